@@ -1,7 +1,26 @@
 import math
+import time
 
 import cv2
 import mediapipe as mp
+import numpy as np
+
+from algorithm_setting import KalmanFilterWrapper
+from profiler import StageTracer
+
+
+class Hand:
+    """
+    Compact record of one detected hand. Landmarks are kept as a (21, 3)
+    array of pixel coordinates, bbox is (x, y, w, h) and center is (cx, cy).
+    """
+    __slots__ = ("type", "lmArray", "bbox", "center")
+
+    def __init__(self, type, lmArray, bbox, center):
+        self.type = type
+        self.lmArray = lmArray
+        self.bbox = bbox
+        self.center = center
 
 
 class HandDetector:
@@ -12,7 +31,9 @@ class HandDetector:
     provides bounding box info of the hand found.
     """
 
-    def __init__(self, staticMode=False, maxHands=2, modelComplexity=1, detectionCon=0.5, minTrackCon=0.5):
+    def __init__(self, staticMode=False, maxHands=2, modelComplexity=1, detectionCon=0.5, minTrackCon=0.5,
+                 processScale=1.0, roiTracking=False, roiSize=256, roiExpand=2.0, roiPredict=False,
+                 fullSearchInterval=30, tracer=None):
 
         """
         :param mode: In static mode, detection is done on each image: slower
@@ -20,44 +41,156 @@ class HandDetector:
         :param modelComplexity: Complexity of the hand landmark model: 0 or 1.
         :param detectionCon: Minimum Detection Confidence Threshold
         :param minTrackCon: Minimum Tracking Confidence Threshold
+        :param processScale: Downscale factor applied before detection (0 - 1.0)
+        :param roiTracking: Run inference on a crop around the tracked hands instead of the full frame
+        :param roiSize: Side of the square the crop is resized to (pixels)
+        :param roiExpand: Crop side relative to the larger side of the tracked box
+        :param roiPredict: Center the crop on a Kalman prediction instead of the last box
+        :param fullSearchInterval: Frames between full-frame searches for new hands
+                                   while fewer than maxHands are tracked (0 to disable)
+        :param tracer: StageTracer timing preprocessing, inference and post-processing
         """
         self.staticMode = staticMode
         self.maxHands = maxHands
         self.modelComplexity = modelComplexity
         self.detectionCon = detectionCon
         self.minTrackCon = minTrackCon
+        self.processScale = processScale
         self.mpHands = mp.solutions.hands
-        self.hands = self.mpHands.Hands(static_image_mode=self.staticMode,
-                                        max_num_hands=self.maxHands,
-                                        model_complexity=modelComplexity,
-                                        min_detection_confidence=self.detectionCon,
-                                        min_tracking_confidence=self.minTrackCon)
+        self.hands = self.createModel()
+
+        # ROI tracking state, boxes are in unmirrored full-frame pixels
+        self.roiTracking = roiTracking
+        self.roiSize = roiSize
+        self.roiExpand = roiExpand
+        self.roiPredict = roiPredict
+        self.fullSearchInterval = fullSearchInterval
+        self.roiHands = None
+        self.roiFilter = None
+        self.trackBox = None
+        self.trackCount = 0
+        self.framesSinceSearch = 0
+        self.roi = None
 
         self.mpDraw = mp.solutions.drawing_utils
+        self.tracer = tracer if tracer is not None else StageTracer(enabled=False)
         self.tipIds = [4, 8, 12, 16, 20]
+        self.tipIdArray = np.array(self.tipIds)
         self.fingers = []
         self.lmList = []
 
-    def findHands(self, img, draw=True, flipType=True):
+        # Preallocated buffers, reused as long as the frame size does not change
+        self.imgSmall = None
+        self.imgRGB = None
+        self.imgMirror = None
+        self.imgRoi = None
+        self.imgRoiRGB = None
+
+    def createModel(self):
+        """
+        :return: New mediapipe Hands instance with the detector settings
+        """
+        return self.mpHands.Hands(static_image_mode=self.staticMode,
+                                  max_num_hands=self.maxHands,
+                                  model_complexity=self.modelComplexity,
+                                  min_detection_confidence=self.detectionCon,
+                                  min_tracking_confidence=self.minTrackCon)
+
+    def setModelComplexity(self, modelComplexity):
+        """
+        Switches the landmark model complexity, rebuilding the models if it changed.
+        :param modelComplexity: 0 or 1
+        """
+        if modelComplexity == self.modelComplexity:
+            return
+        self.modelComplexity = modelComplexity
+        self.hands.close()
+        self.hands = self.createModel()
+        if self.roiHands is not None:
+            self.roiHands.close()
+            self.roiHands = None
+        self.resetTracking()
+
+    def resetTracking(self):
+        """Drops the tracked ROI, the next frame is searched in full"""
+        self.trackBox = None
+        self.trackCount = 0
+        self.roiFilter = None
+
+    def preprocess(self, img):
+        """
+        Converts a BGR frame to the RGB input of the model, optionally
+        downscaled, writing into preallocated buffers instead of
+        allocating new images every frame.
+        :param img: BGR image
+        :return: RGB image owned by the detector (overwritten next frame)
+        """
+        if self.processScale < 1.0:
+            h, w = img.shape[:2]
+            size = (max(1, int(w * self.processScale)), max(1, int(h * self.processScale)))
+            if self.imgSmall is None or self.imgSmall.shape[:2] != (size[1], size[0]):
+                self.imgSmall = np.empty((size[1], size[0], 3), np.uint8)
+            cv2.resize(img, size, dst=self.imgSmall, interpolation=cv2.INTER_LINEAR)
+            img = self.imgSmall
+        if self.imgRGB is None or self.imgRGB.shape != img.shape:
+            self.imgRGB = np.empty_like(img)
+        cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=self.imgRGB)
+        return self.imgRGB
+
+    def mirrorImage(self, img):
+        """
+        Flips an image horizontally into a preallocated buffer.
+        :param img: Image to flip
+        :return: Flipped image owned by the detector (overwritten next frame)
+        """
+        if self.imgMirror is None or self.imgMirror.shape != img.shape:
+            self.imgMirror = np.empty_like(img)
+        cv2.flip(img, 1, dst=self.imgMirror)
+        return self.imgMirror
+
+    def findHands(self, img, draw=True, flipType=True, mirror=False, asArray=False, dtype=np.int32, timestamp=None):
         """
         Finds hands in a BGR image.
         :param img: Image to find the hands in.
         :param draw: Flag to draw the output on the image.
+        :param mirror: Return landmarks as if the image had been flipped
+                       horizontally. The image itself is only flipped when
+                       drawing is requested.
+        :param asArray: Return Hand records with landmark arrays instead of dicts
+        :param dtype: Landmark dtype in array mode (np.int32 or np.float32)
+        :param timestamp: Capture time of the image, steps the ROI prediction by the actual interval
         :return: Image with or without drawings
         """
-        imgRGB = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        self.results = self.hands.process(imgRGB)
-        allHands = []
         h, w, c = img.shape
+        self.results = self.detect(img, timestamp)
+        # The flip is a preprocess span of its own, finished before the postprocess span starts
+        if mirror and draw:
+            with self.tracer.stage("preprocess"):
+                img = self.mirrorImage(img)
+        postStart = time.perf_counter()
+        allHands = []
+        # A mirrored view swaps the handedness reported by the model
+        swapType = flipType != mirror
         if self.results.multi_hand_landmarks:
             for handType, handLms in zip(self.results.multi_handedness, self.results.multi_hand_landmarks):
+                if asArray:
+                    label = handType.classification[0].label
+                    if swapType:
+                        label = "Left" if label == "Right" else "Right"
+                    myHand = self.makeHand(handLms, label, w, h, mirror, dtype)
+                    allHands.append(myHand)
+                    if draw:
+                        self.drawHand(img, myHand.lmArray, myHand.bbox.tolist(), myHand.type, handLms, mirror)
+                    continue
+
                 myHand = {}
                 ## lmList
                 mylmList = []
                 xList = []
                 yList = []
                 for id, lm in enumerate(handLms.landmark):
-                    px, py, pz = int(lm.x * w), int(lm.y * h), int(lm.z * w)
+                    lx = 1.0 - lm.x if mirror else lm.x
+                    px, py, pz = int(lx * w), int(lm.y * h), int(lm.z * w)
                     mylmList.append([px, py, pz])
                     xList.append(px)
                     yList.append(py)
@@ -74,7 +207,7 @@ class HandDetector:
                 myHand["bbox"] = bbox
                 myHand["center"] = (cx, cy)
 
-                if flipType:
+                if swapType:
                     if handType.classification[0].label == "Right":
                         myHand["type"] = "Left"
                     else:
@@ -85,16 +218,178 @@ class HandDetector:
 
                 ## draw
                 if draw:
-                    self.mpDraw.draw_landmarks(img, handLms,
-                                               self.mpHands.HAND_CONNECTIONS)
-                    cv2.rectangle(img, (bbox[0] - 20, bbox[1] - 20),
-                                  (bbox[0] + bbox[2] + 20, bbox[1] + bbox[3] + 20),
-                                  (255, 0, 255), 2)
-                    cv2.putText(img, myHand["type"], (bbox[0] - 30, bbox[1] - 30), cv2.FONT_HERSHEY_PLAIN,
-                                2, (255, 0, 255), 2)
+                    self.drawHand(img, mylmList, bbox, myHand["type"], handLms, mirror)
 
+        if self.roiTracking:
+            self.updateTracking(allHands, w, mirror, timestamp)
+        self.tracer.record("postprocess", postStart, time.perf_counter())
         return allHands, img
 
+    def detect(self, img, timestamp=None):
+        """
+        Runs the model on the ROI around the tracked hands when possible,
+        falling back to a full-frame search when the hands are lost.
+        Landmarks are always returned normalized to the full frame.
+        :param img: BGR image
+        :param timestamp: Capture time of the image, None for one nominal frame interval
+        :return: mediapipe results
+        """
+        self.roi = None
+        if self.roiFilter is not None:
+            self.roiFilter.predict(timestamp)
+        if self.roiTracking and self.trackBox is not None:
+            self.framesSinceSearch += 1
+            needSearch = (self.fullSearchInterval and self.trackCount < self.maxHands
+                          and self.framesSinceSearch >= self.fullSearchInterval)
+            if not needSearch:
+                roi = self.computeRoi(img.shape[1], img.shape[0])
+                with self.tracer.stage("preprocess"):
+                    imgRoi = self.preprocessRoi(img, roi)
+                with self.tracer.stage("hands.process"):
+                    results = self.roiHands.process(imgRoi)
+                if results.multi_hand_landmarks:
+                    self.roi = roi
+                    self.mapLandmarks(results, roi, img.shape[1], img.shape[0])
+                    return results
+
+        self.framesSinceSearch = 0
+        with self.tracer.stage("preprocess"):
+            imgRGB = self.preprocess(img)
+        with self.tracer.stage("hands.process"):
+            return self.hands.process(imgRGB)
+
+    def computeRoi(self, w, h):
+        """
+        Square crop around the tracked box (or its predicted position),
+        clamped to the frame.
+        :return: x, y, side of the crop in pixels
+        """
+        x, y, bw, bh = self.trackBox
+        cx, cy = x + bw / 2, y + bh / 2
+        if self.roiFilter is not None:
+            cx, cy = self.roiFilter.get_state()[:2]
+        side = int(min(max(bw, bh) * self.roiExpand, w, h))
+        side = max(side, 32)
+        x0 = int(min(max(cx - side / 2, 0), w - side))
+        y0 = int(min(max(cy - side / 2, 0), h - side))
+        return x0, y0, side
+
+    def preprocessRoi(self, img, roi):
+        """
+        Crops the ROI and resizes it to the fixed inference size using
+        preallocated buffers.
+        :return: RGB crop owned by the detector (overwritten next frame)
+        """
+        x0, y0, side = roi
+        if self.imgRoi is None:
+            self.imgRoi = np.empty((self.roiSize, self.roiSize, 3), np.uint8)
+            self.imgRoiRGB = np.empty_like(self.imgRoi)
+        cv2.resize(img[y0:y0 + side, x0:x0 + side], (self.roiSize, self.roiSize),
+                   dst=self.imgRoi, interpolation=cv2.INTER_LINEAR)
+        cv2.cvtColor(self.imgRoi, cv2.COLOR_BGR2RGB, dst=self.imgRoiRGB)
+        return self.imgRoiRGB
+
+    def mapLandmarks(self, results, roi, w, h):
+        """
+        Maps landmarks normalized to the ROI back to full-frame normalized
+        coordinates, in place.
+        """
+        x0, y0, side = roi
+        for handLms in results.multi_hand_landmarks:
+            for lm in handLms.landmark:
+                lm.x = (x0 + lm.x * side) / w
+                lm.y = (y0 + lm.y * side) / h
+                lm.z = lm.z * side / w
+
+    def updateTracking(self, allHands, w, mirror=False, timestamp=None):
+        """
+        Stores the union box of the detected hands for the next frame,
+        or drops the track when no hand was found. The ROI filter runs on
+        the capture timestamps, so its velocity is per second whether or
+        not every frame is detected.
+        """
+        if not allHands:
+            self.resetTracking()
+            return
+        boxes = np.array([hand.bbox if isinstance(hand, Hand) else hand["bbox"] for hand in allHands])
+        if mirror:
+            # Track in model coordinates, which are not mirrored
+            boxes[:, 0] = w - boxes[:, 0] - boxes[:, 2]
+        x0, y0 = boxes[:, 0].min(), boxes[:, 1].min()
+        x1, y1 = (boxes[:, 0] + boxes[:, 2]).max(), (boxes[:, 1] + boxes[:, 3]).max()
+        self.trackBox = (int(x0), int(y0), int(x1 - x0), int(y1 - y0))
+        self.trackCount = len(allHands)
+        if self.roiHands is None:
+            self.roiHands = self.createModel()
+        if self.roiPredict:
+            center = np.array([(x0 + x1) / 2, (y0 + y1) / 2])
+            if self.roiFilter is None:
+                self.roiFilter = KalmanFilterWrapper()
+                self.roiFilter.kf.x[:2] = center
+                # The next step is timed from this detection
+                self.roiFilter.clock.step(timestamp)
+            self.roiFilter.update(center)
+
+    def makeHand(self, handLms, handType, w, h, mirror=False, dtype=np.int32):
+        """
+        Builds a Hand record from the model output with vectorized
+        pixel conversion, bbox and center.
+        :param handLms: Normalized landmarks of one hand
+        :param handType: "Left" or "Right"
+        :param w: Image width
+        :param h: Image height
+        :param mirror: Mirror the x coordinates
+        :param dtype: Landmark dtype (np.int32 or np.float32)
+        :return: Hand record
+        """
+        lm = np.array([(p.x, p.y, p.z) for p in handLms.landmark], np.float32)
+        if mirror:
+            lm[:, 0] = 1.0 - lm[:, 0]
+        lm *= (w, h, w)
+        lmArray = lm.astype(dtype)
+        xymin = lm[:, :2].min(axis=0).astype(np.int32)
+        xymax = lm[:, :2].max(axis=0).astype(np.int32)
+        size = xymax - xymin
+        bbox = np.concatenate((xymin, size))
+        center = xymin + size // 2
+        return Hand(handType, lmArray, bbox, center)
+
+    def drawHand(self, img, lmList, bbox, handType, handLms=None, mirror=False):
+        """
+        Draws the landmarks, bounding box and type label of one hand.
+        :param img: Image to draw on
+        :param lmList: Pixel landmarks (list or array)
+        :param bbox: Bounding box (x, y, w, h)
+        :param handType: "Left" or "Right"
+        :param handLms: Normalized model landmarks, drawn with mediapipe when given and not mirrored
+        :param mirror: Landmarks are mirrored relative to the model output
+        """
+        if handLms is not None and not mirror:
+            self.mpDraw.draw_landmarks(img, handLms,
+                                       self.mpHands.HAND_CONNECTIONS)
+        else:
+            self.drawLandmarks(img, lmList)
+        cv2.rectangle(img, (bbox[0] - 20, bbox[1] - 20),
+                      (bbox[0] + bbox[2] + 20, bbox[1] + bbox[3] + 20),
+                      (255, 0, 255), 2)
+        cv2.putText(img, handType, (bbox[0] - 30, bbox[1] - 30), cv2.FONT_HERSHEY_PLAIN,
+                    2, (255, 0, 255), 2)
+        return img
+
+    def drawLandmarks(self, img, lmList):
+        """
+        Draws landmarks and connections from pixel coordinates, used when the
+        landmarks no longer match the model's normalized output (mirrored).
+        :param img: Image to draw on
+        :param lmList: List or array of [x, y, z] pixel landmarks
+        """
+        points = [tuple(p) for p in np.asarray(lmList)[:, :2].astype(int).tolist()]
+        for start, end in self.mpHands.HAND_CONNECTIONS:
+            cv2.line(img, points[start], points[end], (224, 224, 224), 2)
+        for point in points:
+            cv2.circle(img, point, 3, (0, 0, 255), cv2.FILLED)
+        return img
+
     def fingersUp(self, myHand):
         """
         Finds how many fingers are open and returns in a list.
@@ -126,6 +421,43 @@ class HandDetector:
                     fingers.append(0)
         return fingers
 
+    def fingersUpArray(self, lmArray, handType):
+        """
+        Vectorized fingersUp working directly on landmark arrays.
+        Accepts a single hand or a batch of hands.
+        :param lmArray: (21, 3) or (N, 21, 3) landmark array
+        :param handType: "Left"/"Right", or a sequence of N of them
+        :return: (5,) or (N, 5) int array, 1 where the finger is up
+        """
+        lm = np.asarray(lmArray)
+        single = lm.ndim == 2
+        if single:
+            lm = lm[None]
+            handType = [handType]
+        isRight = np.array([t == "Right" for t in handType])
+
+        fingers = np.empty((lm.shape[0], 5), np.int32)
+        # Thumb compares x against the joint below, mirrored for left hands
+        thumbTip, thumbIp = lm[:, self.tipIds[0], 0], lm[:, self.tipIds[0] - 1, 0]
+        fingers[:, 0] = np.where(isRight, thumbTip <= thumbIp, thumbTip >= thumbIp)
+        # 4 Fingers: tip above the pip joint
+        fingers[:, 1:] = lm[:, self.tipIdArray[1:], 1] < lm[:, self.tipIdArray[1:] - 2, 1]
+        return fingers[0] if single else fingers
+
+    def findDistanceArray(self, p1, p2):
+        """
+        Vectorized findDistance for arrays of points, without drawing.
+        :param p1: (..., 2) array of first points
+        :param p2: (..., 2) array of second points
+        :return: Distances (...,) and info (..., 6) as (x1, y1, x2, y2, cx, cy)
+        """
+        p1 = np.asarray(p1)[..., :2]
+        p2 = np.asarray(p2)[..., :2]
+        diff = p2 - p1
+        length = np.hypot(diff[..., 0], diff[..., 1])
+        info = np.concatenate((p1, p2, (p1 + p2) // 2), axis=-1)
+        return length, info
+
     def findDistance(self, p1, p2, img=None, color=(255, 0, 255), scale=5):
         """
         Find the distance between two landmarks input should be (x1,y1) (x2,y2)
@@ -1,26 +1,74 @@
+import copy
+import functools
+import json
+import math
+import queue
+import threading
+import time
+from collections import deque
+
 import numpy as np
-from filterpy.kalman import ExtendedKalmanFilter, KalmanFilter
+from filterpy.kalman import KalmanFilter
+
+class FrameClock:
+    """
+    Time step between measurements, taken from their capture timestamps.
+    The step is clamped to [min_dt, max_dt], so a long dropout does not
+    extrapolate far, and quantized so per-dt matrices can be cached.
+    Without timestamps the nominal dt is used.
+    """
+
+    def __init__(self, dt=1/30.0, min_dt=0.002, max_dt=0.1, quantum=0.0005):
+        """
+        :param dt: Nominal time step.
+        :param min_dt: Smallest time step.
+        :param max_dt: Largest time step.
+        :param quantum: Resolution of the time step.
+        """
+        self.dt = dt
+        self.min_dt = min_dt
+        self.max_dt = max_dt
+        self.quantum = quantum
+        self.last_time = None
+
+    def step(self, timestamp=None):
+        """
+        :param timestamp: Capture time of the new measurement (seconds), or None.
+        :return: Time step since the previous measurement.
+        """
+        if timestamp is None:
+            return self.dt
+        last, self.last_time = self.last_time, timestamp
+        if last is None:
+            return self.dt
+        dt = min(max(timestamp - last, self.min_dt), self.max_dt)
+        return round(dt / self.quantum) * self.quantum
 
 class LowPassFilter:
-    def __init__(self, alpha=0.2):
+    def __init__(self, alpha=0.2, dt=1/30.0):
         """
         Initialize the low-pass filter.
 
         :param alpha: Filter coefficient, range [0, 1], default value is 0.2.
+        :param dt: Time step alpha is meant for, default value is 1/30.0.
         """
         self.alpha = alpha
         self.prev_value = None
+        self.clock = FrameClock(dt)
 
-    def filter(self, data):
+    def filter(self, data, timestamp=None):
         """
         Apply low-pass filtering to the input data.
 
         :param data: Input data.
+        :param timestamp: Capture time, alpha is adapted to the actual time step.
         :return: Filtered data.
         """
+        dt = self.clock.step(timestamp)
+        alpha = self.alpha if dt == self.clock.dt else 1 - (1 - self.alpha) ** (dt / self.clock.dt)
         if self.prev_value is None:
             self.prev_value = data
-        filtered = self.alpha * data + (1 - self.alpha) * self.prev_value
+        filtered = alpha * data + (1 - alpha) * self.prev_value
         self.prev_value = filtered
         return filtered
 
@@ -28,114 +76,366 @@ class MovingAverageFilter:
     def __init__(self, window_size=5):
         """
         Initialize the moving average filter.
+        Works on scalars or on vectors such as an (x, y) point, keeping the
+        window in a ring buffer with a running sum.
 
         :param window_size: Size of the sliding window, default value is 5.
         """
         self.window_size = window_size
-        self.history = []
+        self.reset()
 
-    def filter(self, new_point):
+    def reset(self):
+        self.history = None
+        self.sum = None
+        self.index = 0
+        self.count = 0
+        self.updates = 0
+
+    def _init_buffer(self, shape):
+        self.history = np.zeros((self.window_size,) + shape)
+        self.sum = np.zeros(shape)
+
+    def filter(self, new_point, timestamp=None):
         """
         Apply moving average filtering to the new data point.
 
-        :param new_point: New data point.
+        :param new_point: New data point (scalar or vector).
+        :param timestamp: Unused, the window counts samples.
         :return: Filtered value.
         """
-        self.history.append(new_point)
-        if len(self.history) > self.window_size:
-            self.history.pop(0)
-        return np.mean(self.history)
+        point = np.asarray(new_point, dtype=float)
+        if self.history is None:
+            self._init_buffer(point.shape)
+        if self.count == self.window_size:
+            self.sum -= self.history[self.index]
+        else:
+            self.count += 1
+        self.history[self.index] = point
+        self.sum += point
+        self.index = (self.index + 1) % self.window_size
+        self.updates += 1
+        if self.updates % 4096 == 0:
+            # Recompute now and then so rounding errors cannot accumulate
+            self.sum = self.history.sum(axis=0)
+        return self.sum / self.count
 
-class ExtendedKalmanFilterWrapper:
-    def __init__(self, dt=1/30.0):
-        self.ekf = ExtendedKalmanFilter(dim_x=5, dim_z=2)  # State dimension changed to 5 [x, y, v, θ, ω]
-        # Initial state [x, y, velocity, heading, turn_rate]
-        self.ekf.x = np.array([0., 0., 0., 0., 0.])
-        # Adjust the initial state covariance matrix to reflect the uncertainty of different states
-        self.ekf.P = np.diag([100, 100, 10, 100, 100])  # Greater uncertainty in position and angle
-        # Observation noise (keep 2x2)
-        self.ekf.R = np.array([[0.05, 0], [0, 0.05]])
-        # Optimize the process noise matrix
-        self.ekf.Q = np.diag([0.1, 0.1, 0.5, 1.0, 1.0])  # Greater noise in velocity, angle, and angular velocity
-        self.ekf.dt = dt
-
-    def f(self, x):
-        dt = self.ekf.dt
-        v, θ, ω = x[2], x[3], x[4]
-        
-        # CTRV motion model
-        if abs(ω) < 1e-5:  # Handle the case of zero angular velocity
-            return np.array([
-                x[0] + v * np.cos(θ) * dt,
-                x[1] + v * np.sin(θ) * dt,
-                v,
-                θ,
-                ω
-            ])
-        
-        return np.array([
-            x[0] + (v/ω)*(np.sin(θ + ω*dt) - np.sin(θ)),
-            x[1] + (v/ω)*(np.cos(θ) - np.cos(θ + ω*dt)),
-            v,
-            θ + ω*dt,
-            ω
-        ])
-
-    def jacobian_f(self, x):
-        dt = self.ekf.dt
-        v, θ, ω = x[2], x[3], x[4]
-        
-        F = np.eye(5)
-        if abs(ω) < 1e-5:  # Jacobian for zero angular velocity
-            F[0, 2] = dt * np.cos(θ)
-            F[0, 3] = -v * dt * np.sin(θ)
-            F[1, 2] = dt * np.sin(θ)
-            F[1, 3] = v * dt * np.cos(θ)
-        else:  # Jacobian for non-zero angular velocity
-            dθ = ω * dt
-            F[0, 2] = (np.sin(θ + dθ) - np.sin(θ)) / ω
-            F[0, 3] = v/ω * (np.cos(θ + dθ) - np.cos(θ))
-            F[0, 4] = (v*dt*np.cos(θ + dθ) - F[0, 2]) / ω
-            
-            F[1, 2] = (np.cos(θ) - np.cos(θ + dθ)) / ω
-            F[1, 3] = v/ω * (np.sin(θ + dθ) - np.sin(θ))
-            F[1, 4] = (v*dt*np.sin(θ + dθ) - F[1, 2]) / ω
-            
+    def filter_many(self, points):
+        """
+        Filter a whole trajectory in one vectorized pass using cumulative
+        sums. Continues from, and updates, the current window, so it gives
+        the same result as calling filter on each point in turn.
+
+        :param points: Array of shape (T,) or (T, D).
+        :return: Filtered array of the same shape.
+        """
+        points = np.asarray(points, dtype=float)
+        if len(points) == 0:
+            return points.copy()
+        if self.history is None:
+            self._init_buffer(points.shape[1:])
+        # Current window in chronological order, followed by the new points
+        order = (self.index - self.count + np.arange(self.count)) % self.window_size
+        series = np.concatenate((self.history[order], points))
+        cumsum = np.concatenate((np.zeros((1,) + points.shape[1:]), np.cumsum(series, axis=0)))
+
+        end = np.arange(self.count, len(series)) + 1
+        start = np.maximum(end - self.window_size, 0)
+        counts = (end - start).reshape((-1,) + (1,) * (points.ndim - 1))
+        filtered = (cumsum[end] - cumsum[start]) / counts
+
+        # Keep the last window as the new state
+        tail = series[-self.window_size:]
+        self.count = len(tail)
+        self.history[:self.count] = tail
+        self.index = self.count % self.window_size
+        self.sum = tail.sum(axis=0)
+        self.updates += len(points)
+        return filtered
+
+class CTRVFilter:
+    """
+    Extended Kalman filter with the CTRV (constant turn rate and velocity)
+    model for N tracks at once. The state of the tracks is kept in an
+    (N, 5) array [x, y, v, θ, ω] with (N, 5, 5) covariances, and position
+    measurements come in as (N, 2). The transition and its Jacobian are
+    computed together from the same sin/cos values, and the matrix
+    products write into preallocated arrays.
+    """
+
+    def __init__(self, n=1, dt=1/30.0, P=(100, 100, 10, 100, 100), Q=(0.1, 0.1, 0.5, 1.0, 1.0), R=0.05):
+        """
+        :param n: Number of tracks.
+        :param dt: Nominal time step, Q is scaled for other steps.
+        :param P: Diagonal of the initial state covariance.
+        :param Q: Diagonal of the process noise at the nominal time step.
+        :param R: Variance of the position measurements.
+        """
+        self.n = n
+        self.dt = self.dt0 = dt
+        self.x = np.zeros((n, 5))
+        self.P = np.tile(np.diag(np.asarray(P, dtype=float)), (n, 1, 1))
+        self.Q = self.Q0 = np.diag(np.asarray(Q, dtype=float))
+        self.Qcache = {dt: self.Q}
+        self.R = np.tile(np.eye(2) * R, (n, 1, 1))
+
+        # Preallocated work arrays
+        self.F = np.tile(np.eye(5), (n, 1, 1))
+        self.FP = np.empty((n, 5, 5))
+        self.S = np.empty((n, 2, 2))
+        self.Sinv = np.empty((n, 2, 2))
+        self.K = np.empty((n, 5, 2))
+        self.KHP = np.empty((n, 5, 5))
+        self.y = np.empty((n, 2))
+        self.det = np.empty(n)
+        self.sin0, self.cos0 = np.empty(n), np.empty(n)
+        self.sin1, self.cos1 = np.empty(n), np.empty(n)
+        self.a, self.b = np.empty(n), np.empty(n)
+        self.tmp = np.empty(n)
+
+    def predict(self, dt=None):
+        """
+        Propagate all tracks by one time step with the non-linear model.
+
+        :param dt: Time step, defaults to the last one used.
+        """
+        if dt is not None and dt != self.dt:
+            self.set_dt(dt)
+        if self.n == 1:
+            self._transition_one()
+        else:
+            self._transition()
+        # P = F P Fᵀ + Q
+        np.matmul(self.F, self.P, out=self.FP)
+        np.matmul(self.FP, self.F.transpose(0, 2, 1), out=self.P)
+        self.P += self.Q
+
+    def set_dt(self, dt):
+        # Process noise grows with the time step, scaled from the nominal one
+        self.dt = dt
+        self.Q = self.Qcache.get(dt)
+        if self.Q is None:
+            self.Q = self.Qcache[dt] = self.Q0 * (dt / self.dt0)
+
+    def _transition_one(self):
+        # Single track on Python floats, cheaper than array calls for one state
+        dt, x, F = self.dt, self.x[0], self.F[0]
+        v, θ, ω = float(x[2]), float(x[3]), float(x[4])
+        sin0, cos0 = math.sin(θ), math.cos(θ)
+        if abs(ω) < 1e-5:
+            # Straight line (zero turn rate)
+            a, b = dt * cos0, dt * sin0
+            F[0, 4] = F[1, 4] = F[3, 4] = 0.0
+        else:
+            sin1, cos1 = math.sin(θ + ω * dt), math.cos(θ + ω * dt)
+            a, b = (sin1 - sin0) / ω, (cos0 - cos1) / ω
+            F[0, 4] = (v * dt * cos1 - a) / ω
+            F[1, 4] = (v * dt * sin1 - b) / ω
             F[3, 4] = dt
-            
-        return F
+            x[3] = θ + ω * dt
+        F[0, 2], F[1, 2] = a, b
+        F[0, 3], F[1, 3] = -v * b, v * a
+        x[0] += v * a
+        x[1] += v * b
+
+    def _transition(self):
+        dt, x, F = self.dt, self.x, self.F
+        v, θ, ω = x[:, 2], x[:, 3], x[:, 4]
+        sin0, cos0, sin1, cos1, a, b, tmp = self.sin0, self.cos0, self.sin1, self.cos1, self.a, self.b, self.tmp
+
+        np.sin(θ, out=sin0)
+        np.cos(θ, out=cos0)
+        np.multiply(ω, dt, out=tmp)
+        tmp += θ
+        np.sin(tmp, out=sin1)
+        np.cos(tmp, out=cos1)
+
+        straight = np.abs(ω) < 1e-5
+        # Turning: a = (sin(θ + ωdt) - sin θ) / ω, b = (cos θ - cos(θ + ωdt)) / ω
+        ωSafe = np.where(straight, 1.0, ω)
+        np.subtract(sin1, sin0, out=a)
+        a /= ωSafe
+        np.subtract(cos0, cos1, out=b)
+        b /= ωSafe
+        # Straight line (zero turn rate): the limits dt·cos θ and dt·sin θ
+        a[straight] = dt * cos0[straight]
+        b[straight] = dt * sin0[straight]
+
+        # Jacobian at the current state
+        F[:, 0, 2] = a
+        F[:, 1, 2] = b
+        np.multiply(v, b, out=tmp)
+        np.negative(tmp, out=F[:, 0, 3])
+        np.multiply(v, a, out=F[:, 1, 3])
+        np.multiply(v * dt, cos1, out=tmp)
+        tmp -= a
+        np.divide(tmp, ωSafe, out=F[:, 0, 4])
+        np.multiply(v * dt, sin1, out=tmp)
+        tmp -= b
+        np.divide(tmp, ωSafe, out=F[:, 1, 4])
+        F[:, 3, 4] = dt
+        if straight.any():
+            F[straight, 0, 4] = 0.0
+            F[straight, 1, 4] = 0.0
+            F[straight, 3, 4] = 0.0
 
-    def predict(self):
-        self.ekf.f = self.f
-        # Calculate the Jacobian matrix at the current state and assign it to ekf.F
-        self.ekf.F = self.jacobian_f(self.ekf.x)
-        # Call the predict method without passing the dt parameter
-        self.ekf.predict()
+        # Mean through the non-linear transition, heading only turns when ω is not zero
+        x[:, 0] += v * a
+        x[:, 1] += v * b
+        np.multiply(ω, dt, out=tmp)
+        tmp[straight] = 0.0
+        x[:, 3] += tmp
+
+    def update(self, z, mask=None):
+        """
+        Correct the tracks with position measurements.
+
+        :param z: (N, 2) measured positions.
+        :param mask: Optional (N,) boolean array, only these tracks are updated.
+        """
+        P, S, Sinv, K = self.P, self.S, self.Sinv, self.K
+        np.subtract(z, self.x[:, :2], out=self.y)
+        np.add(P[:, :2, :2], self.R, out=S)
 
-    def h(self, x):
-        return x[:2]
+        # Closed-form inverse of the 2x2 innovation covariances
+        if self.n == 1:
+            (s00, s01), (s10, s11) = S[0].tolist()
+            det = s00 * s11 - s01 * s10
+            Sinv[0] = ((s11 / det, -s01 / det), (-s10 / det, s00 / det))
+        else:
+            np.multiply(S[:, 0, 0], S[:, 1, 1], out=self.det)
+            self.det -= S[:, 0, 1] * S[:, 1, 0]
+            Sinv[:, 0, 0] = S[:, 1, 1]
+            Sinv[:, 1, 1] = S[:, 0, 0]
+            np.negative(S[:, 0, 1], out=Sinv[:, 0, 1])
+            np.negative(S[:, 1, 0], out=Sinv[:, 1, 0])
+            Sinv /= self.det[:, None, None]
 
-    def H(self, x):
-        return np.array([[1, 0, 0, 0, 0],
-                         [0, 1, 0, 0, 0]])
+        # K = P Hᵀ S⁻¹, x += K y, P -= K H P
+        np.matmul(P[:, :, :2], Sinv, out=K)
+        if mask is not None:
+            K[~np.asarray(mask)] = 0.0
+        self.x += np.matmul(K, self.y[:, :, None])[:, :, 0]
+        np.matmul(K, P[:, :2, :], out=self.KHP)
+        P -= self.KHP
+        # Keep the covariances symmetric against rounding
+        np.add(P, P.transpose(0, 2, 1), out=self.FP)
+        np.multiply(self.FP, 0.5, out=P)
+
+    def filter(self, z, mask=None, dt=None):
+        """
+        Predict and update all tracks.
+
+        :param z: (N, 2) measured positions.
+        :param mask: Optional (N,) boolean array of tracks with a measurement.
+        :param dt: Time step, defaults to the last one used.
+        :return: (N, 2) filtered positions.
+        """
+        self.predict(dt)
+        self.update(z, mask)
+        return self.x[:, :2].copy()
+
+class ExtendedKalmanFilterWrapper:
+    def __init__(self, dt=1/30.0, P=(100, 100, 10, 100, 100), Q=(0.1, 0.1, 0.5, 1.0, 1.0), R=0.05):
+        """
+        Initialize the extended Kalman filter for one cursor, using a single track of CTRVFilter.
+        State [x, y, velocity, heading, turn_rate].
+
+        :param dt: Time step, default value is 1/30.0.
+        :param P: Diagonal of the initial state covariance.
+        :param Q: Diagonal of the process noise.
+        :param R: Variance of the position measurements.
+        """
+        # Greater uncertainty in position and angle, greater noise in velocity, angle and angular velocity
+        self.engine = CTRVFilter(n=1, dt=dt, P=P, Q=Q, R=R)
+        self.R0 = R
+        self.z = np.empty((1, 2))
+        self.clock = FrameClock(dt)
+
+    def predict(self, timestamp=None):
+        self.engine.predict(self.clock.step(timestamp))
 
     def update(self, z, velocity=None):
         # Dynamically adjust the observation noise based on velocity
         if velocity is not None:
             noise_scale = 1 + 0.1 * velocity  # Higher velocity leads to greater noise
-            self.ekf.R = np.array([[0.05 * noise_scale, 0], [0, 0.05 * noise_scale]])
-        self.ekf.update(z, HJacobian=self.H, Hx=self.h)
+            self.engine.R[0] = np.eye(2) * self.R0 * noise_scale
+        self.z[0] = z
+        self.engine.update(self.z)
 
     def get_state(self):
-        return self.ekf.x
+        return self.engine.x[0]
+
+    def filter(self, z, timestamp=None):
+        """
+        Predict and update with one measurement.
+
+        :param z: Measured (x, y) position.
+        :param timestamp: Capture time of the measurement, sets the time step.
+        :return: Filtered (x, y) position.
+        """
+        self.predict(timestamp)
+        self.update(z)
+        return self.engine.x[0, :2].copy()
+
+@functools.lru_cache(maxsize=32)
+def steady_state_gain(dt, q, r, tol=1e-12, max_iter=100000):
+    """
+    Solve the discrete algebraic Riccati equation of the constant-velocity
+    model by iterating the covariance recursion until it stops changing.
+    Results are cached per (dt, Q, R).
+
+    :param dt: Time step.
+    :param q: Process noise Q as a tuple of rows.
+    :param r: Observation noise R as a tuple of rows.
+    :return: Steady-state gain K (4x2) and the prior and posterior covariances.
+    """
+    F = np.array([[1, 0, dt, 0],
+                  [0, 1, 0, dt],
+                  [0, 0, 1, 0],
+                  [0, 0, 0, 1]])
+    H = np.array([[1., 0, 0, 0],
+                  [0, 1, 0, 0]])
+    Q, R = np.array(q), np.array(r)
+    P = Q.copy()
+    for _ in range(max_iter):
+        prior = F @ P @ F.T + Q
+        K = prior @ H.T @ np.linalg.inv(H @ prior @ H.T + R)
+        posterior = (np.eye(4) - K @ H) @ prior
+        if np.abs(posterior - P).max() <= tol * np.abs(posterior).max():
+            break
+        P = posterior
+    K.flags.writeable = prior.flags.writeable = posterior.flags.writeable = False
+    return K, prior, posterior
 
 class KalmanFilterWrapper:
-    def __init__(self, dt=1/30.0):
+    # Time steps, relative to the nominal one, the steady-state gain is precomputed for
+    GAIN_BINS = (0.5, 0.75, 1.0, 1.25, 1.5, 2.0, 3.0)
+    # Largest relative distance of a time step from a bin for the bin's gain to be used
+    GAIN_BIN_TOL = 0.1
+
+    def __init__(self, dt=1/30.0, steady_state=False, warmup=30, gain_tol=1e-3, P=1000, Q=0.01, R=0.05):
         """
         Initialize the standard Kalman filter.
 
-        :param dt: Time step, default value is 1/30.0.
+        With steady_state, the filter runs the full covariance recursion for
+        at least `warmup` frames, until its gain is within `gain_tol` of the
+        steady-state gain. From then on it applies that constant gain with a
+        few multiply-adds per frame. The gains are solved once, at
+        construction, for a few time steps (GAIN_BINS); a frame whose step is
+        not close to one of them runs the full recursion instead.
+
+        :param dt: Nominal time step, default value is 1/30.0. F and Q follow the
+            time step measured from the timestamps passed to predict.
+        :param steady_state: Switch to the steady-state gain after the warm-up.
+        :param warmup: Minimum number of full updates before switching.
+        :param gain_tol: Relative gain difference below which the filter switches.
+        :param P: Initial state variance.
+        :param Q: Process noise variance at the nominal time step.
+        :param R: Variance of the position measurements.
         """
+        self.dt = self.dt0 = dt
+        self.clock = FrameClock(dt)
+        self.models = {}
         self.kf = KalmanFilter(dim_x=4, dim_z=2)
         # Initial state [x, y, vx, vy]
         self.kf.x = np.array([0., 0., 0., 0.])
@@ -148,17 +448,90 @@ class KalmanFilterWrapper:
         self.kf.H = np.array([[1, 0, 0, 0],
                               [0, 1, 0, 0]])
         # State covariance matrix (initial uncertainty)
-        self.kf.P = np.eye(4) * 1000
+        self.kf.P = np.eye(4) * P
         # Observation noise
-        self.kf.R = np.array([[0.05, 0],
-                              [0, 0.05]])
+        self.kf.R = np.eye(2) * R
         # Process noise
-        self.kf.Q = np.eye(4) * 0.01
+        self.kf.Q = self.Q0 = np.eye(4) * Q
+
+        self.steady_state = steady_state
+        self.warmup = warmup
+        self.gain_tol = gain_tol
+        self.updates = 0
+        self.converged = False
+        self.gain = None
+        self.fallbacks = 0
+        # Steady-state gain and posterior per bin time step, solved here and never in the frame loop
+        self.gains = {}
+        if steady_state:
+            r = tuple(map(tuple, self.kf.R.tolist()))
+            for b in self.GAIN_BINS:
+                bin_dt = min(max(dt * b, self.clock.min_dt), self.clock.max_dt)
+                K, _, posterior = steady_state_gain(bin_dt, self._model(bin_dt)['q'], r)
+                self.gains[bin_dt] = (K, posterior)
+        self.bins = np.array(sorted(self.gains))
+        self.bin = self._bin(dt)
+
+    def _model(self, dt):
+        # F and Q per time step, Q scaled from the nominal step
+        model = self.models.get(dt)
+        if model is None:
+            F = np.array([[1, 0, dt, 0],
+                          [0, 1, 0, dt],
+                          [0, 0, 1, 0],
+                          [0, 0, 0, 1]])
+            Q = self.Q0 * (dt / self.dt0)
+            model = self.models[dt] = {'F': F, 'Q': Q, 'q': tuple(map(tuple, Q.tolist()))}
+        return model
+
+    def _bin(self, dt):
+        # Bin time step whose gain applies to dt, None when no bin is close enough
+        if not len(self.bins):
+            return None
+        b = float(self.bins[np.argmin(np.abs(self.bins - dt))])
+        return b if abs(dt - b) <= self.GAIN_BIN_TOL * b else None
+
+    def set_dt(self, dt):
+        model = self._model(dt)
+        self.dt = dt
+        self.kf.F = model['F']
+        self.kf.Q = model['Q']
+        self.bin = self._bin(dt)
+        if self.converged:
+            self.gain = self.gains[self.bin][0].tolist() if self.bin is not None else None
 
-    def predict(self):
+    def gain_gap(self):
+        """
+        :return: Relative difference between the current gain and the steady-state gain,
+            infinite when the time step has no precomputed gain.
+        """
+        if self.converged:
+            return 0.0
+        if self.bin is None:
+            return np.inf
+        K_ss = self.gains[self.bin][0]
+        return np.linalg.norm(self.kf.K - K_ss) / np.linalg.norm(K_ss)
+
+    def predict(self, timestamp=None):
         """
         Perform the prediction step of the Kalman filter.
+
+        :param timestamp: Capture time of the next measurement, sets the time step.
         """
+        dt = self.clock.step(timestamp)
+        if dt != self.dt:
+            self.set_dt(dt)
+        if self.converged:
+            if self.gain is not None:
+                # Constant velocity, covariance no longer propagated
+                x = self.kf.x
+                x[0] += self.dt * x[2]
+                x[1] += self.dt * x[3]
+                return
+            # Unusual time step: one full step, starting from the nearest bin's steady state
+            self.fallbacks += 1
+            nearest = float(self.bins[np.argmin(np.abs(self.bins - self.dt))])
+            self.kf.P = self.gains[nearest][1].copy()
         self.kf.predict()
 
     def update(self, z):
@@ -167,7 +540,28 @@ class KalmanFilterWrapper:
 
         :param z: Observation value.
         """
+        if self.converged and self.gain is not None:
+            x = self.kf.x
+            x0, x1, x2, x3 = x.tolist()
+            y0, y1 = float(z[0]) - x0, float(z[1]) - x1
+            (k00, k01), (k10, k11), (k20, k21), (k30, k31) = self.gain
+            x[:] = (x0 + k00 * y0 + k01 * y1, x1 + k10 * y0 + k11 * y1,
+                    x2 + k20 * y0 + k21 * y1, x3 + k30 * y0 + k31 * y1)
+            return
         self.kf.update(z)
+        self.updates += 1
+        if self.steady_state and not self.converged and self.updates >= self.warmup:
+            gap = self.gain_gap()
+            if gap < self.gain_tol:
+                self.converge(gap)
+
+    def converge(self, gap):
+        K, posterior = self.gains[self.bin]
+        self.gain = K.tolist()
+        self.kf.K = K.copy()
+        self.kf.P = posterior.copy()
+        self.converged = True
+        print(f"Kalman filter switched to the steady-state gain after {self.updates} updates (gain gap {gap:.1e})")
 
     def get_state(self):
         """
@@ -177,36 +571,629 @@ class KalmanFilterWrapper:
         """
         return self.kf.x
 
-class PerformanceEvaluator:
+    def get_velocity(self):
+        """
+        :return: Velocity (vx, vy) and the variance of its magnitude.
+        """
+        P = self.kf.P
+        return float(self.kf.x[2]), float(self.kf.x[3]), 0.5 * float(P[2, 2] + P[3, 3])
+
+    def filter(self, z, timestamp=None):
+        """
+        Predict and update with one measurement.
+
+        :param z: Measured (x, y) position.
+        :param timestamp: Capture time of the measurement, sets the time step.
+        :return: Filtered (x, y) position.
+        """
+        self.predict(timestamp)
+        self.update(z)
+        return self.kf.x[:2].copy()
+
+FILTERS = {
+    'lowpass': LowPassFilter,
+    'ekf': ExtendedKalmanFilterWrapper,
+    'moving_avg': MovingAverageFilter,
+    'kf': KalmanFilterWrapper
+}
+
+def make_filter(name, dt=1/30.0, **options):
+    """
+    Create a position filter by name. All of them filter an (x, y) point
+    with filter(z).
+
+    :param name: One of the keys of FILTERS.
+    :param dt: Nominal time step.
+    :param options: Extra keyword arguments for the filter class.
+    :return: Filter instance.
+    """
+    if name not in FILTERS:
+        raise ValueError(f"Unknown filter '{name}', expected one of {list(FILTERS)}")
+    if name == 'moving_avg':
+        return FILTERS[name](**options)
+    return FILTERS[name](dt=dt, **options)
+
+def load_filter_profile(path):
+    """
+    Load filter parameters written by tuner.py.
+
+    :param path: Profile (.json).
+    :return: Dict of make_filter options per filter name.
+    """
+    with open(path) as f:
+        profile = json.load(f)
+    options = profile.get('filters', {})
+    for name in options:
+        if name not in FILTERS:
+            raise ValueError(f"Unknown filter '{name}' in {path}, expected one of {list(FILTERS)}")
+    return options
+
+def estimate_lag(reference, signal, dt=1/30.0, max_lag=0.5):
+    """
+    Delay of a filtered path behind its reference, from the peak of the
+    cross-correlation of their frame-to-frame velocities, refined to a
+    fraction of a frame by a parabola through the peak.
+
+    :param reference: (N, 2) or (N,) reference path (truth or raw measurements).
+    :param signal: Filtered path of the same shape.
+    :param dt: Time step between samples.
+    :param max_lag: Largest lag searched (seconds).
+    :return: Lag in seconds, positive when the signal trails the reference.
+    """
+    ref = np.diff(np.asarray(reference, dtype=float), axis=0).reshape(len(reference) - 1, -1)
+    sig = np.diff(np.asarray(signal, dtype=float), axis=0).reshape(len(signal) - 1, -1)
+    n = len(ref)
+    max_k = min(int(round(max_lag / dt)), n // 2)
+    if max_k < 1:
+        return 0.0
+    # Normalized correlation per lag k between ref[t] and sig[t + k], negative lags included
+    # so that a peak at zero can be refined too
+    lags = np.arange(-max_k, max_k + 1)
+    corr = np.empty(len(lags))
+    for i, k in enumerate(lags):
+        a = ref[max(0, -k):n - max(0, k)]
+        b = sig[max(0, k):n - max(0, -k)]
+        norm = np.sqrt(np.sum(a * a) * np.sum(b * b))
+        corr[i] = np.sum(a * b) / norm if norm else 0.0
+    i = int(np.argmax(corr))
+    offset = 0.0
+    if 0 < i < len(lags) - 1:
+        denom = corr[i - 1] - 2 * corr[i] + corr[i + 1]
+        if denom < 0:
+            offset = 0.5 * (corr[i - 1] - corr[i + 1]) / denom
+    k = lags[i]
+    return (k + offset) * dt
+
+class RunningStat:
+    """
+    Running count, mean, variance (Welford) and max of a stream of values,
+    in constant time and memory per sample.
+    """
+    __slots__ = ('count', 'mean', 'm2', 'max')
+
     def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if self.count == 1 or value > self.max:
+            self.max = value
+
+    def std(self):
+        return np.sqrt(self.m2 / self.count) if self.count else 0.0
+
+
+class WindowStat:
+    """
+    Mean and max of the values of the last `window` seconds, kept in a
+    fixed-size ring buffer. The windowed sum is updated as values enter and
+    expire, and the max comes from a monotonic queue, so both are read in
+    constant time. Values expire when a new one is added or on expire(),
+    which readers call with the current time so a stream that stopped
+    does not report stale values.
+    """
+
+    def __init__(self, window=5.0, capacity=1024):
+        """
+        :param window: Window length (seconds)
+        :param capacity: Maximum number of values in the window
+        """
+        self.window = window
+        self.capacity = capacity
+        self.times = np.zeros(capacity)
+        self.values = np.zeros(capacity)
+        self.start = 0
+        self.size = 0
+        self.seq = 0
+        self.sum = 0.0
+        self.maxQueue = deque()
+
+    def expire(self, now, full=False):
+        """
+        Drop the values older than `window` seconds before `now`.
+        :param full: Also drop the oldest value when the buffer is full
+        """
+        while self.size and ((full and self.size == self.capacity) or self.times[self.start] < now - self.window):
+            self.sum -= self.values[self.start]
+            self.start = (self.start + 1) % self.capacity
+            self.size -= 1
+        oldest = self.seq - self.size
+        while self.maxQueue and self.maxQueue[0][0] < oldest:
+            self.maxQueue.popleft()
+
+    def add(self, value, timestamp):
+        # Expire values that fell out of the window or would be overwritten
+        self.expire(timestamp, full=True)
+        end = (self.start + self.size) % self.capacity
+        self.times[end] = timestamp
+        self.values[end] = value
+        self.size += 1
+        self.sum += value
+        while self.maxQueue and self.maxQueue[-1][1] <= value:
+            self.maxQueue.pop()
+        self.maxQueue.append((self.seq, value))
+        self.seq += 1
+
+    def mean(self):
+        return self.sum / self.size if self.size else 0.0
+
+    def max(self):
+        return self.maxQueue[0][1] if self.maxQueue else 0.0
+
+
+class PerformanceEvaluator:
+    """
+    Streaming error and jitter statistics per algorithm. Whole-session
+    mean and max are kept as running values and the last `window` seconds
+    in ring buffers, so recording and get_metrics take constant time and
+    memory however long the session runs. Optionally every record is
+    spilled to a compact file on disk (see load_history), the time in
+    float64 so it keeps sub-millisecond resolution in long sessions and
+    the other columns in float32.
+
+    When the true position is passed with the records (simulations), the
+    metrics also include the error against it (RMSE), the lag of the
+    filtered path behind it over the last `lag_capacity` samples, and for
+    every pause of the true hand the overshoot past the stop point and
+    the time until the output stays within `settle_radius` of it. A pause
+    the output never settles in counts with its whole length and as
+    unsettled, so the settle time is a lower bound when there are some.
+    """
+    SPILL_COLUMNS = ('time', 'algo', 'x', 'y', 'error', 'jitter')
+    SPILL_DTYPE = np.dtype([('time', np.float64)] + [(name, np.float32) for name in SPILL_COLUMNS[1:]])
+
+    def __init__(self, window=5.0, capacity=1024, spill_path=None, spill_chunk=4096,
+                 algos=('lowpass', 'ekf', 'moving_avg', 'kf'), lag_capacity=600, still_speed=1.0, settle_radius=5.0):
+        """
+        :param window: Length of the windowed statistics (seconds)
+        :param capacity: Maximum samples per window
+        :param spill_path: File the full history is appended to, None to keep no history
+        :param spill_chunk: Records buffered in memory before they are written
+        :param algos: Algorithms listed in the metrics from the start
+        :param lag_capacity: Samples the lag is estimated over
+        :param still_speed: True speed (pixels per second) below which the hand counts as paused
+        :param settle_radius: Distance from the true position the output has settled within (pixels)
+        """
+        self.window = window
+        self.capacity = capacity
+        self.lag_capacity = lag_capacity
+        self.still_speed = still_speed
+        self.settle_radius = settle_radius
+        self.spill_path = spill_path
+        self.spill_chunk = spill_chunk
+        self.algos = algos
+        self.spill_file = None
+        # Records may come from a ShadowEvaluator worker while the HUD reads the metrics
+        self.lock = threading.Lock()
         self.reset()
 
     def reset(self):
-        self.data = {
-            'lowpass': {'positions': [], 'errors': [], 'jitter': []},
-            'ekf': {'positions': [], 'errors': [], 'jitter': []},
-            'moving_avg': {'positions': [], 'errors': [], 'jitter': []},
-            'kf': {'positions': [], 'errors': [], 'jitter': []}
+        self.close()
+        self.data = {}
+        for algo in self.algos:
+            self._add_algo(algo)
+        self.start_time = time.time()
+        if self.spill_path:
+            self.spill_file = open(self.spill_path, 'wb')
+            self.spill_buffer = np.zeros(self.spill_chunk, self.SPILL_DTYPE)
+            self.spill_size = 0
+
+    def _add_algo(self, algo_name):
+        self.data[algo_name] = {
+            'error': RunningStat(),
+            'jitter': RunningStat(),
+            'window_error': WindowStat(self.window, self.capacity),
+            'window_jitter': WindowStat(self.window, self.capacity),
+            'last_position': None,
+            'id': len(self.data),
+            # Ground truth: error, (time, position, truth) ring buffer for the lag, pause tracking
+            'true_error': RunningStat(),
+            'track': np.zeros((self.lag_capacity, 5)),
+            'track_next': 0,
+            'track_size': 0,
+            'last_truth': None,
+            'direction': None,
+            'pause': None,
+            'settle': RunningStat(),
+            'overshoot': RunningStat(),
+            'unsettled': 0
         }
+        return self.data[algo_name]
 
-    def record(self, algo_name, position, error):
-        positions = self.data[algo_name]['positions']
-        if positions:
-            prev_pos = positions[-1]
-            jitter = np.sqrt((position[0] - prev_pos[0])**2 + (position[1] - prev_pos[1])**2)
-            self.data[algo_name]['jitter'].append(jitter)
-        self.data[algo_name]['positions'].append(position)
-        self.data[algo_name]['errors'].append(error)
+    def record(self, algo_name, position, error, timestamp=None, truth=None):
+        """
+        :param algo_name: Name of the algorithm
+        :param position: Filtered (x, y) position
+        :param error: Error of the position
+        :param timestamp: Time of the sample, defaults to now
+        :param truth: True (x, y) position, None when it is unknown
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            data = self.data.get(algo_name) or self._add_algo(algo_name)
+            jitter = np.nan
+            prev_pos = data['last_position']
+            if prev_pos is not None:
+                jitter = np.sqrt((position[0] - prev_pos[0])**2 + (position[1] - prev_pos[1])**2)
+                data['jitter'].add(jitter)
+                data['window_jitter'].add(jitter, timestamp)
+            data['last_position'] = position
+            data['error'].add(error)
+            data['window_error'].add(error, timestamp)
+            if truth is not None:
+                self._record_truth(data, position, truth, timestamp)
+            if self.spill_file is not None:
+                self._spill(timestamp, algo_name, position, error, jitter)
 
-    def get_metrics(self):
+    def _record_truth(self, data, position, truth, timestamp):
+        dx, dy = position[0] - truth[0], position[1] - truth[1]
+        distance = math.hypot(dx, dy)
+        data['true_error'].add(distance)
+        i = data['track_next']
+        data['track'][i] = (timestamp, position[0], position[1], truth[0], truth[1])
+        data['track_next'] = (i + 1) % self.lag_capacity
+        data['track_size'] = min(data['track_size'] + 1, self.lag_capacity)
+
+        last = data['last_truth']
+        data['last_truth'] = (timestamp, truth[0], truth[1])
+        if last is None or timestamp <= last[0]:
+            return
+        mx, my = truth[0] - last[1], truth[1] - last[2]
+        step = math.hypot(mx, my)
+        pause = data['pause']
+        if step < self.still_speed * (timestamp - last[0]):
+            if pause is None:
+                if data['direction'] is None:
+                    return
+                # The hand stopped at the last position, when the previous sample was taken
+                pause = data['pause'] = {'start': last[0], 'overshoot': 0.0, 'settled': None}
+            # Overshoot is the distance past the stop point along the approach direction
+            ux, uy = data['direction']
+            pause['overshoot'] = max(pause['overshoot'], dx * ux + dy * uy)
+            if distance > self.settle_radius:
+                pause['settled'] = None
+            elif pause['settled'] is None:
+                pause['settled'] = timestamp
+        else:
+            if pause is not None:
+                # The pause lasted until the last still sample
+                self._end_pause(data, pause, last[0])
+                data['pause'] = None
+            data['direction'] = (mx / step, my / step)
+
+    @staticmethod
+    def _end_pause(stats, pause, end):
+        """Add a pause that lasted until `end` to the 'settle', 'overshoot' and 'unsettled' entries of `stats`"""
+        stats['overshoot'].add(pause['overshoot'])
+        if pause['settled'] is None:
+            stats['unsettled'] += 1
+            stats['settle'].add(end - pause['start'])
+        else:
+            stats['settle'].add(pause['settled'] - pause['start'])
+
+    def _pause_stats(self, data):
+        """Pause statistics with a pause still in progress counted as if it ended at the last sample"""
+        stats = {'settle': copy.copy(data['settle']), 'overshoot': copy.copy(data['overshoot']),
+                 'unsettled': data['unsettled']}
+        if data['pause'] is not None:
+            self._end_pause(stats, data['pause'], data['last_truth'][0])
+        return stats
+
+    def _lag(self, data):
+        size = data['track_size']
+        if size < 3:
+            return 0.0
+        order = (data['track_next'] - size + np.arange(size)) % self.lag_capacity
+        track = data['track'][order]
+        dt = float(np.median(np.diff(track[:, 0])))
+        if dt <= 0:
+            return 0.0
+        return estimate_lag(track[:, 3:5], track[:, 1:3], dt)
+
+    def _spill(self, timestamp, algo_name, position, error, jitter):
+        self.spill_buffer[self.spill_size] = (timestamp - self.start_time, self.data[algo_name]['id'],
+                                              position[0], position[1], error, jitter)
+        self.spill_size += 1
+        if self.spill_size == self.spill_chunk:
+            self.flush()
+
+    def flush(self):
+        """Write buffered history records to the spill file"""
+        if self.spill_file is None:
+            return
+        self.spill_buffer[:self.spill_size].tofile(self.spill_file)
+        self.spill_size = 0
+        self.spill_file.flush()
+        with open(self.spill_path + '.json', 'w') as f:
+            json.dump({'columns': self.SPILL_COLUMNS, 'dtype': self.SPILL_DTYPE.descr, 'algos': list(self.data),
+                       'start_time': self.start_time}, f)
+
+    def close(self):
+        """Flush and close the spill file"""
+        if self.spill_file is not None:
+            self.flush()
+            self.spill_file.close()
+            self.spill_file = None
+
+    @staticmethod
+    def load_history(path):
+        """
+        Load a spilled history.
+        :param path: Spill file
+        :return: Memory-mapped record array with the SPILL_COLUMNS fields (time relative to the start, float64),
+            and the list of algorithm names
+        """
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        dtype = np.dtype([tuple(field) for field in meta['dtype']])
+        return np.memmap(path, dtype=dtype, mode='r'), meta['algos']
+
+    def get_metrics(self, now=None):
+        """
+        :param now: Current time on the clock of the record timestamps, defaults to now. The windowed
+            statistics only cover the `window` seconds before it.
+        """
+        now = time.time() if now is None else now
         metrics = {}
-        for algo in self.data:
-            errors = self.data[algo]['errors']
-            jitter = self.data[algo]['jitter']
-            metrics[algo] = {
-                'avg_error': np.mean(errors) if errors else 0,
-                'max_error': np.max(errors) if errors else 0,
-                'avg_jitter': np.mean(jitter) if jitter else 0,
-                'max_jitter': np.max(jitter) if jitter else 0
-            }
-        return metrics
\ No newline at end of file
+        with self.lock:
+            for algo, data in self.data.items():
+                errors, jitter = data['error'], data['jitter']
+                data['window_error'].expire(now)
+                data['window_jitter'].expire(now)
+                metrics[algo] = {
+                    'avg_error': errors.mean,
+                    'max_error': errors.max,
+                    'std_error': errors.std(),
+                    'avg_jitter': jitter.mean,
+                    'max_jitter': jitter.max,
+                    'window_avg_error': data['window_error'].mean(),
+                    'window_max_error': data['window_error'].max(),
+                    'window_avg_jitter': data['window_jitter'].mean(),
+                    'window_max_jitter': data['window_jitter'].max(),
+                    'count': errors.count
+                }
+                true_error = data['true_error']
+                if true_error.count:
+                    pauses = self._pause_stats(data)
+                    settle, overshoot = pauses['settle'], pauses['overshoot']
+                    # Without pauses there is nothing to settle, NaN rather than a perfect 0
+                    metrics[algo].update({
+                        'true_rmse': math.sqrt(true_error.mean ** 2 + true_error.std() ** 2),
+                        'true_max_error': true_error.max,
+                        'lag_ms': self._lag(data) * 1000,
+                        'settle_ms': settle.mean * 1000 if settle.count else np.nan,
+                        'max_settle_ms': settle.max * 1000 if settle.count else np.nan,
+                        'overshoot': overshoot.mean if overshoot.count else np.nan,
+                        'max_overshoot': overshoot.max if overshoot.count else np.nan,
+                        'pauses': overshoot.count,
+                        'unsettled': pauses['unsettled']
+                    })
+        return metrics
+
+
+class ShadowEvaluator:
+    """
+    Records the metrics of the active filter and runs the other filters
+    next to it for comparison only, so they never delay the cursor.
+
+    mode 'thread': every measurement goes through a bounded queue to a
+    background worker, which also records the active filter so the
+    evaluator is written from a single thread. Measurements are dropped
+    (and counted) when the worker falls behind.
+    mode 'sample': the shadow filters run inline on every n-th
+    measurement, n = 1 / sample_rate, with their nominal time step scaled
+    by n (timestamps give them the actual gaps).
+    Their metrics then describe the filters at that lower rate.
+    mode None: only the active filter is recorded.
+    """
+
+    def __init__(self, evaluator, active_name, names, mode='thread', sample_rate=0.2, dt=1/30.0, queue_size=256,
+                 options=None):
+        """
+        :param evaluator: PerformanceEvaluator receiving the records
+        :param active_name: Name the active filter is recorded under
+        :param names: Names of the shadow filters (see FILTERS)
+        :param mode: 'thread', 'sample' or None
+        :param sample_rate: Fraction of measurements the shadows see in 'sample' mode
+        :param dt: Time step of the measurements
+        :param queue_size: Maximum measurements waiting for the worker
+        :param options: Dict of filter name to extra make_filter arguments
+        """
+        self.evaluator = evaluator
+        self.active_name = active_name
+        self.mode = mode
+        self.step = max(1, int(round(1 / sample_rate))) if mode == 'sample' else 1
+        options = options or {}
+        self.filters = {name: make_filter(name, dt * self.step, **options.get(name, {})) for name in names} if mode else {}
+        self.count = 0
+        self.dropped = 0
+        self.queue = None
+        self.thread = None
+        if mode == 'thread' and self.filters:
+            self.queue = queue.Queue(maxsize=queue_size)
+            self.thread = threading.Thread(target=self._loop, name="ShadowEvaluator", daemon=True)
+            self.thread.start()
+
+    def submit(self, z, position, timestamp=None):
+        """
+        :param z: Measured (x, y) position
+        :param position: Output of the active filter
+        :param timestamp: Time of the measurement, defaults to now
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        if self.queue is not None:
+            try:
+                self.queue.put_nowait((z, position, timestamp))
+            except queue.Full:
+                self.dropped += 1
+            return
+        self._record(self.active_name, position, z, timestamp)
+        if self.filters and self.count % self.step == 0:
+            self._run_shadows(z, timestamp)
+        self.count += 1
+
+    def _record(self, name, position, z, timestamp):
+        error = np.sqrt((position[0] - z[0])**2 + (position[1] - z[1])**2)
+        self.evaluator.record(name, position, error, timestamp)
+
+    def _run_shadows(self, z, timestamp):
+        for name, shadow in self.filters.items():
+            self._record(name, shadow.filter(z, timestamp), z, timestamp)
+
+    def _loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            z, position, timestamp = item
+            self._record(self.active_name, position, z, timestamp)
+            self._run_shadows(z, timestamp)
+
+    def close(self):
+        """Let the worker finish the queued measurements and stop it"""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.dropped:
+            print(f"Shadow evaluation dropped {self.dropped} measurements")
+
+
+class CursorPredictor:
+    """
+    Moves the filtered cursor ahead by the pipeline latency, the time from
+    capture to the cursor update. The velocity comes from the filter's
+    state when it has a linear one (get_velocity(), the Kalman filter),
+    otherwise from the filtered positions themselves. The EKF's speed and
+    heading state trails the hand too far to extrapolate with, so it uses
+    the output velocity as well. The extrapolation shrinks when the
+    velocity is uncertain compared to its size, is clamped in time and
+    distance, and is off while the hand is not moving.
+    """
+
+    def __init__(self, lead=1.0, max_lead=0.1, max_distance=150, extra_latency=0.0, smoothing=0.1,
+                 velocity_smoothing=0.5, max_gap=0.25):
+        """
+        :param lead: Fraction of the latency to compensate, 0 turns prediction off
+        :param max_lead: Longest extrapolation (seconds)
+        :param max_distance: Longest extrapolation (pixels)
+        :param extra_latency: Output latency not seen by the measurement, added to it (seconds)
+        :param smoothing: Weight of the newest latency sample in its moving average
+        :param velocity_smoothing: Weight of the newest sample in the output velocity's moving average
+        :param max_gap: Longest time between positions the output velocity is carried over (seconds)
+        """
+        self.lead = lead
+        self.max_lead = max_lead
+        self.max_distance = max_distance
+        self.extra_latency = extra_latency
+        self.smoothing = smoothing
+        self.latency = None
+        self.lead_time = RunningStat()
+        self.offset = RunningStat()
+        self.last_lead_time = 0.0
+        self.last_offset = 0.0
+        self.velocity_smoothing = velocity_smoothing
+        self.max_gap = max_gap
+        self.last_position = None
+        self.velocity = None
+        self.velocity_var = 0.0
+
+    def _track_output(self, position, timestamp):
+        """Exponentially weighted mean and variance of the velocity between filtered positions"""
+        last, self.last_position = self.last_position, (position[0], position[1], timestamp)
+        if last is None or timestamp <= last[2]:
+            return
+        dt = timestamp - last[2]
+        if dt > self.max_gap:
+            self.velocity, self.velocity_var = None, 0.0
+            return
+        vx, vy = (position[0] - last[0]) / dt, (position[1] - last[1]) / dt
+        if self.velocity is None:
+            self.velocity = (vx, vy)
+            return
+        a = self.velocity_smoothing
+        ex, ey = vx - self.velocity[0], vy - self.velocity[1]
+        self.velocity = (self.velocity[0] + a * ex, self.velocity[1] + a * ey)
+        self.velocity_var = (1 - a) * (self.velocity_var + a * (ex * ex + ey * ey))
+
+    def get_velocity(self, filt):
+        """
+        :return: Velocity (vx, vy) and the variance of its magnitude, from the filter state or the
+            output, None before the output has two positions
+        """
+        if hasattr(filt, 'get_velocity'):
+            return filt.get_velocity()
+        if self.velocity is None:
+            return None
+        # Variance of the moving average, per axis
+        a = self.velocity_smoothing
+        return self.velocity[0], self.velocity[1], 0.5 * self.velocity_var * a / (2 - a)
+
+    def predict(self, position, filt, latency, moving=True, timestamp=None):
+        """
+        :param position: Filtered (x, y) cursor position
+        :param filt: Filter that produced it
+        :param latency: Time since the frame was captured (seconds)
+        :param moving: False while the hand is static
+        :param timestamp: Capture time of the frame, defaults to now
+        :return: Predicted (x, y) position
+        """
+        self._track_output(position, time.time() if timestamp is None else timestamp)
+        # Fast replays can hand out timestamps ahead of the clock
+        latency = max(latency, 0.0) + self.extra_latency
+        self.latency = latency if self.latency is None else self.latency + self.smoothing * (latency - self.latency)
+        velocity = self.get_velocity(filt) if self.lead and moving else None
+        if velocity is None:
+            self.last_lead_time = self.last_offset = 0.0
+            return position
+
+        lead_time = min(self.lead * self.latency, self.max_lead)
+        vx, vy, variance = velocity
+        speed2 = vx * vx + vy * vy
+        # Shrink towards no extrapolation when the velocity is uncertain
+        confidence = speed2 / (speed2 + variance) if speed2 else 0.0
+        dx, dy = vx * lead_time * confidence, vy * lead_time * confidence
+        distance = math.sqrt(dx * dx + dy * dy)
+        if distance > self.max_distance:
+            dx, dy = dx * self.max_distance / distance, dy * self.max_distance / distance
+            distance = self.max_distance
+
+        self.last_lead_time, self.last_offset = lead_time * confidence, distance
+        self.lead_time.add(self.last_lead_time)
+        self.offset.add(distance)
+        return position[0] + dx, position[1] + dy
+
+    def get_metrics(self):
+        return {
+            'latency': (self.latency or 0.0) * 1000,
+            'avg_lead': self.lead_time.mean * 1000,
+            'lead': self.last_lead_time * 1000,
+            'avg_offset': self.offset.mean,
+            'offset': self.last_offset
+        }
@@ -0,0 +1,153 @@
+import threading
+import time
+
+import cv2
+
+
+class FrameGrabber:
+    """
+    Reads frames from a cv2.VideoCapture and hands out only the newest one.
+    In threaded mode the camera is drained on a background thread, so the
+    consumer never works on frames that queued up in the driver while it
+    was busy. Every frame carries its capture timestamp, and frames that
+    were replaced before anybody read them are counted as dropped.
+    Read failures back off exponentially instead of spinning, and after
+    `reconnectAfter` consecutive failures the camera is reopened.
+    """
+
+    def __init__(self, cap, threaded=True, source=None, reconnectAfter=10, maxBackoff=2.0):
+        """
+        :param cap: Opened cv2.VideoCapture
+        :param threaded: Capture on a background thread (latest frame wins)
+        :param source: Camera index or URL used to reopen the camera (None disables reconnects)
+        :param reconnectAfter: Consecutive read failures before the camera is reopened
+        :param maxBackoff: Longest wait between failed reads (seconds)
+        """
+        self.cap = cap
+        self.threaded = threaded
+        self.source = source
+        self.reconnectAfter = reconnectAfter
+        self.maxBackoff = maxBackoff
+        self.failures = 0
+        self.reconnects = 0
+        self.resolution = None
+        self.pendingResolution = None
+        self.frame = None
+        self.timestamp = 0.0
+        self.frameId = 0
+        self.readId = 0
+        self.captured = 0
+        self.dropped = 0
+        self.running = False
+        self.thread = None
+        self.cond = threading.Condition()
+
+    def setResolution(self, width, height):
+        """
+        Request a capture resolution. In threaded mode it is applied by the
+        capture thread before its next read, and it is reapplied after a
+        reconnect.
+        """
+        self.resolution = (width, height)
+        if self.threaded and self.running:
+            self.pendingResolution = self.resolution
+        else:
+            self._applyResolution()
+
+    def _applyResolution(self):
+        self.pendingResolution = None
+        if self.resolution is not None:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.resolution[0])
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.resolution[1])
+
+    def start(self):
+        """Start the capture thread (no-op in synchronous mode)"""
+        # Keep the driver queue as short as possible, we only want fresh frames
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.running = True
+        if self.threaded:
+            self.thread = threading.Thread(target=self._loop, name="FrameGrabber", daemon=True)
+            self.thread.start()
+        return self
+
+    def _readCamera(self):
+        if self.pendingResolution is not None:
+            self._applyResolution()
+        success, img = self.cap.read()
+        if success:
+            self.failures = 0
+            return True, img
+        self.failures += 1
+        if self.source is not None and self.failures % self.reconnectAfter == 0:
+            self.reconnect()
+        # Exponential backoff instead of busy-spinning on a dead camera
+        time.sleep(min(self.maxBackoff, 0.01 * 2 ** min(self.failures, 16)))
+        return False, None
+
+    def reconnect(self):
+        """Reopen the camera and restore its settings"""
+        print(f"Camera read failed {self.failures} times, reconnecting")
+        self.cap.release()
+        self.cap.open(self.source)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self._applyResolution()
+        self.reconnects += 1
+
+    def _loop(self):
+        while self.running:
+            success, img = self._readCamera()
+            timestamp = time.time()
+            if not success:
+                continue
+            with self.cond:
+                if self.frameId != self.readId:
+                    # Previous frame was never consumed
+                    self.dropped += 1
+                self.frame = img
+                self.timestamp = timestamp
+                self.frameId += 1
+                self.captured += 1
+                self.cond.notify_all()
+
+    def read(self, timeout=1.0):
+        """
+        Get the newest frame that has not been returned yet.
+        :param timeout: Maximum time to wait for a new frame (seconds)
+        :return: success flag, image, capture timestamp (time.time())
+        """
+        if not self.threaded:
+            success, img = self._readCamera()
+            if success:
+                self.captured += 1
+            return success, img, time.time()
+
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.frameId != self.readId or not self.running, timeout):
+                return False, None, 0.0
+            if self.frameId == self.readId:
+                return False, None, 0.0
+            self.readId = self.frameId
+            return True, self.frame, self.timestamp
+
+    def stats(self):
+        """
+        :return: Dict with captured and dropped frame counts and the drop rate
+        """
+        captured = self.captured
+        return {
+            'captured': captured,
+            'dropped': self.dropped,
+            'drop_rate': self.dropped / captured if captured else 0.0,
+            'reconnects': self.reconnects
+        }
+
+    def stop(self):
+        """Stop the capture thread and report the frame statistics"""
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        stats = self.stats()
+        print(f"Captured {stats['captured']} frames, dropped {stats['dropped']} ({stats['drop_rate'] * 100:.1f}%)")
@@ -36,6 +36,170 @@ display_scale = 1.0
 # Default: False
 debugMode = True
 
+# Headless mode: no drawing and no preview window, control logic unchanged (True/False)
+# Default: False
+headless = False
+
+# Frame rate of the diagnostic preview window in headless mode (0 to disable)
+# Default: 0
+preview_fps = 0
+
+# Refresh interval of the metrics HUD (seconds)
+# Default: 0.5
+hud_refresh = 0.5
+
+# Window of the recent filter metrics (seconds)
+# Default: 5.0
+metrics_window = 5.0
+
+# File the full filter metric history is written to, None to keep no history
+# Default: None
+metrics_spill = None
+
+# Filter that drives the cursor ('lowpass', 'ekf', 'moving_avg' or 'kf')
+# Default: 'ekf'
+active_filter = 'ekf'
+
+# Filters run only for the metrics comparison, None for all the others
+# Default: None
+shadow_filters = None
+
+# How the comparison filters run: 'thread' (background worker), 'sample' (inline on a subset of frames) or None (off)
+# Replays run 'thread' inline on every frame instead, so their metrics are reproducible
+# Default: 'thread'
+shadow_mode = 'thread'
+
+# Fraction of frames the comparison filters see in 'sample' mode
+# Default: 0.2
+shadow_sample_rate = 0.2
+
+# Switch the Kalman filter ('kf') to its precomputed steady-state gain once it has converged (True/False)
+# Default: True
+kf_steady_state = True
+
+# Filter parameter profile written by tuner.py (.json), None for the built-in defaults
+# Default: None
+filter_profile = None
+
+# Fraction of the measured capture-to-cursor latency the cursor is moved ahead along its velocity, 0 to turn prediction off
+# Default: 1.0
+cursor_lead = 1.0
+
+# Longest cursor extrapolation (seconds)
+# Default: 0.1
+cursor_max_lead = 0.1
+
+# Longest cursor extrapolation (screen pixels)
+# Default: 150
+cursor_max_distance = 150
+
+# Output latency not covered by the measurement, such as the display (seconds)
+# Replays have no measured latency and lead the cursor by this alone
+# Default: 0.0
+cursor_extra_latency = 0.0
+
+# Rate the mouse is moved at from its own thread (Hz), usually the display refresh rate, 0 to move it once per frame
+# Default: 120
+cursor_output_rate = 120
+
+# How far in the past the output thread renders the cursor (seconds), 0 extrapolates from the newest samples,
+# about one frame interval interpolates between them instead (smoother, one frame later)
+# Default: 0.0
+cursor_output_delay = 0.0
+
+# Maximum number of key presses and clicks waiting to be injected, further ones are dropped
+# Default: 64
+action_queue_size = 64
+
+# Record timestamps and hands of every frame to this .npz file for replays, None to record nothing
+# Default: None
+record_path = None
+
+# Also record frames downscaled to this (width, height), None to record landmarks only
+# Default: None
+record_frames = None
+
+# Run on this recording instead of the camera, input is logged instead of injected (see recording.py), None for the camera
+# Default: None
+replay_path = None
+
+# Replay at the recorded speed (True) or as fast as possible (False)
+# Default: True
+replay_realtime = True
+
+# Capture frames on a background thread and always process the newest one (True/False)
+# Default: True
+threaded_capture = True
+
+# Downscale factor applied to frames before hand detection (0 - 1.0)
+# Default: 1.0
+detection_scale = 1.0
+
+# Run detection on a crop around the tracked hand instead of the full frame (True/False)
+# Default: False
+roi_tracking = False
+
+# Side of the square the tracking crop is resized to (pixels)
+# Default: 256
+roi_size = 256
+
+# Center the tracking crop on the Kalman-predicted hand position (True/False)
+# Default: True
+roi_predict = True
+
+# Run full hand detection every N frames and predict the landmarks in between (1 = every frame)
+# Default: 1
+detect_interval = 1
+
+# Detect earlier once the expected prediction error exceeds this many pixels (0 to disable)
+# Default: 0
+detect_max_error = 0
+
+# Skip hand detection while the scene is static and no hand is tracked (True/False)
+# Default: True
+presence_gate = True
+
+# Mean gray level change between frames that counts as motion (0 - 255)
+# Default: 3.0
+motion_threshold = 3.0
+
+# Seconds without hand or motion before dropping to the idle frame rate
+# Default: 10
+idle_timeout = 10
+
+# Frame rate while idle
+# Default: 5
+idle_fps = 5
+
+# Adapt capture resolution, detection scale and model complexity to the measured latency (True/False)
+# Default: False
+fps_governor = False
+
+# Frame rate the governor tries to sustain
+# Default: 30
+target_fps = 30
+
+# End-to-end latency budget from capture to display (seconds)
+# Default: 0.1
+latency_budget = 0.1
+
+# Quality levels for the governor, best first: (width, height, detection scale, model complexity)
+governor_levels = [
+    (videoWidth, videoHeight, detection_scale, 1),
+    (1280, 720, 1.0, 1),
+    (1280, 720, 1.0, 0),
+    (960, 540, 1.0, 0),
+    (640, 360, 1.0, 0)
+]
+
+# Time every stage of the frame loop, press 't' for a percentile report (True/False)
+# Default: False
+trace_stages = False
+
+# Path prefix for the trace export (.json Chrome trace and .csv) on exit, None to skip
+# Default: None
+trace_export = None
+
 
 ## Keyboard configuration
 # Keyboard start x position (pixels)
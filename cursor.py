@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import deque
+
+
+class CursorOutput:
+    """
+    Moves the mouse from its own thread at a fixed rate (the display
+    refresh rate), independent of the camera frame rate. The frame loop
+    submits filtered cursor samples with move(); every tick the cursor
+    position is evaluated on the line through the last two samples at
+    `now - delay`. With delay 0 it extrapolates from the newest sample,
+    for at most `maxExtrapolation` seconds, then eases back onto it over
+    the same time, so the cursor rests where the samples stopped (the
+    frame loop stops submitting while the hand is static). With a delay of
+    one frame interval it interpolates between samples, smoother but one
+    frame later.
+
+    Clicks go through the same queue as the samples, so a click is
+    issued after the moves submitted before it, at the position of the
+    newest of them.
+    """
+
+    def __init__(self, moveFn, clickFn, rate=120, delay=0.0, maxExtrapolation=0.05, screen=None):
+        """
+        :param moveFn: Function moving the mouse to (x, y)
+        :param clickFn: Function clicking, called with the button or without arguments
+        :param rate: Output rate (Hz)
+        :param delay: How far in the past the cursor is rendered (seconds)
+        :param maxExtrapolation: Longest extrapolation past the newest sample (seconds)
+        :param screen: Screen size (width, height) the output is clamped to
+        """
+        self.moveFn = moveFn
+        self.clickFn = clickFn
+        self.period = 1.0 / rate
+        self.delay = delay
+        self.maxExtrapolation = maxExtrapolation
+        self.screen = screen
+        self.events = deque()
+        self.cond = threading.Condition()
+        self.prev = None
+        self.last = None
+        self.position = None
+        self.moves = 0
+        self.clicks = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, name="CursorOutput", daemon=True)
+        self.thread.start()
+        return self
+
+    def move(self, x, y, timestamp=None):
+        """
+        Submit a filtered cursor sample.
+        :param timestamp: Time the sample is valid for, defaults to now
+        """
+        with self.cond:
+            self.events.append(('move', (x, y, time.time() if timestamp is None else timestamp)))
+
+    def click(self, button=None):
+        """
+        Queue a click after the samples submitted so far.
+        :param button: Button passed to the click function, None for its default
+        """
+        with self.cond:
+            self.events.append(('click', button))
+            self.cond.notify()
+
+    def _loop(self):
+        nextTick = time.perf_counter()
+        while self.running:
+            with self.cond:
+                # Sleep until the next tick, clicks wake the thread early
+                timeout = nextTick - time.perf_counter()
+                if timeout > 0 and not self.events:
+                    self.cond.wait(timeout)
+                events = list(self.events)
+                self.events.clear()
+            self._handle(events)
+            now = time.perf_counter()
+            if now >= nextTick:
+                self._output(time.time())
+                nextTick = max(nextTick + self.period, now)
+
+    def _handle(self, events):
+        for kind, data in events:
+            if kind == 'move':
+                self.prev, self.last = self.last, data
+            else:
+                # The click lands where the newest sample says, not on an interpolated point
+                if self.last is not None:
+                    self._moveTo(self.last[0], self.last[1])
+                if data is None:
+                    self.clickFn()
+                else:
+                    self.clickFn(button=data)
+                self.clicks += 1
+
+    def evaluate(self, now):
+        """
+        :param now: Current time (time.time())
+        :return: Cursor position at `now - delay`, or None before the first sample
+        """
+        if self.last is None:
+            return None
+        x1, y1, t1 = self.last
+        if self.prev is None or t1 <= self.prev[2]:
+            return x1, y1
+        x0, y0, t0 = self.prev
+        t = now - self.delay
+        overrun = t - t1 - self.maxExtrapolation
+        if overrun > 0:
+            # Past the horizon the extrapolated offset shrinks back to the newest sample
+            ease = max(1.0 - overrun / self.maxExtrapolation, 0.0) if self.maxExtrapolation > 0 else 0.0
+            t = t1 + self.maxExtrapolation * ease
+        alpha = max(t - t0, 0.0) / (t1 - t0)
+        return x0 + (x1 - x0) * alpha, y0 + (y1 - y0) * alpha
+
+    def _output(self, now):
+        position = self.evaluate(now)
+        if position is not None:
+            self._moveTo(*position)
+
+    def _moveTo(self, x, y):
+        if self.screen is not None:
+            x = max(0, min(x, self.screen[0] - 1))
+            y = max(0, min(y, self.screen[1] - 1))
+        # Skip moves that would not change the pixel
+        position = (int(x), int(y))
+        if position == self.position:
+            return
+        self.position = position
+        self.moveFn(x, y)
+        self.moves += 1
+
+    def stop(self):
+        """Issue the queued events and stop the thread"""
+        self.running = False
+        with self.cond:
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        with self.cond:
+            events = list(self.events)
+            self.events.clear()
+        self._handle(events)
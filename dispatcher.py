@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import deque
+
+
+class ActionDispatcher:
+    """
+    Runs input actions (virtual key presses, mouse clicks) on a worker
+    thread, so a slow OS input call never stalls the frame loop.
+
+    Events are executed in submission order. The actions of one event,
+    such as a key's press and release, are queued together: they take
+    one slot and nothing is injected between them. The queue is bounded;
+    when it is full new events are dropped instead of blocking the
+    caller. Clicks are debounced per channel on the capture time of the
+    frame that triggered them, not on the time they reach the queue.
+    """
+
+    def __init__(self, maxSize=64, debounce=1.0, backlogWarning=8):
+        """
+        :param maxSize: Maximum number of queued events
+        :param debounce: Minimum time between accepted events of a channel (seconds)
+        :param backlogWarning: Backlog size that is reported
+        """
+        self.maxSize = maxSize
+        self.debounce = debounce
+        self.backlogWarning = backlogWarning
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.lastAccepted = {}
+        self.submitted = 0
+        self.executed = 0
+        self.dropped = 0
+        self.debounced = 0
+        self.maxBacklog = 0
+        self.maxDelay = 0.0
+        self.totalDelay = 0.0
+        self.warned = False
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, name="ActionDispatcher", daemon=True)
+        self.thread.start()
+        return self
+
+    def due(self, channel, timestamp, interval=None):
+        """
+        Debounce check, without recording the event. Events delivered
+        outside the queue are recorded with record() once they went out.
+        :param channel: Name of the debounced input, e.g. 'mouse'
+        :param timestamp: Capture time of the frame that triggered the event
+        :param interval: Minimum time since the last accepted event, defaults to `debounce`
+        :return: True if the event may go out
+        """
+        interval = self.debounce if interval is None else interval
+        last = self.lastAccepted.get(channel)
+        if last is not None and timestamp - last < interval:
+            self.debounced += 1
+            return False
+        return True
+
+    def record(self, channel, timestamp):
+        """Count an event that went out for the debounce of its channel"""
+        self.lastAccepted[channel] = timestamp
+
+    def submit(self, actions, timestamp=None, channel=None, name=None):
+        """
+        Queue the actions of one event. Never blocks.
+        :param actions: Callables run in order on the worker thread
+        :param timestamp: Capture time of the frame that triggered the event, defaults to now
+        :param channel: Debounce channel, None to skip the debounce
+        :param name: Name of the event for reports
+        :return: True if the event was accepted
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        if channel is not None and not self.due(channel, timestamp):
+            return False
+        if not actions:
+            if channel is not None:
+                self.record(channel, timestamp)
+            return True
+        with self.cond:
+            if len(self.queue) >= self.maxSize:
+                self.dropped += 1
+                print(f"Input queue full, dropped {name or 'event'}")
+                return False
+            self.queue.append((name, actions, timestamp))
+            if channel is not None:
+                # A dropped event does not count for the debounce
+                self.record(channel, timestamp)
+            self.submitted += 1
+            backlog = len(self.queue)
+            self.maxBacklog = max(self.maxBacklog, backlog)
+            self.cond.notify()
+        if backlog >= self.backlogWarning and not self.warned:
+            self.warned = True
+            print(f"Input backlog of {backlog} events, the OS input calls are slow")
+        elif backlog < self.backlogWarning // 2:
+            self.warned = False
+        return True
+
+    def backlog(self):
+        """
+        :return: Number of events waiting for the worker
+        """
+        return len(self.queue)
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.queue or not self.running)
+                if not self.queue:
+                    return
+                name, actions, timestamp = self.queue.popleft()
+            self._run(name, actions, timestamp)
+
+    def _run(self, name, actions, timestamp):
+        for action in actions:
+            try:
+                action()
+            except Exception as e:
+                print(f"Input action {name or ''} failed: {e}")
+        delay = time.time() - timestamp
+        self.executed += 1
+        self.totalDelay += delay
+        self.maxDelay = max(self.maxDelay, delay)
+
+    def stats(self):
+        """
+        :return: Dict of event counts, backlog and the delay from capture to injection (milliseconds)
+        """
+        return {
+            'submitted': self.submitted,
+            'executed': self.executed,
+            'dropped': self.dropped,
+            'debounced': self.debounced,
+            'backlog': self.backlog(),
+            'max_backlog': self.maxBacklog,
+            'avg_delay': self.totalDelay / self.executed * 1000 if self.executed else 0.0,
+            'max_delay': self.maxDelay * 1000
+        }
+
+    def stop(self, timeout=1.0):
+        """Let the worker finish the queued events and stop it"""
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+        s = self.stats()
+        if s['submitted']:
+            print(f"Input events: {s['executed']}/{s['submitted']} executed, {s['dropped']} dropped, "
+                  f"max backlog {s['max_backlog']}, delay avg {s['avg_delay']:.1f} ms max {s['max_delay']:.1f} ms")
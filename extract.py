@@ -0,0 +1,214 @@
+"""
+Offline landmark extraction for recorded hand videos.
+
+Each video is split into chunks of frames that a process pool works on
+in parallel. Every worker builds its HandDetector and its models once,
+in the pool initializer, and writes its chunk to memory-mapped .npy
+arrays. The detector's ROI tracking is reset at the start of every
+chunk and the model is warmed up on a few frames before it, so the
+output does not depend on which worker got which chunk. When all
+chunks of a video are done they are merged into one .npz recording per
+video, in the format LandmarkRecorder writes, so the result can be
+replayed with `python recording.py <video>.npz`. Videos are told apart
+by file name, so the names must be unique.
+
+    python extract.py videos/*.mp4 -o landmarks --workers 8
+"""
+import argparse
+import multiprocessing
+import os
+import time
+
+import cv2
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from recording import HANDEDNESS
+
+# Per-process detector, created by init_worker
+_detector = None
+_mirror = True
+
+CHUNK_ARRAYS = ('timestamps', 'landmarks', 'bbox', 'handedness')
+
+
+def init_worker(detector_args, mirror):
+    """Pool initializer, builds the detector once per worker process"""
+    global _detector, _mirror
+    # One inference thread per process, the pool provides the parallelism
+    cv2.setNumThreads(1)
+    from HandTrackingModule import HandDetector
+    _detector = HandDetector(**detector_args)
+    _mirror = mirror
+
+
+def video_info(path):
+    """
+    :return: Frame count, frame rate and (height, width) of a video
+    """
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open {path}")
+    count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    shape = (int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)))
+    cap.release()
+    return count, fps, shape
+
+
+def make_chunks(videos, out_dir, chunk_size, overlap=0):
+    """
+    :return: List of chunk tasks (video, first frame, end frame, fps, chunk file prefix, warm-up frames)
+    """
+    tasks = []
+    for video in videos:
+        count, fps, _ = video_info(video)
+        stem = os.path.splitext(os.path.basename(video))[0]
+        for start in range(0, count, chunk_size):
+            prefix = os.path.join(out_dir, f"{stem}.{start:08d}")
+            tasks.append((video, start, min(start + chunk_size, count), fps, prefix, overlap))
+    return tasks
+
+
+def extract_chunk(task):
+    """
+    Worker: run the detector over frames [start, end) of a video and write
+    the results to memory-mapped arrays next to `prefix`. The `overlap`
+    frames before the chunk are run but not written, so the video-mode
+    tracking is in the state it would have in a sequential pass.
+    :return: Chunk prefix, frames processed, processing time (seconds)
+    """
+    video, start, end, fps, prefix, overlap = task
+    n = end - start
+    maxHands = _detector.maxHands
+    arrays = {
+        'timestamps': open_memmap(prefix + '.timestamps.npy', 'w+', np.float64, (n,)),
+        'landmarks': open_memmap(prefix + '.landmarks.npy', 'w+', np.int16, (n, maxHands, 21, 3)),
+        'bbox': open_memmap(prefix + '.bbox.npy', 'w+', np.int16, (n, maxHands, 4)),
+        'handedness': open_memmap(prefix + '.handedness.npy', 'w+', np.int8, (n, maxHands))
+    }
+    arrays['handedness'][:] = 0
+
+    t0 = time.perf_counter()
+    # The models are kept, the warm-up frames replace the tracking state they carry over
+    _detector.resetTracking()
+    first = max(start - overlap, 0)
+    cap = cv2.VideoCapture(video)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+    for k in range(first, start):
+        success, img = cap.read()
+        if not success:
+            break
+        _detector.findHands(img, draw=False, flipType=False, mirror=_mirror, asArray=True, timestamp=k / fps)
+    done = 0
+    for i in range(n):
+        success, img = cap.read()
+        if not success:
+            break
+        # Same landmark convention as the live app: mirrored, handedness as seen by the user
+        timestamp = (start + i) / fps
+        hands, _ = _detector.findHands(img, draw=False, flipType=False, mirror=_mirror, asArray=True,
+                                       timestamp=timestamp)
+        arrays['timestamps'][i] = timestamp
+        for j, hand in enumerate(hands[:maxHands]):
+            arrays['landmarks'][i, j] = hand.lmArray
+            arrays['bbox'][i, j] = hand.bbox
+            arrays['handedness'][i, j] = HANDEDNESS.index(hand.type)
+        done += 1
+    cap.release()
+    for array in arrays.values():
+        array.flush()
+    with open(prefix + '.count', 'w') as f:
+        f.write(str(done))
+    return prefix, done, time.perf_counter() - t0
+
+
+def merge_chunks(video, prefixes, out_dir, keep_chunks=False):
+    """
+    Concatenate the chunks of a video into one recording.
+    :return: Path of the recording
+    """
+    _, _, shape = video_info(video)
+    parts = {name: [] for name in CHUNK_ARRAYS}
+    for prefix in sorted(prefixes):
+        with open(prefix + '.count') as f:
+            done = int(f.read())
+        for name in CHUNK_ARRAYS:
+            parts[name].append(np.load(prefix + f'.{name}.npy', mmap_mode='r')[:done])
+    merged = {name: np.concatenate(parts[name]) for name in CHUNK_ARRAYS}
+    merged['predicted'] = np.zeros(len(merged['timestamps']), bool)
+    merged['frame_shape'] = np.array(shape, np.int32)
+    merged['screen_size'] = np.zeros(2, np.int32)
+    path = os.path.join(out_dir, os.path.splitext(os.path.basename(video))[0] + '.npz')
+    np.savez(path, **merged)
+    del parts
+
+    if not keep_chunks:
+        for prefix in prefixes:
+            for name in CHUNK_ARRAYS:
+                os.remove(prefix + f'.{name}.npy')
+            os.remove(prefix + '.count')
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract hand landmarks from videos with a process pool")
+    parser.add_argument("videos", nargs="+", help="Video files")
+    parser.add_argument("-o", "--out", default="landmarks", help="Output directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument("--chunk", type=int, default=600, help="Frames per chunk")
+    parser.add_argument("--max-hands", type=int, default=2, help="Maximum hands per frame")
+    parser.add_argument("--complexity", type=int, default=1, help="Model complexity (0 or 1)")
+    parser.add_argument("--detection-con", type=float, default=0.8, help="Minimum detection confidence")
+    parser.add_argument("--scale", type=float, default=1.0, help="Downscale factor before detection")
+    parser.add_argument("--overlap", type=int, default=15, help="Warm-up frames run before each chunk")
+    parser.add_argument("--static", action="store_true", help="Detect every frame independently, without tracking")
+    parser.add_argument("--no-mirror", action="store_true", help="Keep the video's orientation (already mirrored videos)")
+    parser.add_argument("--keep-chunks", action="store_true", help="Keep the per-chunk arrays")
+    args = parser.parse_args()
+
+    # Outputs are named after the file name, two videos with the same one would overwrite each other
+    stems = [os.path.splitext(os.path.basename(video))[0] for video in args.videos]
+    duplicates = sorted({stem for stem in stems if stems.count(stem) > 1})
+    if duplicates:
+        parser.error(f"Videos with the same file name: {', '.join(duplicates)}")
+
+    os.makedirs(args.out, exist_ok=True)
+    tasks = make_chunks(args.videos, args.out, args.chunk, 0 if args.static else args.overlap)
+    total = sum(task[2] - task[1] for task in tasks)
+    workers = max(1, min(args.workers, len(tasks)))
+    print(f"{len(args.videos)} videos, {total} frames in {len(tasks)} chunks on {workers} workers")
+
+    detector_args = {
+        'staticMode': args.static,
+        'maxHands': args.max_hands,
+        'modelComplexity': args.complexity,
+        'detectionCon': args.detection_con,
+        'processScale': args.scale
+    }
+    chunks = {}
+    frames = 0
+    busy = 0.0
+    t0 = time.perf_counter()
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(detector_args, not args.no_mirror)) as pool:
+        for k, (prefix, done, elapsed) in enumerate(pool.imap_unordered(extract_chunk, tasks), 1):
+            chunks[prefix] = done
+            frames += done
+            busy += elapsed
+            wall = time.perf_counter() - t0
+            print(f"[{k}/{len(tasks)}] {os.path.basename(prefix)}: {done} frames at {done / elapsed:.1f} fps | "
+                  f"total {frames}/{total} frames, {frames / wall:.1f} fps, {frames / busy:.1f} fps per core")
+
+    for video in args.videos:
+        stem = os.path.splitext(os.path.basename(video))[0]
+        prefixes = [p for p in chunks if os.path.basename(p).rsplit('.', 1)[0] == stem]
+        if prefixes:
+            print(f"Wrote {merge_chunks(video, prefixes, args.out, args.keep_chunks)}")
+
+    wall = time.perf_counter() - t0
+    print(f"Extracted {frames} frames in {wall:.1f}s: {frames / wall:.1f} fps on {workers} workers, "
+          f"{frames / wall / workers:.1f} fps per core")
+
+
+if __name__ == "__main__":
+    main()
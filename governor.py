@@ -0,0 +1,87 @@
+class FpsGovernor:
+    """
+    Adapts the processing quality to the speed of the machine. Each frame
+    reports its end-to-end latency (capture to display) and the time spent
+    processing it. When the smoothed values miss the target frame rate or
+    the latency budget for `downFrames` frames in a row, the governor steps
+    down one quality level; when there is clear headroom for `upFrames`
+    frames it steps back up. Different thresholds and frame counts in the
+    two directions keep it from oscillating between levels.
+    """
+
+    def __init__(self, levels, targetFps=30, latencyBudget=0.1, downFrames=30, upFrames=150,
+                 upMargin=0.6, settleFrames=30, smoothing=0.1):
+        """
+        :param levels: Quality levels, best first, as (width, height, processScale, modelComplexity)
+        :param targetFps: Frame rate the processing has to keep up with
+        :param latencyBudget: Maximum end-to-end latency (seconds)
+        :param downFrames: Consecutive missing frames before stepping down
+        :param upFrames: Consecutive frames with headroom before stepping up
+        :param upMargin: Fraction of the budgets that counts as headroom
+        :param settleFrames: Frames ignored after a level change
+        :param smoothing: Weight of the newest sample in the moving averages
+        """
+        self.levels = levels
+        self.targetFps = targetFps
+        self.latencyBudget = latencyBudget
+        self.downFrames = downFrames
+        self.upFrames = upFrames
+        self.upMargin = upMargin
+        self.settleFrames = settleFrames
+        self.smoothing = smoothing
+        self.level = 0
+        self.latency = None
+        self.busy = None
+        self.missCount = 0
+        self.headroomCount = 0
+        self.settle = settleFrames
+
+    def current(self):
+        """
+        :return: Current level as (width, height, processScale, modelComplexity)
+        """
+        return self.levels[self.level]
+
+    def update(self, latency, busy):
+        """
+        Feed the measurements of one frame.
+        :param latency: End-to-end latency of the frame (seconds)
+        :param busy: Processing time of the frame, without waiting for the camera (seconds)
+        :return: New level if it changed, otherwise None
+        """
+        if self.settle > 0:
+            self.settle -= 1
+            return None
+        if self.latency is None:
+            self.latency, self.busy = latency, busy
+        else:
+            self.latency += self.smoothing * (latency - self.latency)
+            self.busy += self.smoothing * (busy - self.busy)
+
+        frameBudget = 1.0 / self.targetFps
+        if self.latency > self.latencyBudget or self.busy > frameBudget:
+            self.missCount += 1
+            self.headroomCount = 0
+        elif self.latency < self.latencyBudget * self.upMargin and self.busy < frameBudget * self.upMargin:
+            self.headroomCount += 1
+            self.missCount = 0
+        else:
+            self.missCount = 0
+            self.headroomCount = 0
+
+        if self.missCount >= self.downFrames and self.level < len(self.levels) - 1:
+            return self.setLevel(self.level + 1)
+        if self.headroomCount >= self.upFrames and self.level > 0:
+            return self.setLevel(self.level - 1)
+        return None
+
+    def setLevel(self, level):
+        print(f"Governor: latency {self.latency * 1000:.1f} ms, processing {self.busy * 1000:.1f} ms, "
+              f"level {self.level} -> {level} {self.levels[level]}")
+        self.level = level
+        self.missCount = 0
+        self.headroomCount = 0
+        self.latency = None
+        self.busy = None
+        self.settle = self.settleFrames
+        return self.levels[level]
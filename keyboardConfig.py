@@ -50,6 +50,64 @@ custom_keys = {
         }
 }
 
+class KeyboardIndex:
+    """
+    Hit-test index for a keyboard layout. A grid over the layout's
+    bounding box holds the index of the button covering each pixel, so
+    the button under a point is one array lookup, independent of the
+    number of keys and of their sizes (keys spanning several rows work
+    too). Bounds are exclusive on all sides, like the original
+    per-button check.
+    """
+
+    def __init__(self, buttonList):
+        self.buttonList = list(buttonList)
+        self.build()
+
+    def build(self):
+        if not self.buttonList:
+            self.origin = (0, 0)
+            self.grid = np.full((0, 0), -1, np.int16)
+            return
+        x0 = min(int(b.pos[0]) for b in self.buttonList)
+        y0 = min(int(b.pos[1]) for b in self.buttonList)
+        x1 = max(int(b.pos[0] + b.size[0]) for b in self.buttonList)
+        y1 = max(int(b.pos[1] + b.size[1]) for b in self.buttonList)
+        self.origin = (x0, y0)
+
+        self.grid = np.full((y1 - y0, x1 - x0), -1, np.int16)
+        for i, b in enumerate(self.buttonList):
+            x, y = int(b.pos[0]) - x0, int(b.pos[1]) - y0
+            w, h = int(b.size[0]), int(b.size[1])
+            self.grid[y + 1:y + h, x + 1:x + w] = i
+
+    def hit(self, point):
+        """
+        :param point: (x, y) pixel coordinates
+        :return: Button under the point or None
+        """
+        x, y = int(point[0]) - self.origin[0], int(point[1]) - self.origin[1]
+        if 0 <= y < self.grid.shape[0] and 0 <= x < self.grid.shape[1]:
+            i = self.grid[y, x]
+            if i >= 0:
+                return self.buttonList[i]
+        return None
+
+    def query(self, points):
+        """
+        Vectorized hit test for several points at once, e.g. both hands or several fingertips.
+        :param points: (N, 2) array of (x, y) pixel coordinates
+        :return: (N,) array of button indices into buttonList, -1 where no button was hit
+        """
+        pts = np.asarray(points, np.int64).reshape(-1, 2)
+        xs = pts[:, 0] - self.origin[0]
+        ys = pts[:, 1] - self.origin[1]
+        result = np.full(len(pts), -1, np.int64)
+        inside = (xs >= 0) & (xs < self.grid.shape[1]) & (ys >= 0) & (ys < self.grid.shape[0])
+        result[inside] = self.grid[ys[inside], xs[inside]]
+        return result
+
+
 def init_keyboard(start_x, start_y, buttonList, size=button_size, keys = keys, custom_keys = custom_keys):
     current_x, current_y = start_x, start_y
     for i in range(len(keys)):
@@ -68,3 +126,4 @@ def init_keyboard(start_x, start_y, buttonList, size=button_size, keys = keys, c
                 action = [lambda k=current_key: keyboard.press(k), lambda k=current_key: keyboard.release(k)]
                 buttonList.append(Button([current_x, current_y], key, size, action=action))
                 current_x += size[0] + button_interval
+    return KeyboardIndex(buttonList)
@@ -4,87 +4,219 @@ import numpy as np
 from pynput.keyboard import Controller
 import time
 from button import Button
+from capture import FrameGrabber
+from scheduler import DetectionScheduler, LandmarkPredictor
+from presence import PresenceGate
+from governor import FpsGovernor
+from profiler import StageTracer
+from preview import PreviewWorker
+from overlay import KeyboardCompositor, HudLayer
+from cursor import CursorOutput
+from dispatcher import ActionDispatcher
+from recording import LandmarkRecorder, ReplaySource, InputLog
+from functools import partial
 import keyboardConfig
 from config import *
 import autopy
 import ctypes
-from algorithm_setting import LowPassFilter, MovingAverageFilter, ExtendedKalmanFilterWrapper, KalmanFilterWrapper, PerformanceEvaluator
+from algorithm_setting import FILTERS, make_filter, load_filter_profile, PerformanceEvaluator, ShadowEvaluator, CursorPredictor
 
 class GestureControlApp:
-    def __init__(self):
+    def __init__(self, replay=None):
+        """
+        :param replay: ReplaySource to run on instead of the camera, defaults to config.replay_path
+        """
         # Initialize keyboard controller and hand detector
         self.keyboard = Controller()
-        self.detector = HandDetector(detectionCon=0.8)
-        self.cap = cv2.VideoCapture(camaraIdx)
+        self.tracer = StageTracer(enabled=trace_stages)
+        self.detector = HandDetector(detectionCon=0.8, processScale=detection_scale, roiTracking=roi_tracking,
+                                     roiSize=roi_size, roiPredict=roi_predict, tracer=self.tracer)
+        # The camera is opened in init(), replays never open it
+        if replay is None and replay_path:
+            replay = ReplaySource(replay_path, realtime=replay_realtime)
+        self.replay = replay
+        self.cap = None
+        self.grabber = replay
+        self.presence = PresenceGate(motionThreshold=motion_threshold, idleTimeout=idle_timeout, idleFps=idle_fps) if presence_gate else None
+        self.scheduler = DetectionScheduler(interval=detect_interval, maxError=detect_max_error)
+        self.predictor = LandmarkPredictor()
+        # Headless runs skip every drawing call and the preview window
+        self.render = not headless
+        self.preview = PreviewWorker(self.detector, fps=preview_fps) if headless and preview_fps else None
+        self.governor = FpsGovernor(governor_levels, targetFps=target_fps, latencyBudget=latency_budget) if fps_governor else None
         self.finalText = ""
 
+        # Key presses and clicks are injected off the frame loop and debounced on capture time
+        self.dispatcher = ActionDispatcher(maxSize=action_queue_size, debounce=click_interval)
+
         # Initialize global variables
         self.last_state_time = 0
-        self.last_click_time = 0
         self.indexLm = 8
         self.clickLm = 4
         self.buttonList = []
+        self.keyIndex = None
         self.fingers_up = []
-        self.wScr, self.hScr = autopy.screen.size()
+        # Replays log the input instead of injecting it
+        self.input_log = InputLog() if self.replay else None
+        self.mouse = self.input_log or autopy.mouse
+        if self.replay and self.replay.screenSize:
+            self.wScr, self.hScr = self.replay.screenSize
+        else:
+            self.wScr, self.hScr = autopy.screen.size()
+        self.recorder = LandmarkRecorder(record_path, frameSize=record_frames, screenSize=(self.wScr, self.hScr)) \
+            if record_path and not self.replay else None
+        # Mouse output at the display rate, decoupled from the camera
+        self.cursor_output = CursorOutput(self.mouse.move, self.mouse.click, rate=cursor_output_rate,
+                                          delay=cursor_output_delay, screen=(self.wScr, self.hScr)) if cursor_output_rate else None
         self.pLocx, self.pLocy = 0, 0
         self.cLocx, self.cLocy = 0, 0
         self.prev_x1, self.prev_y1 = 0, 0
         self.current_mode = 0
         self.finger_state = 0
         self.finger_count = 0
+        self.frame_size = None
+        self.pt1, self.pt2 = (0, 0), (0, 0)
 
-        # Initialize filters and performance evaluator
-        self.lowpass_filter_x = LowPassFilter()
-        self.lowpass_filter_y = LowPassFilter()
-        self.ekf = ExtendedKalmanFilterWrapper(dt=1/30.0)
-        self.moving_avg_filter_x = MovingAverageFilter()
-        self.moving_avg_filter_y = MovingAverageFilter()
-        self.kf = KalmanFilterWrapper(dt=1/30.0)
-        self.evaluator = PerformanceEvaluator()
+        # Initialize the cursor filter and performance evaluator, the other filters only run as shadows
+        # Tuned parameters from the profile, the steady-state switch stays a config setting
+        filter_options = load_filter_profile(filter_profile) if filter_profile else {}
+        kf_options = filter_options.setdefault('kf', {})
+        if kf_options.get('steady_state', kf_steady_state) != kf_steady_state:
+            print(f"Warning: {filter_profile} was tuned with kf steady_state={kf_options['steady_state']}, "
+                  f"running with {kf_steady_state}")
+        kf_options['steady_state'] = kf_steady_state
+        self.filter = make_filter(active_filter, dt=1/30.0, **filter_options.get(active_filter, {}))
+        self.filter_position = None
+        shadows = [name for name in (FILTERS if shadow_filters is None else shadow_filters) if name != active_filter]
+        shadows = shadows if shadow_mode else []
+        # The worker thread drops measurements when it falls behind, replays evaluate every one inline
+        mode, sample_rate = shadow_mode, shadow_sample_rate
+        if self.replay and shadow_mode == 'thread':
+            mode, sample_rate = 'sample', 1.0
+        self.evaluator = PerformanceEvaluator(window=metrics_window, spill_path=metrics_spill,
+                                              algos=[active_filter] + shadows)
+        self.shadow = ShadowEvaluator(self.evaluator, active_filter, shadows, mode=mode,
+                                      sample_rate=sample_rate, dt=1/30.0, options=filter_options)
+        self.cursor_predictor = CursorPredictor(lead=cursor_lead, max_lead=cursor_max_lead, max_distance=cursor_max_distance,
+                                                extra_latency=cursor_extra_latency)
+        self.compositor = KeyboardCompositor(self.buttonList)
+        self.hud = HudLayer(refreshInterval=hud_refresh)
 
     def init(self, videoWidth=videoWidth, videoHeight=videoHeight):
         """Initialize camera and keyboard buttons"""
-        self.cap.set(3, videoWidth)
-        self.cap.set(4, videoHeight)
+        if self.grabber is None:
+            self.cap = cv2.VideoCapture(camaraIdx)
+            self.grabber = FrameGrabber(self.cap, threaded=threaded_capture, source=camaraIdx)
+        self.grabber.setResolution(videoWidth, videoHeight)
         if click_mode == 0:
             self.indexLm = 8
             self.clickLm = 12
         elif click_mode == 1:
             self.indexLm = 8
             self.clickLm = 4
-        keyboardConfig.init_keyboard(keyboard_start_x, keyboard_start_y, self.buttonList, button_size)
+        self.keyIndex = keyboardConfig.init_keyboard(keyboard_start_x, keyboard_start_y, self.buttonList, button_size)
+        self.compositor.invalidate()
+        self.grabber.start()
+        if self.cursor_output:
+            self.cursor_output.start()
+        self.dispatcher.start()
+
+    def update_geometry(self, img):
+        """Recalculate the mapping rectangle when the frame size changes"""
+        h, w = img.shape[:2]
+        if (w, h) != self.frame_size:
+            if self.frame_size is not None:
+                # Pixel coordinates of tracked hands are no longer valid
+                self.predictor.reset()
+                self.detector.resetTracking()
+            self.frame_size = (w, h)
+            self.pt1 = (int(0.2 * w), int(0.2 * h))
+            self.pt2 = (int(0.8 * w), int(0.8 * h))
+        return self.pt1, self.pt2
+
+    def apply_quality(self, level):
+        """Apply a governor level: capture resolution, detection scale and model complexity"""
+        width, height, scale, complexity = level
+        self.grabber.setResolution(width, height)
+        self.detector.processScale = scale
+        self.detector.setModelComplexity(complexity)
+
+    def find_hands(self, img, frame_time):
+        """Detect hands, or predict them from the last detection when the scheduler allows it"""
+        if self.replay:
+            # Recorded pipeline output, the model does not run
+            hands = self.replay.hands
+            if self.render:
+                img = self.detector.mirrorImage(img)
+                for hand in hands:
+                    self.detector.drawHand(img, hand.lmArray, hand.bbox.tolist(), hand.type)
+            return hands, img, self.replay.predicted
+
+        if self.presence and not self.presence.update(img, frame_time, bool(self.predictor.hands)):
+            # Static scene without hands, skip the model entirely
+            return [], self.detector.mirrorImage(img) if self.render else img, False
+
+        if self.scheduler.shouldDetect(bool(self.predictor.hands), self.predictor.expectedError()):
+            # Landmarks are mirrored by the detector, the frame is only flipped for display
+            hands, img = self.detector.findHands(img, draw=self.render, flipType=False, mirror=True, asArray=True,
+                                                timestamp=frame_time)
+            self.predictor.update(hands, frame_time)
+            self.scheduler.detected()
+            return hands, img, False
+
+        hands = self.predictor.predict(frame_time)
+        if self.render:
+            with self.tracer.stage("preprocess"):
+                img = self.detector.mirrorImage(img)
+            for hand in hands:
+                self.detector.drawHand(img, hand.lmArray, hand.bbox.tolist(), hand.type)
+        self.scheduler.predicted()
+        return hands, img, True
 
     def draw_all(self, img):
         """Draw all buttons and text on the image"""
-        imgNew = np.zeros_like(img, np.uint8)
-        for button in self.buttonList:
-            button.draw(imgNew, buttonColor=buttonColor, textColor=textColor, fontScale=2, thickness=3)
-        
-        cv2.rectangle(imgNew, (50, 550), (700, 650), (210, 146, 192), cv2.FILLED)
-        cv2.putText(imgNew, self.finalText, (60, 625), cv2.FONT_HERSHEY_PLAIN, 5, textColor, 5)
-
-        out = img.copy()
-        alpha = 0.5
-        mask = imgNew.astype(bool)
-        out[mask] = cv2.addWeighted(img, alpha, imgNew, 1 - alpha, 0)[mask]
-        return out
+        # The keyboard layer is cached, only the typed text is re-rendered when it changes
+        self.compositor.setText(self.finalText)
+        return self.compositor.composite(img)
 
-    def is_clicked(self, lmList, bboxInfo, img, dynamic_scale=0.08, click_interval=1):
-        """Check if a button is clicked"""
-        x1, y1 = lmList[self.indexLm][0], lmList[self.indexLm][1]
-        x2, y2 = lmList[self.clickLm][0], lmList[self.clickLm][1]
+    def is_clicked(self, lmList, bboxInfo, img, dynamic_scale=0.08):
+        """Check if the click fingers touch, debouncing is left to the dispatcher"""
+        x1, y1 = lmList[self.indexLm][:2].tolist()
+        x2, y2 = lmList[self.clickLm][:2].tolist()
 
         # clickThreshold_old = 25 + (bboxInfo[2] + bboxInfo[3]) * dynamic_scale
         clickThreshold = 25 + np.sqrt(bboxInfo[2] * bboxInfo[3]) * dynamic_scale
         l, _, _ = self.detector.findDistance((x1, y1), (x2, y2), img)
-        return l < clickThreshold and time.time() - self.last_click_time >= click_interval
+        return l < clickThreshold
+
+    def mouse_move(self, x, y):
+        """Move the mouse, through the output thread when it runs"""
+        if self.cursor_output:
+            self.cursor_output.move(x, y)
+        else:
+            self.mouse.move(x, y)
 
-    def check_finger_mode_switch(self):
-        """Check for mode switching based on finger count"""
+    def mouse_click(self, timestamp, button=None):
+        """Click, queued behind the pending moves when the output thread runs, otherwise on the dispatcher"""
+        if self.cursor_output:
+            # Only a queued click counts for the debounce, as on the dispatcher
+            if self.dispatcher.due('mouse', timestamp):
+                self.cursor_output.click(button)
+                self.dispatcher.record('mouse', timestamp)
+        elif button is None:
+            self.dispatcher.submit([self.mouse.click], timestamp, channel='mouse', name="click")
+        else:
+            self.dispatcher.submit([partial(self.mouse.click, button=button)], timestamp, channel='mouse', name="click")
+
+    def check_finger_mode_switch(self, timestamp):
+        """
+        Check for mode switching based on finger count
+        :param timestamp: Capture time of the frame, the switch delay is timed on it so replays behave the same
+        """
         if self.finger_count == 5:
             self.finger_state = 1
-            self.last_state_time = time.time()
-        elif self.finger_count < 5 and self.finger_state == 1 and self.finger_count > 0 and time.time() - self.last_state_time > switch_delay:
+            self.last_state_time = timestamp
+        elif self.finger_count < 5 and self.finger_state == 1 and self.finger_count > 0 and timestamp - self.last_state_time > switch_delay:
             self.finger_state = 0
         elif self.finger_count == 0 and self.finger_state == 1:
             self.current_mode = 1 - self.current_mode  # Toggle mode
@@ -92,168 +224,225 @@ class GestureControlApp:
             print(f"Mode has switched to {self.current_mode}")
         return self.current_mode
 
-    def apply_filters_and_record(self, x3, y3):
-        """Apply different filters and record metrics"""
-        # Low-pass filter
-        lp_x = self.lowpass_filter_x.filter(x3)
-        lp_y = self.lowpass_filter_y.filter(y3)
-        lp_error = np.sqrt((lp_x - x3)**2 + (lp_y - y3)**2)
-        self.evaluator.record('lowpass', (lp_x, lp_y), lp_error)
+    def apply_filters_and_record(self, x3, y3, predicted=False, frame_time=None):
+        """Apply the active filter and hand the measurement to the shadow evaluation"""
+        if predicted:
+            # No measurement on this frame, Kalman filters extrapolate the cursor, the others hold it
+            if hasattr(self.filter, 'predict'):
+                self.filter.predict(frame_time)
+                state = self.filter.get_state()
+                return state[0], state[1]
+            if self.filter_position is not None:
+                return self.filter_position[0], self.filter_position[1]
 
-        # Extended Kalman Filter
         z = np.array([x3, y3])
-        self.ekf.predict()
-        self.ekf.update(z)
-        ekf_x, ekf_y = self.ekf.get_state()[0], self.ekf.get_state()[1]
-        ekf_error = np.sqrt((ekf_x - x3)**2 + (ekf_y - y3)**2)
-        self.evaluator.record('ekf', (ekf_x, ekf_y), ekf_error)
-
-        # Moving Average filter
-        ma_x = self.moving_avg_filter_x.filter(x3)
-        ma_y = self.moving_avg_filter_y.filter(y3)
-        ma_error = np.sqrt((ma_x - x3)**2 + (ma_y - y3)**2)
-        self.evaluator.record('moving_avg', (ma_x, ma_y), ma_error)
-
-        # Kalman Filter
-        self.kf.predict()
-        self.kf.update(z)
-        kf_x, kf_y = self.kf.get_state()[0], self.kf.get_state()[1]
-        kf_error = np.sqrt((kf_x - x3)**2 + (kf_y - y3)**2)
-        self.evaluator.record('kf', (kf_x, kf_y), kf_error)
-
-        return ekf_x, ekf_y
+        self.filter_position = self.filter.filter(z, frame_time)
+        self.shadow.submit(z, self.filter_position, frame_time)
+        return self.filter_position[0], self.filter_position[1]
 
     def display_metrics(self, img):
         """Display performance metrics on screen"""
-        metrics = self.evaluator.get_metrics()
-        y_pos = 30
-        for algo in metrics:
-            text = f"{algo}: Avg Err {metrics[algo]['avg_error']:.2f} | Max Err {metrics[algo]['max_error']:.2f} | Avg Jitter {metrics[algo]['avg_jitter']:.2f} | Max Jitter {metrics[algo]['max_jitter']:.2f}"
-            cv2.putText(img, text, (10, y_pos), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-            y_pos += 30
+        # Metrics are re-rendered at the HUD refresh rate, in between the cached text is pasted
+        if self.hud.due():
+            metrics = self.evaluator.get_metrics()
+            lines = []
+            for algo in metrics:
+                lines.append(f"{algo}: Avg Err {metrics[algo]['avg_error']:.2f} | Max Err {metrics[algo]['max_error']:.2f} | Avg Jitter {metrics[algo]['avg_jitter']:.2f} | Max Jitter {metrics[algo]['max_jitter']:.2f}")
+            if self.cursor_predictor.lead:
+                cursor = self.cursor_predictor.get_metrics()
+                lines.append(f"cursor: Latency {cursor['latency']:.1f} ms | Lead {cursor['lead']:.1f} ms (avg {cursor['avg_lead']:.1f}) | Offset {cursor['offset']:.1f} px (avg {cursor['avg_offset']:.1f})")
+            self.hud.update(lines)
+        self.hud.paste(img)
 
     def run(self):
         """Run the gesture control application"""
         self.init()
+        if self.preview:
+            self.preview.start()
 
-        while True:
-            success, img = self.cap.read()
-            if not success:
-                continue
-            img = cv2.flip(img, 1)
-            # Get actual video dimensions
-            actual_width = int(self.cap.get(3))
-            actual_height = int(self.cap.get(4))
-            # Calculate rectangle coordinates
-            pt1, pt2 = (int(0.2 * actual_width), int(0.2 * actual_height)), (int(0.8 * actual_width), int(0.8 * actual_height))
-            
-            hands, img = self.detector.findHands(img, draw=True, flipType=False)
-            lmList, bboxInfo = [], []
-            if hands:
-                lmList, bboxInfo = hands[0]["lmList"], hands[0]["bbox"]
-                # Detect number of raised fingers
-                self.fingers_up = self.detector.fingersUp(hands[0])
-                self.finger_count = self.fingers_up.count(1)
+        try:
+            while True:
+                loop_start = time.time()
+                # Always work on the newest frame, stale ones are dropped by the grabber
+                with self.tracer.stage("capture"):
+                    success, img, frame_time = self.grabber.read()
+                if not success:
+                    if self.replay and self.replay.finished:
+                        break
+                    continue
+                read_done = time.time()
+                # Rectangle coordinates only change with the frame size
+                pt1, pt2 = self.update_geometry(img)
+
+                raw = img
+                hands, img, predicted = self.find_hands(img, frame_time)
+                if self.recorder:
+                    self.recorder.add(frame_time, hands, predicted, raw)
+                lmList, bboxInfo = [], []
+                if hands:
+                    lmList, bboxInfo = hands[0].lmArray, hands[0].bbox.tolist()
+                    # Detect number of raised fingers
+                    self.fingers_up = self.detector.fingersUpArray(lmList, hands[0].type)
+                    self.finger_count = int(self.fingers_up.sum())
             
-                # Check for mode switching
-                self.current_mode = self.check_finger_mode_switch()
-
-                # Draw bounding box and keypoints in normal mode
-                if bboxInfo and debugMode:
-                    l, _, _ = self.detector.findDistance((lmList[self.indexLm][0], lmList[self.indexLm][1]), (lmList[self.clickLm][0], lmList[self.clickLm][1]), img)
-                    bboxWidth = bboxInfo[2]
-                    bboxHeight = bboxInfo[3]
-                    sum_val = bboxInfo[2] + bboxInfo[3]
-                    # Debug output: (commented out in production)
-                    # print(f"boxWidth: {bboxWidth} boxHeight: {bboxHeight} sum: {sum_val} distance: {l:.2f} rate: {l/sum_val:.3f} threshold: {(5+sum_val*0.08):.2f}")
-
-                if self.current_mode == 0:
-                    # Draw rectangle on screen
-                    cv2.rectangle(img, pt1, pt2, (0, 255, 255), 5)
-                    # Get coordinates of index and thumb tips
-                    x1, y1 = lmList[8][:2]
-                    x2, y2 = lmList[4][:2]
-
-                    # Calculate movement distance
-                    movement = np.sqrt((x1 - self.prev_x1) ** 2 + (y1 - self.prev_y1) ** 2)
-
-                    # Move mouse if index finger raised and thumb down
-                    if self.fingers_up[1] and not self.fingers_up[0]:
-                        if pt1[0] - 10 <= x1 <= pt2[0] + 10 and pt1[1] - 10 <= y1 <= pt2[1] + 10:
-                            # Draw circle at index fingertip
-                            cv2.circle(img, (x1, y1), 15, (255, 255, 0), cv2.FILLED)
+                    # Check for mode switching
+                    self.current_mode = self.check_finger_mode_switch(frame_time)
+
+                    # Draw bounding box and keypoints in normal mode
+                    if bboxInfo and debugMode and self.render:
+                        l, _, _ = self.detector.findDistance(tuple(lmList[self.indexLm][:2].tolist()), tuple(lmList[self.clickLm][:2].tolist()), img)
+                        bboxWidth = bboxInfo[2]
+                        bboxHeight = bboxInfo[3]
+                        sum_val = bboxInfo[2] + bboxInfo[3]
+                        # Debug output: (commented out in production)
+                        # print(f"boxWidth: {bboxWidth} boxHeight: {bboxHeight} sum: {sum_val} distance: {l:.2f} rate: {l/sum_val:.3f} threshold: {(5+sum_val*0.08):.2f}")
+
+                    if self.current_mode == 0:
+                        # Draw rectangle on screen
+                        if self.render:
+                            cv2.rectangle(img, pt1, pt2, (0, 255, 255), 5)
+                        # Get coordinates of index and thumb tips
+                        x1, y1 = lmList[8][:2].tolist()
+                        x2, y2 = lmList[4][:2].tolist()
+
+                        # Calculate movement distance
+                        movement = np.sqrt((x1 - self.prev_x1) ** 2 + (y1 - self.prev_y1) ** 2)
+
+                        # Move mouse if index finger raised and thumb down
+                        if self.fingers_up[1] and not self.fingers_up[0]:
+                            if pt1[0] - 10 <= x1 <= pt2[0] + 10 and pt1[1] - 10 <= y1 <= pt2[1] + 10:
+                                # Draw circle at index fingertip
+                                if self.render:
+                                    cv2.circle(img, (x1, y1), 15, (255, 255, 0), cv2.FILLED)
                     
-                            # Raw coordinates
-                            x3 = np.interp(x1, (pt1[0], pt2[0]), (0, self.wScr))
-                            y3 = np.interp(y1, (pt1[1], pt2[1]), (0, self.hScr))
+                                # Raw coordinates
+                                x3 = np.interp(x1, (pt1[0], pt2[0]), (0, self.wScr))
+                                y3 = np.interp(y1, (pt1[1], pt2[1]), (0, self.hScr))
 
-                            # Apply filters and record metrics
-                            self.cLocx, self.cLocy = self.apply_filters_and_record(x3, y3)
+                                # Apply filters and record metrics
+                                with self.tracer.stage("filters"):
+                                    self.cLocx, self.cLocy = self.apply_filters_and_record(x3, y3, predicted, frame_time)
+                                    # Move the cursor ahead by the time the frame spent in the pipeline,
+                                    # replays run on the recorded clock and only add the configured extra latency
+                                    latency = 0.0 if self.replay else time.time() - frame_time
+                                    self.cLocx, self.cLocy = self.cursor_predictor.predict(
+                                        (self.cLocx, self.cLocy), self.filter, latency,
+                                        moving=movement > STATIC_THRESHOLD, timestamp=frame_time)
                             
-                            # Display performance metrics
-                            self.display_metrics(img)
-
-                            # Ensure coordinates are within valid range
-                            self.cLocx = max(0, min(self.cLocx, self.wScr - 1))
-                            self.cLocy = max(0, min(self.cLocy, self.hScr - 1))
-                            # Move mouse
-                            if movement > STATIC_THRESHOLD:
-                                autopy.mouse.move(self.cLocx, self.cLocy)
+                                # Display performance metrics
+                                if self.render:
+                                    with self.tracer.stage("draw"):
+                                        self.display_metrics(img)
+
+                                # Ensure coordinates are within valid range
+                                self.cLocx = max(0, min(self.cLocx, self.wScr - 1))
+                                self.cLocy = max(0, min(self.cLocy, self.hScr - 1))
+                                # Move mouse
+                                if movement > STATIC_THRESHOLD:
+                                    with self.tracer.stage("mouse"):
+                                        self.mouse_move(self.cLocx, self.cLocy)
                             
-                            # Update previous mouse position
-                            self.pLocx, self.pLocy = self.cLocx, self.cLocy
-
-                        self.prev_x1, self.prev_y1 = x1, y1
-
-                    # Left-click if right hand thumb and index close
-                    if hands[0]['type'] == 'Right':
-                        if self.is_clicked(lmList, bboxInfo, img, dynamic_scale=dynamic_scale, click_interval=click_interval) and self.fingers_up[0] and self.fingers_up[1]:
-                            autopy.mouse.click()
-                    # Right-click if left hand thumb and index close
-                    elif hands[0]['type'] == 'Left':
-                        if self.is_clicked(lmList, bboxInfo, img, dynamic_scale=dynamic_scale, click_interval=click_interval) and self.fingers_up[0] and self.fingers_up[1]:
-                            autopy.mouse.click(button=autopy.mouse.Button.RIGHT)
-
-            # Draw buttons and text in keyboard mode
-            if self.current_mode == 1:
-                img = self.draw_all(img)
+                                # Update previous mouse position
+                                self.pLocx, self.pLocy = self.cLocx, self.cLocy
+
+                            self.prev_x1, self.prev_y1 = x1, y1
+
+                        # Left-click if right hand thumb and index close
+                        canvas = img if self.render else None
+                        if hands[0].type == 'Right':
+                            if self.is_clicked(lmList, bboxInfo, canvas, dynamic_scale=dynamic_scale) and self.fingers_up[0] and self.fingers_up[1]:
+                                self.mouse_click(frame_time)
+                        # Right-click if left hand thumb and index close
+                        elif hands[0].type == 'Left':
+                            if self.is_clicked(lmList, bboxInfo, canvas, dynamic_scale=dynamic_scale) and self.fingers_up[0] and self.fingers_up[1]:
+                                self.mouse_click(frame_time, button=autopy.mouse.Button.RIGHT)
+
+                # Draw buttons and text in keyboard mode
+                if self.current_mode == 1:
+                    if self.render:
+                        with self.tracer.stage("draw"):
+                            img = self.draw_all(img)
         
-                # Detect button clicks in keyboard mode
-                if lmList and len(self.fingers_up) >= 5:
-                    midPoint = ((lmList[self.indexLm][0] + lmList[self.clickLm][0]) // 2, (lmList[self.indexLm][1] + lmList[self.clickLm][1]) // 2)
+                    # Detect button clicks in keyboard mode
+                    if len(lmList) and len(self.fingers_up) >= 5:
+                        midPoint = tuple(((lmList[self.indexLm][:2] + lmList[self.clickLm][:2]) // 2).tolist())
                     
-                    for button in self.buttonList:
-                        x, y = button.pos
-                        w, h = button.size
-                        
-                        if x < midPoint[0] < x + w and y < midPoint[1] < y + h:
-                            button.draw(img, buttonColor=buttonHoverColor, textColor=textColor, fontScale=4, thickness=4)
+                        # Key under the midpoint from the layout index
+                        button = self.keyIndex.hit(midPoint)
+                        if button is not None:
+                            if self.render:
+                                button.draw(img, buttonColor=buttonHoverColor, textColor=textColor, fontScale=4, thickness=4)
 
                             # Click button only when index and middle fingers raised
-                            if self.is_clicked(lmList, bboxInfo, img):# and self.fingers_up[0] and self.fingers_up[1]:
-                                if debugMode:
-                                    print("Clicked:", button.text)
-                                self.last_click_time = time.time()
-                                if button.action:
-                                    for func in button.action:
-                                        func()
-                                button.draw(img, buttonColor=buttonClickColor, textColor=textColor, fontScale=4, thickness=4)
-                                self.finalText += button.text
-
-                    cv2.circle(img, midPoint, 8, (255, 255, 255), 2)
-                    # if debugMode:
-                    #     x1, y1 = lmList[self.indexLm][0], lmList[self.indexLm][1]
-                    #     x2, y2 = lmList[self.clickLm][0], lmList[self.clickLm][1]
-                    #     l, _, _ = self.detector.findDistance((x1, y1), (x2, y2), img)
+                            if self.is_clicked(lmList, bboxInfo, img if self.render else None):# and self.fingers_up[0] and self.fingers_up[1]:
+                                # The key events run on the dispatcher thread, accepted unless debounced or the queue is full
+                                actions = [partial(self.input_log.key, button.text)] if self.input_log else button.action
+                                if self.dispatcher.submit(actions, frame_time, channel='keyboard', name=button.text):
+                                    if debugMode:
+                                        print("Clicked:", button.text)
+                                    if self.render:
+                                        button.draw(img, buttonColor=buttonClickColor, textColor=textColor, fontScale=4, thickness=4)
+                                    self.finalText += button.text
+
+                        if self.render:
+                            cv2.circle(img, midPoint, 8, (255, 255, 255), 2)
+                        # if debugMode:
+                        #     x1, y1 = lmList[self.indexLm][0], lmList[self.indexLm][1]
+                        #     x2, y2 = lmList[self.clickLm][0], lmList[self.clickLm][1]
+                        #     l, _, _ = self.detector.findDistance((x1, y1), (x2, y2), img)
                         
 
           
-            cv2.imshow(f"Image", img)
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
+                if self.render:
+                    with self.tracer.stage("display"):
+                        cv2.imshow(f"Image", img)
+                        key = cv2.waitKey(1) & 0xFF
+                    if key == ord('q'):
+                        break
+                    if key == ord('t') and self.tracer.enabled:
+                        self.tracer.report()
+                elif self.preview:
+                    self.preview.submit(img, hands, self.current_mode, (pt1, pt2), frame_time)
+                    if self.preview.quit:
+                        break
+
+                # Step quality down or up based on the measured latency
+                if self.governor:
+                    frame_end = time.time()
+                    level = self.governor.update(frame_end - frame_time, frame_end - read_done)
+                    if level:
+                        self.apply_quality(level)
+
+                # Drop to a low frame rate while idle
+                if self.presence:
+                    delay = self.presence.idleDelay(time.time() - loop_start)
+                    if delay:
+                        time.sleep(delay)
+        except KeyboardInterrupt:
+            # Headless runs are stopped with Ctrl+C
+            pass
 
-        self.cap.release()
-        cv2.destroyAllWindows()
+        if self.preview:
+            self.preview.stop()
+        if self.cursor_output:
+            self.cursor_output.stop()
+        self.dispatcher.stop()
+        self.grabber.stop()
+        if self.cap is not None:
+            self.cap.release()
+        if self.recorder:
+            self.recorder.save()
+        self.shadow.close()
+        self.evaluator.close()
+        if self.render or self.preview:
+            # Headless runs open no window, and headless OpenCV builds lack the call
+            cv2.destroyAllWindows()
+        if self.tracer.enabled:
+            self.tracer.report()
+            if trace_export:
+                self.tracer.exportChromeTrace(trace_export + ".json")
+                self.tracer.exportCsv(trace_export + ".csv")
+                print(f"Trace written to {trace_export}.json and {trace_export}.csv")
 
 if __name__ == "__main__":
     app = GestureControlApp()
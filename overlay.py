@@ -0,0 +1,164 @@
+import time
+
+import cv2
+import numpy as np
+
+from config import buttonColor, textColor
+
+
+class KeyboardCompositor:
+    """
+    Retained-mode overlay for the virtual keyboard. The button layer and
+    its blend mask are rendered once per layout (or frame size) into a
+    buffer covering only the keyboard region; the typed text box is
+    re-rendered only when the text changes. Each frame the layer is
+    blended into that region of the frame in place, using preallocated
+    buffers.
+    """
+
+    def __init__(self, buttonList, textBox=((50, 550), (700, 650)), alpha=0.5, margin=5):
+        """
+        :param buttonList: Buttons of the layout
+        :param textBox: Corners of the typed text box
+        :param alpha: Weight of the camera image in the blend
+        :param margin: Extra pixels around the buttons for the corner marks
+        """
+        self.buttonList = buttonList
+        self.textBox = textBox
+        self.alpha = alpha
+        self.margin = margin
+        self.frameSize = None
+        self.text = None
+        self.region = None
+
+    def invalidate(self):
+        """Force a rebuild, call after the layout changed"""
+        self.frameSize = None
+
+    def build(self, w, h):
+        (tx0, ty0), (tx1, ty1) = self.textBox
+        xs0 = [b.pos[0] for b in self.buttonList] + [tx0]
+        ys0 = [b.pos[1] for b in self.buttonList] + [ty0]
+        xs1 = [b.pos[0] + b.size[0] for b in self.buttonList] + [tx1]
+        ys1 = [b.pos[1] + b.size[1] for b in self.buttonList] + [ty1]
+        x0 = max(0, int(min(xs0)) - self.margin)
+        y0 = max(0, int(min(ys0)) - self.margin)
+        # Typed text may run past its box, keep the full row up to the frame edge
+        x1 = w
+        y1 = min(h, int(max(ys1)) + self.margin)
+        self.region = (x0, y0, x1, y1)
+
+        # Render the static buttons once, in frame coordinates, then keep the region
+        canvas = np.zeros((y1, x1, 3), np.uint8)
+        for button in self.buttonList:
+            button.draw(canvas, buttonColor=buttonColor, textColor=textColor, fontScale=2, thickness=3)
+        self.staticLayer = np.ascontiguousarray(canvas[y0:y1, x0:x1])
+        self.layer = self.staticLayer.copy()
+        self.mask = np.empty(self.layer.shape[:2], bool)
+        np.any(self.layer, axis=2, out=self.mask)
+        # uint8 view of the mask for cv2.copyTo, shares memory with the bool mask
+        self.mask8 = self.mask.view(np.uint8)
+        self.blend = np.empty_like(self.layer)
+        self.frameSize = (w, h)
+        self.renderText()
+
+    def setText(self, text):
+        """
+        Update the typed text, re-rendering only the text box rows when it changed.
+        """
+        if text == self.text:
+            return
+        self.text = text
+        if self.region is not None:
+            self.renderText()
+
+    def renderText(self):
+        x0, y0, x1, y1 = self.region
+        (tx0, ty0), (tx1, ty1) = self.textBox
+        rows = slice(max(ty0 - y0, 0), min(ty1 - y0 + self.margin, y1 - y0))
+        self.layer[rows] = self.staticLayer[rows]
+        cv2.rectangle(self.layer, (tx0 - x0, ty0 - y0), (tx1 - x0, ty1 - y0), buttonColor, cv2.FILLED)
+        cv2.putText(self.layer, self.text or "", (tx0 + 10 - x0, ty1 - 25 - y0), cv2.FONT_HERSHEY_PLAIN, 5,
+                    textColor, 5)
+        np.any(self.layer[rows], axis=2, out=self.mask[rows])
+
+    def composite(self, img):
+        """
+        Blend the keyboard layer into the image in place.
+        :return: The same image
+        """
+        h, w = img.shape[:2]
+        if self.frameSize != (w, h):
+            self.build(w, h)
+        x0, y0, x1, y1 = self.region
+        roi = img[y0:y1, x0:x1]
+        cv2.addWeighted(roi, self.alpha, self.layer, 1 - self.alpha, 0, dst=self.blend)
+        cv2.copyTo(self.blend, self.mask8, roi)
+        return img
+
+
+class HudLayer:
+    """
+    Metrics text rendered into a small buffer at its own refresh rate and
+    pasted onto every frame, instead of calling putText for each line on
+    every frame. The buffer grows to fit the measured text, so long or
+    many lines are only clipped by the frame.
+    """
+    FONT = cv2.FONT_HERSHEY_SIMPLEX
+    SCALE = 0.6
+    THICKNESS = 2
+    LINE_HEIGHT = 30
+
+    def __init__(self, origin=(10, 10), size=(1200, 200), refreshInterval=0.5):
+        """
+        :param origin: Top-left corner of the HUD in the frame
+        :param size: Initial width and height of the HUD buffer
+        :param refreshInterval: Seconds between re-renders
+        """
+        self.origin = origin
+        self.refreshInterval = refreshInterval
+        self.allocate(*size)
+        self.lastRefresh = -float("inf")
+
+    def allocate(self, width, height):
+        """Allocate the text buffer and its mask"""
+        self.buffer = np.zeros((height, width, 3), np.uint8)
+        self.mask = np.zeros((height, width), bool)
+        self.mask8 = self.mask.view(np.uint8)
+
+    def due(self, now=None):
+        """
+        :return: True when the HUD content should be refreshed
+        """
+        now = time.time() if now is None else now
+        return now - self.lastRefresh >= self.refreshInterval
+
+    def update(self, lines, now=None):
+        """
+        Re-render the HUD text.
+        :param lines: Text lines
+        """
+        self.lastRefresh = time.time() if now is None else now
+        sizes = [cv2.getTextSize(text, self.FONT, self.SCALE, self.THICKNESS) for text in lines]
+        width = max((w for (w, _), _ in sizes), default=0) + self.THICKNESS
+        height = 20 + self.LINE_HEIGHT * (len(lines) - 1) + max((b for _, b in sizes), default=0) + self.THICKNESS
+        if width > self.buffer.shape[1] or height > self.buffer.shape[0]:
+            self.allocate(max(width, self.buffer.shape[1]), max(height, self.buffer.shape[0]))
+        self.buffer[:] = 0
+        y_pos = 20
+        for text in lines:
+            cv2.putText(self.buffer, text, (0, y_pos), self.FONT, self.SCALE, (0, 255, 0), self.THICKNESS)
+            y_pos += self.LINE_HEIGHT
+        np.any(self.buffer, axis=2, out=self.mask)
+
+    def paste(self, img):
+        """
+        Copy the rendered text onto the image, clipped to its size.
+        """
+        x, y = self.origin
+        h = min(self.buffer.shape[0], img.shape[0] - y)
+        w = min(self.buffer.shape[1], img.shape[1] - x)
+        if h <= 0 or w <= 0:
+            return img
+        cv2.copyTo(self.buffer[:h, :w], self.mask8[:h, :w], img[y:y + h, x:x + w])
+        return img
@@ -0,0 +1,96 @@
+import cv2
+import numpy as np
+
+
+class PresenceGate:
+    """
+    Cheap check that decides whether a frame is worth sending to the hand
+    detector. While no hand is tracked, a tiny grayscale copy of the frame
+    is compared with the previous one and detection only runs when
+    something moved. After `idleTimeout` seconds without a hand or motion
+    the gate reports idle, so the caller can drop to `idleFps`; the next
+    motion wakes it up again.
+    """
+
+    def __init__(self, motionThreshold=3.0, idleTimeout=10.0, idleFps=5, refreshInterval=1.0, size=(64, 36)):
+        """
+        :param motionThreshold: Mean absolute gray level difference that counts as motion
+        :param idleTimeout: Seconds without hand or motion before going idle
+        :param idleFps: Frame rate while idle
+        :param refreshInterval: Run detection at least this often while not idle (seconds)
+        :param size: Size of the downscaled frame used for the motion check
+        """
+        self.motionThreshold = motionThreshold
+        self.idleTimeout = idleTimeout
+        self.idleFps = idleFps
+        self.refreshInterval = refreshInterval
+        self.size = size
+        self.idle = False
+        self.lastActive = 0.0
+        self.lastDetection = 0.0
+        self.motion = 0.0
+
+        # Preallocated buffers for the motion check
+        self.imgSmall = np.empty((size[1], size[0], 3), np.uint8)
+        self.gray = np.empty((size[1], size[0]), np.uint8)
+        self.prevGray = np.empty_like(self.gray)
+        self.diff = np.empty_like(self.gray)
+        self.hasPrev = False
+
+    def motionScore(self, img):
+        """
+        :param img: BGR frame
+        :return: Mean absolute difference to the previous frame (inf for the first one)
+        """
+        cv2.resize(img, self.size, dst=self.imgSmall, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.imgSmall, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        if self.hasPrev:
+            cv2.absdiff(self.gray, self.prevGray, dst=self.diff)
+            score = cv2.mean(self.diff)[0]
+        else:
+            score = float("inf")
+        self.gray, self.prevGray = self.prevGray, self.gray
+        self.hasPrev = True
+        return score
+
+    def update(self, img, timestamp, handPresent):
+        """
+        :param img: BGR frame
+        :param timestamp: Capture time of the frame
+        :param handPresent: True if hands were found on the previous frame
+        :return: True if the frame should go through hand detection
+        """
+        if handPresent:
+            # Tracking a hand, no need for the motion check
+            self.hasPrev = False
+            self.wake(timestamp)
+            return True
+
+        self.motion = self.motionScore(img)
+        if self.motion > self.motionThreshold:
+            self.wake(timestamp)
+            return True
+
+        if not self.idle and timestamp - self.lastActive > self.idleTimeout:
+            self.idle = True
+            print(f"No hand or motion for {self.idleTimeout}s, idling at {self.idleFps} fps")
+        if not self.idle and timestamp - self.lastDetection >= self.refreshInterval:
+            self.lastDetection = timestamp
+            return True
+        return False
+
+    def wake(self, timestamp):
+        self.lastActive = timestamp
+        self.lastDetection = timestamp
+        if self.idle:
+            self.idle = False
+            print("Motion detected, leaving idle mode")
+
+    def idleDelay(self, elapsed):
+        """
+        :param elapsed: Time already spent on the current frame (seconds)
+        :return: How long to sleep before the next frame (0 when not idle)
+        """
+        if not self.idle:
+            return 0.0
+        return max(0.0, 1.0 / self.idleFps - elapsed)
@@ -0,0 +1,86 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class PreviewWorker:
+    """
+    Low-rate diagnostic preview for headless runs. The frame loop hands
+    over the raw frame and its hands with submit(), which only stores
+    references; mirroring, drawing and cv2.imshow happen on this worker's
+    thread at no more than `fps` frames per second, off the hot path.
+
+    HighGUI windows must live on the main thread on macOS, so the preview
+    is meant for Linux and Windows deployments.
+    """
+
+    def __init__(self, detector, fps=5, windowName="Preview"):
+        """
+        :param detector: HandDetector used to draw the hands
+        :param fps: Maximum preview frame rate
+        :param windowName: Name of the preview window
+        """
+        self.detector = detector
+        self.fps = fps
+        self.windowName = windowName
+        self.pending = None
+        self.lastSubmit = 0.0
+        self.quit = False
+        self.running = False
+        self.thread = None
+        self.cond = threading.Condition()
+        self.imgMirror = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, name="PreviewWorker", daemon=True)
+        self.thread.start()
+        return self
+
+    def submit(self, img, hands, mode, rect, timestamp):
+        """
+        Offer a frame to the preview. Cheap when the preview is not due yet.
+        :param img: Raw (unmirrored) BGR frame, must not be modified afterwards
+        :param hands: Hand records with mirrored landmarks
+        :param mode: Current interaction mode
+        :param rect: Mouse mapping rectangle (pt1, pt2)
+        :param timestamp: Capture time of the frame
+        """
+        if timestamp - self.lastSubmit < 1.0 / self.fps:
+            return
+        self.lastSubmit = timestamp
+        with self.cond:
+            self.pending = (img, hands, mode, rect)
+            self.cond.notify()
+
+    def _loop(self):
+        while self.running:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending is not None or not self.running, 0.1)
+                job, self.pending = self.pending, None
+            if job is not None:
+                self.render(*job)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                self.quit = True
+
+    def render(self, img, hands, mode, rect):
+        if self.imgMirror is None or self.imgMirror.shape != img.shape:
+            self.imgMirror = np.empty_like(img)
+        out = cv2.flip(img, 1, dst=self.imgMirror)
+        for hand in hands:
+            self.detector.drawHand(out, hand.lmArray, hand.bbox.tolist(), hand.type)
+        if mode == 0:
+            cv2.rectangle(out, rect[0], rect[1], (0, 255, 255), 5)
+        cv2.putText(out, f"Mode {mode}  {time.strftime('%H:%M:%S')}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX,
+                    0.8, (0, 255, 0), 2)
+        cv2.imshow(self.windowName, out)
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
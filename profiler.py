@@ -0,0 +1,174 @@
+import csv
+import json
+import math
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class LatencyHistogram:
+    """
+    Fixed-size histogram of durations with logarithmic bins, so memory
+    stays constant however long the session runs. Percentiles are read
+    from the cumulative counts with the resolution of one bin (about 3%).
+    """
+
+    def __init__(self, minValue=1e-6, maxValue=10.0, binsPerDecade=80):
+        """
+        :param minValue: Smallest duration resolved (seconds)
+        :param maxValue: Largest duration resolved (seconds)
+        :param binsPerDecade: Number of bins per factor of 10
+        """
+        self.minValue = minValue
+        self.binsPerDecade = binsPerDecade
+        self.numBins = int(math.ceil(math.log10(maxValue / minValue) * binsPerDecade)) + 1
+        self.counts = np.zeros(self.numBins, np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        if value <= self.minValue:
+            index = 0
+        else:
+            index = min(int(math.log10(value / self.minValue) * self.binsPerDecade), self.numBins - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """
+        :param p: Percentile (0 - 100)
+        :return: Upper edge of the bin holding the percentile (seconds)
+        """
+        if not self.count:
+            return 0.0
+        index = int(np.searchsorted(np.cumsum(self.counts), math.ceil(self.count * p / 100.0)))
+        return min(self.minValue * 10 ** ((index + 1) / self.binsPerDecade), self.max)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Stage:
+    __slots__ = ("tracer", "name", "start")
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.start, time.perf_counter())
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class StageTracer:
+    """
+    Times the stages of the frame loop. Every stage gets a LatencyHistogram
+    for p50/p95/p99 reports, and the most recent `maxEvents` stage events
+    are kept for export as a Chrome trace (chrome://tracing, Perfetto) or
+    as CSV. When disabled, stage() returns a shared no-op context manager.
+    """
+
+    def __init__(self, enabled=False, maxEvents=200000):
+        """
+        :param enabled: Record timings
+        :param maxEvents: Number of events kept for export
+        """
+        self.enabled = enabled
+        self.histograms = {}
+        self.events = deque(maxlen=maxEvents)
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def stage(self, name):
+        """
+        Context manager timing one stage:
+            with tracer.stage("capture"):
+                ...
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def record(self, name, start, end):
+        """
+        Record a stage that ran from `start` to `end` (time.perf_counter()).
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.add(end - start)
+            self.events.append((name, start, end - start, threading.get_ident()))
+
+    def percentiles(self):
+        """
+        :return: Dict of stage name to count, mean, p50, p95, p99 and max (milliseconds)
+        """
+        with self.lock:
+            return {name: {
+                'count': h.count,
+                'mean': h.mean() * 1000,
+                'p50': h.percentile(50) * 1000,
+                'p95': h.percentile(95) * 1000,
+                'p99': h.percentile(99) * 1000,
+                'max': h.max * 1000
+            } for name, h in self.histograms.items()}
+
+    def report(self):
+        """Print the percentile table of all stages"""
+        stats = self.percentiles()
+        print(f"{'stage':<16}{'count':>8}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)")
+        for name, s in stats.items():
+            print(f"{name:<16}{s['count']:>8}{s['mean']:>9.2f}{s['p50']:>9.2f}{s['p95']:>9.2f}{s['p99']:>9.2f}{s['max']:>9.2f}")
+
+    def exportChromeTrace(self, path):
+        """
+        Write the recorded events in the Chrome trace-event JSON format.
+        """
+        with self.lock:
+            events = list(self.events)
+        trace = [{
+            'name': name,
+            'ph': 'X',
+            'ts': (start - self.origin) * 1e6,
+            'dur': duration * 1e6,
+            'pid': 0,
+            'tid': tid
+        } for name, start, duration, tid in events]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+    def exportCsv(self, path):
+        """
+        Write the recorded events as CSV with start and duration in microseconds.
+        """
+        with self.lock:
+            events = list(self.events)
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['stage', 'start_us', 'duration_us', 'thread'])
+            for name, start, duration, tid in events:
+                writer.writerow([name, f"{(start - self.origin) * 1e6:.1f}", f"{duration * 1e6:.1f}", tid])
@@ -0,0 +1,232 @@
+import time
+
+import cv2
+import numpy as np
+
+from HandTrackingModule import Hand
+
+HANDEDNESS = ("", "Left", "Right")
+
+
+class LandmarkRecorder:
+    """
+    Records what the hand tracking hands to the control logic: per frame
+    the capture timestamp, the hands (landmarks, bbox, handedness),
+    whether they were predicted instead of detected, and optionally a
+    downscaled copy of the frame. Saved as one .npz file that
+    ReplaySource plays back.
+
+    Landmarks take about 0.5 kB per frame. Frames at 160x90 add 43 kB
+    each, so keep them for short clips.
+    """
+
+    def __init__(self, path, maxHands=2, frameSize=None, screenSize=None):
+        """
+        :param path: Output .npz file
+        :param maxHands: Maximum hands stored per frame
+        :param frameSize: (width, height) the frames are downscaled to, None to store no frames
+        :param screenSize: Screen size used by the session, replays map the cursor onto it
+        """
+        self.path = path
+        self.maxHands = maxHands
+        self.frameSize = tuple(frameSize) if frameSize else None
+        self.screenSize = screenSize
+        self.frameShape = None
+        self.timestamps = []
+        self.landmarks = []
+        self.bboxes = []
+        self.handedness = []
+        self.predicted = []
+        self.frames = []
+
+    def add(self, timestamp, hands, predicted=False, img=None):
+        """
+        :param timestamp: Capture time of the frame
+        :param hands: Hand records (array mode) found or predicted on the frame
+        :param predicted: True if the hands were predicted instead of detected
+        :param img: Raw frame, stored downscaled when frames are recorded
+        """
+        landmarks = np.zeros((self.maxHands, 21, 3), np.int16)
+        bboxes = np.zeros((self.maxHands, 4), np.int16)
+        handedness = np.zeros(self.maxHands, np.int8)
+        for i, hand in enumerate(hands[:self.maxHands]):
+            landmarks[i] = hand.lmArray
+            bboxes[i] = hand.bbox
+            handedness[i] = HANDEDNESS.index(hand.type)
+        self.timestamps.append(timestamp)
+        self.landmarks.append(landmarks)
+        self.bboxes.append(bboxes)
+        self.handedness.append(handedness)
+        self.predicted.append(predicted)
+        if img is not None:
+            if self.frameShape is None:
+                self.frameShape = img.shape[:2]
+            if self.frameSize:
+                self.frames.append(cv2.resize(img, self.frameSize, interpolation=cv2.INTER_AREA))
+
+    def save(self):
+        """Write the recording to `path`"""
+        if not self.timestamps:
+            return
+        arrays = {
+            'timestamps': np.array(self.timestamps, np.float64),
+            'landmarks': np.stack(self.landmarks),
+            'bbox': np.stack(self.bboxes),
+            'handedness': np.stack(self.handedness),
+            'predicted': np.array(self.predicted, bool),
+            'frame_shape': np.array(self.frameShape or (0, 0), np.int32),
+            'screen_size': np.array(self.screenSize or (0, 0), np.int32)
+        }
+        if self.frames:
+            arrays['frames'] = np.stack(self.frames)
+            np.savez_compressed(self.path, **arrays)
+        else:
+            np.savez(self.path, **arrays)
+        print(f"Recorded {len(self.timestamps)} frames to {self.path}")
+
+
+class ReplaySource:
+    """
+    Plays a LandmarkRecorder recording back through the frame loop in
+    place of the camera. read() has the FrameGrabber interface, and the
+    recorded hands of the frame it returned are in `hands`. Frames come
+    from the recording (upscaled) or are blank at the recorded size.
+
+    Timestamps keep the recorded spacing, shifted to start now. In real
+    time mode read() waits for each frame's time; otherwise frames are
+    returned as fast as they are consumed.
+    """
+
+    def __init__(self, path, realtime=True):
+        """
+        :param path: Recording (.npz)
+        :param realtime: Play at the recorded speed instead of as fast as possible
+        """
+        data = np.load(path)
+        self.realtime = realtime
+        self.timestamps = data['timestamps']
+        self.landmarks = data['landmarks'].astype(np.int32)
+        self.bbox = data['bbox'].astype(np.int32)
+        self.handedness = data['handedness']
+        self.predictedFlags = data['predicted']
+        self.frames = data['frames'] if 'frames' in data else None
+        h, w = data['frame_shape'].tolist()
+        if not h and self.frames is not None:
+            h, w = self.frames.shape[1:3]
+        self.frameShape = (h or 720, w or 1280)
+        screen = data['screen_size'].tolist()
+        self.screenSize = tuple(screen) if screen[0] else None
+        self.img = np.zeros(self.frameShape + (3,), np.uint8)
+        self.index = 0
+        self.origin = None
+        self.started = None
+        self.hands = []
+        self.predicted = False
+        self.finished = len(self.timestamps) == 0
+
+    def setResolution(self, width, height):
+        """The recorded frame size is kept"""
+
+    def start(self):
+        self.started = time.time()
+        if len(self.timestamps):
+            self.origin = self.started - self.timestamps[0]
+        return self
+
+    def read(self, timeout=1.0):
+        """
+        Get the next recorded frame.
+        :return: success flag, image, timestamp
+        """
+        if self.index >= len(self.timestamps):
+            self.finished = True
+            return False, None, 0.0
+        if self.origin is None:
+            self.start()
+        i = self.index
+        self.index += 1
+        timestamp = self.origin + self.timestamps[i]
+        if self.realtime:
+            delay = timestamp - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+        self.hands = []
+        for j in range(len(self.handedness[i])):
+            if self.handedness[i, j]:
+                bbox = self.bbox[i, j]
+                self.hands.append(Hand(HANDEDNESS[self.handedness[i, j]], self.landmarks[i, j], bbox,
+                                       bbox[:2] + bbox[2:] // 2))
+        self.predicted = bool(self.predictedFlags[i])
+        if self.frames is not None:
+            cv2.resize(self.frames[i], self.frameShape[::-1], dst=self.img, interpolation=cv2.INTER_LINEAR)
+        return True, self.img, timestamp
+
+    def stats(self):
+        elapsed = time.time() - self.started if self.started else 0.0
+        return {
+            'frames': self.index,
+            'elapsed': elapsed,
+            'fps': self.index / elapsed if elapsed else 0.0
+        }
+
+    def stop(self):
+        stats = self.stats()
+        print(f"Replayed {stats['frames']}/{len(self.timestamps)} frames in {stats['elapsed']:.2f}s ({stats['fps']:.0f} fps)")
+
+
+class InputLog:
+    """
+    Stands in for autopy.mouse and the virtual keyboard during replays:
+    input is counted and logged instead of injected, so runs can be
+    compared.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.moves = 0
+        self.clicks = 0
+        self.keys = 0
+
+    def move(self, x, y):
+        self.moves += 1
+        self.events.append(('move', round(float(x), 1), round(float(y), 1)))
+
+    def click(self, button=None):
+        self.clicks += 1
+        self.events.append(('click', str(button) if button is not None else 'left'))
+
+    def key(self, text):
+        self.keys += 1
+        self.events.append(('key', text))
+
+    def summary(self):
+        return f"Input log: {self.moves} moves, {self.clicks} clicks, {self.keys} keys"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay a landmark recording through GestureControlApp")
+    parser.add_argument("path", help="Recording (.npz)")
+    parser.add_argument("--fast", action="store_true", help="Replay as fast as possible")
+    parser.add_argument("--show", action="store_true", help="Show the frames instead of running headless")
+    parser.add_argument("--mode", type=int, default=0, help="Start mode (0 mouse, 1 keyboard)")
+    parser.add_argument("--trace", action="store_true", help="Time the stages of the frame loop")
+    args = parser.parse_args()
+
+    # main reads the configuration on import
+    import config
+    config.headless = not args.show
+    config.trace_stages = args.trace
+    if args.fast:
+        # The cursor output thread runs on wall-clock time, move once per frame instead
+        config.cursor_output_rate = 0
+    from main import GestureControlApp
+
+    app = GestureControlApp(replay=ReplaySource(args.path, realtime=not args.fast))
+    app.current_mode = args.mode
+    app.run()
+    print(app.input_log.summary())
+    for algo, m in app.evaluator.get_metrics().items():
+        print(f"{algo}: Avg Err {m['avg_error']:.2f} | Max Err {m['max_error']:.2f} | Avg Jitter {m['avg_jitter']:.2f} | Max Jitter {m['max_jitter']:.2f}")
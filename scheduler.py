@@ -0,0 +1,128 @@
+import numpy as np
+
+from HandTrackingModule import Hand
+from algorithm_setting import KalmanFilterWrapper
+
+
+class DetectionScheduler:
+    """
+    Decides for each frame whether to run full landmark detection or to
+    reuse predicted landmarks. Detection runs every `interval` frames, and
+    earlier when the expected prediction error grows past `maxError`.
+    """
+
+    def __init__(self, interval=1, maxError=0):
+        """
+        :param interval: Run detection at least every `interval` frames (1 = every frame)
+        :param maxError: Detect as soon as the expected prediction error exceeds
+                         this many pixels (0 to disable)
+        """
+        self.interval = interval
+        self.maxError = maxError
+        self.framesSinceDetection = 0
+        self.detections = 0
+        self.predictions = 0
+
+    def shouldDetect(self, tracking, expectedError=0.0):
+        """
+        :param tracking: True if there are hands whose landmarks can be predicted
+        :param expectedError: Expected prediction error in pixels
+        :return: True if detection should run on this frame
+        """
+        if not tracking or self.framesSinceDetection + 1 >= self.interval:
+            return True
+        return bool(self.maxError) and expectedError > self.maxError
+
+    def detected(self):
+        """Mark the current frame as detected"""
+        self.framesSinceDetection = 0
+        self.detections += 1
+
+    def predicted(self):
+        """Mark the current frame as predicted"""
+        self.framesSinceDetection += 1
+        self.predictions += 1
+
+
+class LandmarkPredictor:
+    """
+    Predicts hand landmarks between detections. Each hand gets a
+    KalmanFilterWrapper on one anchor landmark (the index fingertip by
+    default) and the whole hand is translated with it, so finger states
+    and fingertip distances stay exactly as last detected. With capture
+    timestamps the filters step by the measured frame interval, so
+    dropped frames and camera rate changes are extrapolated correctly.
+    """
+
+    def __init__(self, dt=1/30.0, anchor=8):
+        """
+        :param dt: Nominal frame interval of the filters, used without timestamps
+        :param anchor: Landmark id the motion is estimated from
+        """
+        self.dt = dt
+        self.anchor = anchor
+        self.hands = []
+        self.filters = []
+        self.steps = 0
+        self.errorRate = 0.0
+
+    def update(self, hands, timestamp=None):
+        """
+        Feeds freshly detected hands (Hand records).
+        :param hands: List of Hand records
+        :param timestamp: Capture time of the frame they were detected in
+        """
+        types = [hand.type for hand in hands]
+        if types != [hand.type for hand in self.hands]:
+            # Different set of hands, start new tracks
+            self.filters = []
+            for hand in hands:
+                kf = KalmanFilterWrapper(dt=self.dt)
+                kf.kf.x[:2] = hand.lmArray[self.anchor, :2]
+                # The next step is timed from this detection
+                kf.clock.step(timestamp)
+                self.filters.append(kf)
+            self.errorRate = 0.0
+        else:
+            errors = []
+            for hand, kf in zip(hands, self.filters):
+                z = hand.lmArray[self.anchor, :2].astype(float)
+                kf.predict(timestamp)
+                errors.append(np.hypot(*(z - kf.get_state()[:2])))
+                kf.update(z)
+            if errors:
+                # Prediction error per frame since the previous detection
+                self.errorRate = max(errors) / (self.steps + 1)
+        self.hands = hands
+        self.steps = 0
+
+    def predict(self, timestamp=None):
+        """
+        Advances the filters to the next frame.
+        :param timestamp: Capture time of the frame, None for one nominal frame interval
+        :return: List of Hand records with predicted landmarks
+        """
+        self.steps += 1
+        predicted = []
+        for hand, kf in zip(self.hands, self.filters):
+            kf.predict(timestamp)
+            shift = np.rint(kf.get_state()[:2] - hand.lmArray[self.anchor, :2]).astype(np.int32)
+            lmArray = hand.lmArray.copy()
+            lmArray[:, :2] += shift.astype(lmArray.dtype)
+            bbox = hand.bbox.copy()
+            bbox[:2] += shift
+            predicted.append(Hand(hand.type, lmArray, bbox, hand.center + shift))
+        return predicted
+
+    def expectedError(self):
+        """
+        :return: Expected error in pixels of the next predicted frame
+        """
+        return self.errorRate * (self.steps + 1)
+
+    def reset(self):
+        """Forget all tracked hands"""
+        self.hands = []
+        self.filters = []
+        self.steps = 0
+        self.errorRate = 0.0
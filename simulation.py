@@ -1,57 +1,90 @@
 # Simulate gesture-controlled mouse and evaluate algorithms
+import csv
+import json
+import multiprocessing
+import os
+import time
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from algorithm_setting import LowPassFilter, ExtendedKalmanFilterWrapper, MovingAverageFilter, KalmanFilterWrapper, PerformanceEvaluator
+from algorithm_setting import FILTERS, make_filter
 
-# Generate simulation data at 30fps (600 frames = 20 seconds), simulating gesture acceleration and lighting effects
-def generate_simulation_data(num_points=300):  # Modified to 30fps
+# Generate noisy trajectories at 30fps, vectorized over runs (rows) and samples (columns),
+# simulating gesture acceleration, velocity-dependent noise, lighting effects and pauses
+def generate_trajectories(runs=1, num_points=300, seed=None, randomize=True, pause_length=15):
+    rng = np.random.default_rng(seed)
     t = np.linspace(0, 10, num_points)
-    
-    # Generate a non-linear trajectory (Lissajous curve) with acceleration information added
-    acceleration = 0.1 * np.sin(0.2 * t)  # Simulate acceleration
-    x_true = 100 * np.sin(0.5 * t) + 50 * np.cos(2.0 * t) + 0.5 * acceleration * t**2
-    y_true = 100 * np.cos(0.8 * t) + 50 * np.sin(1.2 * t) + 0.5 * acceleration * t**2
-    
+    if randomize:
+        # Vary the shape, speed and lighting of each run around the reference trajectory
+        amplitude = rng.uniform(0.7, 1.3, (runs, 2, 1))
+        speed = rng.uniform(0.7, 1.3, (runs, 1))
+        phase = rng.uniform(0, 2 * np.pi, (runs, 2, 1))
+        light_phase = rng.uniform(0, 2 * np.pi, (runs, 1))
+    else:
+        amplitude = np.ones((runs, 2, 1))
+        speed = np.ones((runs, 1))
+        phase = np.zeros((runs, 2, 1))
+        light_phase = np.zeros((runs, 1))
+
+    # Simulate pauses (gesture stops), 0.5 seconds each
+    if randomize:
+        pause_starts = rng.integers(0, max(num_points - pause_length, 1), (runs, 3))
+    else:
+        pause_starts = np.tile([80, 180, 250], (runs, 1))  # Pause frames at 30fps
+    # Pauses may run past the end, mark them on a padded mask and cut it
+    pause_mask = np.zeros((runs, max(num_points, pause_starts.max() + 1) + pause_length), dtype=bool)
+    pause_mask[np.arange(runs)[:, None, None], pause_starts[:, :, None] + np.arange(pause_length)] = True
+    pause_mask = pause_mask[:, :num_points]
+
+    # The hand stands still during a pause: the trajectory time only advances on moving frames
+    moving = ~pause_mask[:, 1:]
+    t_path = np.concatenate((np.zeros((runs, 1)), np.cumsum(moving * np.diff(t), axis=1)), axis=1)
+    ts = speed * t_path
+
+    # Non-linear trajectory (Lissajous curve) with acceleration information added
+    acceleration = 0.1 * np.sin(0.2 * ts)  # Simulate acceleration
+    drift = 0.5 * acceleration * ts**2
+    x_true = amplitude[:, 0] * (100 * np.sin(0.5 * ts + phase[:, 0]) + 50 * np.cos(2.0 * ts + phase[:, 1])) + drift
+    y_true = amplitude[:, 1] * (100 * np.cos(0.8 * ts + phase[:, 1]) + 50 * np.sin(1.2 * ts + phase[:, 0])) + drift
+
     # Dynamic noise (increases with velocity)
-    velocity = np.sqrt(np.diff(x_true)**2 + np.diff(y_true)**2)
-    velocity = np.append(velocity, velocity[-1])
+    velocity = np.hypot(np.diff(x_true, axis=1), np.diff(y_true, axis=1))
+    velocity = np.concatenate((velocity, velocity[:, -1:]), axis=1)
 
     # Simulate lighting changes
-    light_intensity = 0.7 + 0.3 * np.sin(0.3 * t)  # Light intensity varies between 0.4 and 1.0
+    light_intensity = 0.7 + 0.3 * np.sin(0.3 * t + light_phase)  # Light intensity varies between 0.4 and 1.0
     light_factor = np.clip(1.5 - light_intensity, 0.5, 1.5)  # More noise in low light
 
     noise_std = (1 + 0.1 * velocity) * light_factor
-    
-    # Simulate pauses (gesture stops)
-    pause_mask = np.zeros(num_points, dtype=bool)
-    pause_starts = [80, 180, 250]  # Pause frames at 30fps
-    for start in pause_starts:
-        pause_mask[start:start+15] = True  # 0.5-second pause
-    
-    x_noisy = x_true.copy()
-    y_noisy = y_true.copy()
-    for i in range(num_points):
-        if not pause_mask[i]:
-            x_noisy[i] += np.random.normal(0, noise_std[i])
-            y_noisy[i] += np.random.normal(0, noise_std[i])
-        else:
-            if i > 0:
-                x_noisy[i] = x_noisy[i-1]
-                y_noisy[i] = y_noisy[i-1]
-    
-    return x_noisy, y_noisy, light_intensity
+
+    noise = rng.standard_normal((2, runs, num_points)) * noise_std
+    noise[:, pause_mask] = 0
+    x_noisy = x_true + noise[0]
+    y_noisy = y_true + noise[1]
+    # During a pause the tracked landmarks hold the last value before it
+    hold = np.maximum.accumulate(np.where(pause_mask, 0, np.arange(num_points)), axis=1)
+    x_noisy = np.take_along_axis(x_noisy, hold, axis=1)
+    y_noisy = np.take_along_axis(y_noisy, hold, axis=1)
+
+    return x_true, y_true, x_noisy, y_noisy, light_intensity
+
+# Generate simulation data at 30fps (600 frames = 20 seconds), simulating gesture acceleration and lighting effects
+# Returns the true trajectory, the noisy measurements and the light intensity
+def generate_simulation_data(num_points=300, seed=None):  # Modified to 30fps
+    x_true, y_true, x_noisy, y_noisy, light_intensity = generate_trajectories(1, num_points, seed, randomize=False)
+    return x_true[0], y_true[0], x_noisy[0], y_noisy[0], light_intensity[0]
 
 # Simulate gesture control
-def simulate_gesture_control():
-    x_noisy, y_noisy, light_intensity = generate_simulation_data()
+def simulate_gesture_control(seed=None):
+    x_true, y_true, x_noisy, y_noisy, light_intensity = generate_simulation_data(seed=seed)
     evaluator = PerformanceEvaluator()
     
     # Initialize filters
     lowpass_filter_x = LowPassFilter()
     lowpass_filter_y = LowPassFilter()
     ekf = ExtendedKalmanFilterWrapper(dt=1/30.0)
-    moving_avg_filter_x = MovingAverageFilter()
-    moving_avg_filter_y = MovingAverageFilter()
+    moving_avg_filter = MovingAverageFilter()
     kf = KalmanFilterWrapper(dt=1/30.0)
 
     # Store trajectories
@@ -60,14 +93,19 @@ def simulate_gesture_control():
     moving_avg_x, moving_avg_y = [], []
     kf_x, kf_y = [], []
 
+    # The moving average has no state besides its window, filter the whole trajectory in one pass
+    moving_avg = moving_avg_filter.filter_many(np.column_stack((x_noisy, y_noisy)))
+
     for i in range(len(x_noisy)):
         x3, y3 = x_noisy[i], y_noisy[i]
+        timestamp = i / 30.0
+        truth = (x_true[i], y_true[i])
 
         # Low-pass filter
         lp_x = lowpass_filter_x.filter(x3)
         lp_y = lowpass_filter_y.filter(y3)
         lp_error = np.sqrt((lp_x - x3)**2 + (lp_y - y3)**2)
-        evaluator.record('lowpass', (lp_x, lp_y), lp_error)
+        evaluator.record('lowpass', (lp_x, lp_y), lp_error, timestamp, truth)
         lowpass_x.append(lp_x)
         lowpass_y.append(lp_y)
 
@@ -78,15 +116,14 @@ def simulate_gesture_control():
         ekf_state = ekf.get_state()
         ekf_x_val, ekf_y_val = ekf_state[0], ekf_state[1]
         ekf_error = np.sqrt((ekf_x_val - x3)**2 + (ekf_y_val - y3)**2)
-        evaluator.record('ekf', (ekf_x_val, ekf_y_val), ekf_error)
+        evaluator.record('ekf', (ekf_x_val, ekf_y_val), ekf_error, timestamp, truth)
         ekf_x.append(ekf_x_val)
         ekf_y.append(ekf_y_val)
 
         # Moving average
-        ma_x = moving_avg_filter_x.filter(x3)
-        ma_y = moving_avg_filter_y.filter(y3)
+        ma_x, ma_y = moving_avg[i]
         ma_error = np.sqrt((ma_x - x3)**2 + (ma_y - y3)**2)
-        evaluator.record('moving_avg', (ma_x, ma_y), ma_error)
+        evaluator.record('moving_avg', (ma_x, ma_y), ma_error, timestamp, truth)
         moving_avg_x.append(ma_x)
         moving_avg_y.append(ma_y)
 
@@ -97,11 +134,11 @@ def simulate_gesture_control():
         kf_state = kf.get_state()
         kf_x_val, kf_y_val = kf_state[0], kf_state[1]
         kf_error = np.sqrt((kf_x_val - x3)**2 + (kf_y_val - y3)**2)
-        evaluator.record('kf', (kf_x_val, kf_y_val), kf_error)
+        evaluator.record('kf', (kf_x_val, kf_y_val), kf_error, timestamp, truth)
         kf_x.append(kf_x_val)
         kf_y.append(kf_y_val)
 
-    return evaluator, x_noisy, y_noisy, lowpass_x, lowpass_y, ekf_x, ekf_y, moving_avg_x, moving_avg_y, kf_x, kf_y, light_intensity
+    return evaluator, x_true, y_true, x_noisy, y_noisy, lowpass_x, lowpass_y, ekf_x, ekf_y, moving_avg_x, moving_avg_y, kf_x, kf_y, light_intensity
 
 # Plot performance metrics
 def plot_metrics(evaluator):
@@ -115,7 +152,12 @@ def plot_metrics(evaluator):
     x = np.arange(len(algorithms))
     width = 0.2
 
-    fig, ax = plt.subplots()
+    # With ground truth, the true error and the time response get their own panels
+    has_truth = all('true_rmse' in metrics[algo] for algo in algorithms)
+    if has_truth:
+        fig, (ax, ax_true, ax_time) = plt.subplots(1, 3, figsize=(16, 5))
+    else:
+        fig, ax = plt.subplots()
     rects1 = ax.bar(x - 1.5 * width, avg_errors, width, label='Avg Error')
     rects2 = ax.bar(x - 0.5 * width, max_errors, width, label='Max Error')
     rects3 = ax.bar(x + 0.5 * width, avg_jitters, width, label='Avg Jitter')
@@ -127,7 +169,7 @@ def plot_metrics(evaluator):
     ax.set_xticklabels(algorithms)
     ax.legend()
 
-    def autolabel(rects):
+    def autolabel(ax, rects):
         for rect in rects:
             height = rect.get_height()
             ax.annotate('{:.2f}'.format(height),
@@ -136,17 +178,36 @@ def plot_metrics(evaluator):
                         textcoords="offset points",
                         ha='center', va='bottom')
 
-    autolabel(rects1)
-    autolabel(rects2)
-    autolabel(rects3)
-    autolabel(rects4)
+    autolabel(ax, rects1)
+    autolabel(ax, rects2)
+    autolabel(ax, rects3)
+    autolabel(ax, rects4)
+
+    if has_truth:
+        width = 0.3
+        rects5 = ax_true.bar(x - 0.5 * width, [metrics[algo]['true_rmse'] for algo in algorithms], width, label='True RMSE')
+        rects6 = ax_true.bar(x + 0.5 * width, [metrics[algo]['max_overshoot'] for algo in algorithms], width, label='Max Overshoot')
+        ax_true.set_ylabel('Pixels')
+        ax_true.set_title('Against Ground Truth')
+        rects7 = ax_time.bar(x - 0.5 * width, [metrics[algo]['lag_ms'] for algo in algorithms], width, label='Lag')
+        rects8 = ax_time.bar(x + 0.5 * width, [metrics[algo]['settle_ms'] for algo in algorithms], width, label='Settle Time')
+        ax_time.set_ylabel('Milliseconds')
+        ax_time.set_title('Time Response')
+        for axis, rects in ((ax_true, (rects5, rects6)), (ax_time, (rects7, rects8))):
+            axis.set_xticks(x)
+            axis.set_xticklabels(algorithms)
+            axis.legend()
+            for r in rects:
+                autolabel(axis, r)
 
     fig.tight_layout()
     plt.show()
 
 # Plot trajectory comparison
-def plot_trajectories(x_noisy, y_noisy, lowpass_x, lowpass_y, ekf_x, ekf_y, moving_avg_x, moving_avg_y, kf_x, kf_y):
+def plot_trajectories(x_noisy, y_noisy, lowpass_x, lowpass_y, ekf_x, ekf_y, moving_avg_x, moving_avg_y, kf_x, kf_y, x_true=None, y_true=None):
     plt.figure(figsize=(10, 6))
+    if x_true is not None:
+        plt.plot(x_true, y_true, label='True Path', color='black', linestyle='--', linewidth=1)
     plt.plot(x_noisy, y_noisy, label='Noisy Data', alpha=0.7)
     plt.plot(lowpass_x, lowpass_y, label='Lowpass Filter', alpha=0.7)
     # Explicitly specify the line color for the Extended Kalman Filter as purple
@@ -172,8 +233,139 @@ def plot_light_intensity(light_intensity):
     plt.grid(True)
     plt.show()
 
+# Metrics summarized over the runs of a benchmark
+BENCHMARK_METRICS = ('avg_error', 'max_error', 'avg_jitter', 'max_jitter', 'true_rmse', 'max_overshoot', 'lag_ms',
+                     'settle_ms', 'unsettled', 'cost_us')
+
+# Benchmark worker: filter a batch of seeded trajectories with every filter
+def run_benchmark_batch(task):
+    seed, first, runs, num_points, names, options = task
+    dt = 1 / 30.0
+    x_true, y_true, x_noisy, y_noisy, _ = generate_trajectories(runs, num_points, seed)
+    measurements = np.stack((x_noisy, y_noisy), axis=-1)
+    truths = np.stack((x_true, y_true), axis=-1)
+    timestamps = np.arange(num_points) * dt
+    rows = []
+    for run in range(runs):
+        z, truth = measurements[run], truths[run]
+        evaluator = PerformanceEvaluator(algos=names)
+        costs = {}
+        for name in names:
+            filt = make_filter(name, dt, **options.get(name, {}))
+            # Time the filter alone, the metrics are recorded afterwards
+            t0 = time.perf_counter()
+            positions = [filt.filter(z[i], timestamps[i]) for i in range(num_points)]
+            costs[name] = (time.perf_counter() - t0) / num_points * 1e6
+            positions = np.array(positions, np.float64)
+            errors = np.hypot(*(positions - z).T)
+            for i in range(num_points):
+                evaluator.record(name, positions[i], errors[i], timestamps[i], truth[i])
+        for name, m in evaluator.get_metrics().items():
+            row = {'run': first + run, 'algo': name}
+            row.update({metric: float(m[metric]) for metric in BENCHMARK_METRICS[:-1]})
+            row['cost_us'] = costs[name]
+            rows.append(row)
+    return rows
+
+# Monte Carlo benchmark: seeded trajectories in batches across a process pool
+def run_benchmark(runs=100, num_points=300, seed=0, workers=None, batch_size=10, names=None, options=None):
+    names = list(names or FILTERS)
+    options = options or {}
+    starts = range(0, runs, batch_size)
+    # One independent stream per batch, so the results do not depend on the worker count
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    tasks = [(s, first, min(batch_size, runs - first), num_points, names, options) for s, first in zip(seeds, starts)]
+    workers = max(1, min(workers or os.cpu_count(), len(tasks)))
+    t0 = time.perf_counter()
+    if workers == 1:
+        results = [run_benchmark_batch(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.map(run_benchmark_batch, tasks)
+    rows = [row for batch in results for row in batch]
+    info = {'runs': runs, 'num_points': num_points, 'seed': seed, 'workers': workers, 'batch_size': batch_size,
+            'filters': names, 'options': options, 'elapsed': time.perf_counter() - t0}
+    return rows, info
+
+# Mean, standard deviation and 95% confidence interval of the mean per algorithm and metric,
+# over the runs where the metric is defined (no settle time without pauses)
+def summarize_benchmark(rows):
+    summary = {}
+    for algo in dict.fromkeys(row['algo'] for row in rows):
+        values = {metric: np.array([row[metric] for row in rows if row['algo'] == algo]) for metric in BENCHMARK_METRICS}
+        summary[algo] = {}
+        for metric, v in values.items():
+            v = v[~np.isnan(v)]
+            mean = float(v.mean()) if len(v) else float('nan')
+            std = float(v.std(ddof=1)) if len(v) > 1 else 0.0
+            summary[algo][metric] = {'mean': mean, 'std': std, 'ci95': 1.96 * std / np.sqrt(max(len(v), 1))}
+    return summary
+
+# Write the per-run rows (CSV), the summary (JSON) and the plots (PNG) to a directory
+def write_benchmark(rows, info, summary, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, 'benchmark_runs.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(os.path.join(out_dir, 'benchmark_summary.json'), 'w') as f:
+        json.dump({'info': info, 'summary': summary}, f, indent=2)
+    plot_benchmark(summary, os.path.join(out_dir, 'benchmark.png'))
+
+# Plot the benchmark means with their 95% confidence intervals, without a display
+def plot_benchmark(summary, path):
+    algorithms = list(summary)
+    x = np.arange(len(algorithms))
+    panels = [
+        ('Algorithm Performance Metrics (95% CI)', 'Pixels',
+         ('avg_error', 'max_error', 'avg_jitter', 'max_jitter', 'true_rmse', 'max_overshoot')),
+        ('Time Response', 'Milliseconds', ('lag_ms', 'settle_ms')),
+        ('Filter Cost', 'Microseconds per sample', ('cost_us',))
+    ]
+    fig = Figure(figsize=(15, 5))
+    axes = fig.subplots(1, len(panels), gridspec_kw={'width_ratios': [3, 1.5, 1]})
+    for ax, (title, ylabel, names) in zip(axes, panels):
+        width = 0.8 / len(names)
+        for k, metric in enumerate(names):
+            means = [summary[algo][metric]['mean'] for algo in algorithms]
+            cis = [summary[algo][metric]['ci95'] for algo in algorithms]
+            ax.bar(x + (k - (len(names) - 1) / 2) * width, means, width, yerr=cis, capsize=3,
+                   label=metric.replace('_', ' ').replace(' ms', '').replace(' us', '').title())
+        ax.set_ylabel(ylabel)
+        ax.set_title(title)
+        ax.set_xticks(x)
+        ax.set_xticklabels(algorithms)
+        if len(names) > 1:
+            ax.legend()
+    fig.tight_layout()
+    fig.savefig(path, dpi=100)
+
 if __name__ == "__main__":
-    evaluator, x_noisy, y_noisy, lowpass_x, lowpass_y, ekf_x, ekf_y, moving_avg_x, moving_avg_y, kf_x, kf_y, light_intensity = simulate_gesture_control()
-    plot_metrics(evaluator)
-    plot_trajectories(x_noisy, y_noisy, lowpass_x, lowpass_y, ekf_x, ekf_y, moving_avg_x, moving_avg_y, kf_x, kf_y)
-    plot_light_intensity(light_intensity)
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulate gesture control and evaluate the filters")
+    parser.add_argument("--benchmark", action="store_true", help="Run the Monte Carlo benchmark instead of the interactive plots")
+    parser.add_argument("--runs", type=int, default=200, help="Benchmark trajectories")
+    parser.add_argument("--points", type=int, default=300, help="Samples per trajectory")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed, the benchmark defaults to 0")
+    parser.add_argument("--workers", type=int, default=None, help="Benchmark worker processes, defaults to all cores")
+    parser.add_argument("--batch", type=int, default=10, help="Trajectories per benchmark task")
+    parser.add_argument("--filters", nargs="+", default=None, help="Filters to benchmark, defaults to all")
+    parser.add_argument("--kf-steady-state", action="store_true", help="Let the Kalman filter switch to its steady-state gain")
+    parser.add_argument("--out", default="benchmark", help="Benchmark output directory")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        options = {'kf': {'steady_state': True}} if args.kf_steady_state else {}
+        rows, info = run_benchmark(args.runs, args.points, args.seed or 0, args.workers, args.batch, args.filters, options)
+        summary = summarize_benchmark(rows)
+        write_benchmark(rows, info, summary, args.out)
+        print(f"{info['runs']} runs x {info['num_points']} samples on {info['workers']} workers in {info['elapsed']:.1f}s")
+        for algo, s in summary.items():
+            print(f"{algo}: " + " | ".join(f"{metric} {s[metric]['mean']:.2f} ± {s[metric]['ci95']:.2f}" for metric in BENCHMARK_METRICS))
+        print(f"Results written to {args.out}")
+    else:
+        evaluator, x_true, y_true, x_noisy, y_noisy, lowpass_x, lowpass_y, ekf_x, ekf_y, moving_avg_x, moving_avg_y, kf_x, kf_y, light_intensity = simulate_gesture_control(args.seed)
+        plot_metrics(evaluator)
+        plot_trajectories(x_noisy, y_noisy, lowpass_x, lowpass_y, ekf_x, ekf_y, moving_avg_x, moving_avg_y, kf_x, kf_y, x_true, y_true)
+        plot_light_intensity(light_intensity)
@@ -0,0 +1,51 @@
+import types
+
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip("mediapipe")
+
+import extract
+from recording import HANDEDNESS
+
+
+def write_video(path, frames=6, size=(160, 120)):
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 30.0, size)
+    for i in range(frames):
+        writer.write(np.full((size[1], size[0], 3), 20 * i, np.uint8))
+    writer.release()
+    return frames
+
+
+def model_result(label):
+    # One hand on the left half of the camera image, labeled by the model as seen by the camera
+    landmarks = [types.SimpleNamespace(x=0.2 + 0.005 * i, y=0.5, z=0.0) for i in range(21)]
+    return types.SimpleNamespace(
+        multi_hand_landmarks=[types.SimpleNamespace(landmark=landmarks)],
+        multi_handedness=[types.SimpleNamespace(classification=[types.SimpleNamespace(label=label)])])
+
+
+def extract_video(tmp_path, mirror, label="Right"):
+    video = tmp_path / "clip.avi"
+    frames = write_video(video)
+    extract.init_worker({'maxHands': 1}, mirror)
+    extract._detector.detect = lambda img, timestamp=None: model_result(label)
+    prefix = str(tmp_path / "clip.00000000")
+    _, done, _ = extract.extract_chunk((str(video), 0, frames, 30.0, prefix, 0))
+    assert done == frames
+    return np.load(prefix + ".handedness.npy"), np.load(prefix + ".landmarks.npy")
+
+
+def test_mirror_swaps_handedness(tmp_path):
+    # Camera footage is mirrored like the live app, which sees a right hand as the user's left
+    handedness, landmarks = extract_video(tmp_path, mirror=True)
+    assert set(handedness[:, 0]) == {HANDEDNESS.index("Left")}
+    assert (landmarks[:, 0, 0, 0] > 80).all()
+
+
+def test_no_mirror_keeps_handedness(tmp_path):
+    # Already mirrored footage is taken as is, labels and coordinates unchanged
+    handedness, landmarks = extract_video(tmp_path, mirror=False)
+    assert set(handedness[:, 0]) == {HANDEDNESS.index("Right")}
+    assert (landmarks[:, 0, 0, 0] < 80).all()
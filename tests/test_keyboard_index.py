@@ -0,0 +1,52 @@
+import numpy as np
+
+from button import Button
+from keyboardConfig import KeyboardIndex
+
+
+def numpad():
+    # 3x2 block of 70x70 keys with a 70x155 "+" key spanning both rows on the right
+    buttons = []
+    for row, keys in enumerate((("7", "8", "9"), ("4", "5", "6"))):
+        for col, key in enumerate(keys):
+            buttons.append(Button([col * 85, row * 85], key, [70, 70]))
+    buttons.append(Button([255, 0], "+", [70, 155]))
+    return buttons
+
+
+def brute_force(buttons, point):
+    x, y = point
+    for b in buttons:
+        if b.pos[0] < x < b.pos[0] + b.size[0] and b.pos[1] < y < b.pos[1] + b.size[1]:
+            return b
+    return None
+
+
+def test_mixed_heights():
+    buttons = numpad()
+    index = KeyboardIndex(buttons)
+    assert index.hit((35, 35)).text == "7"
+    assert index.hit((35, 120)).text == "4"
+    assert index.hit((205, 120)).text == "6"
+    assert index.hit((290, 10)).text == "+"
+    assert index.hit((290, 150)).text == "+"
+    # Gap between the rows, under the tall key's row span
+    assert index.hit((35, 77)) is None
+
+
+def test_matches_per_button_check():
+    buttons = numpad()
+    index = KeyboardIndex(buttons)
+    xs, ys = np.meshgrid(np.arange(-5, 335), np.arange(-5, 165))
+    points = np.column_stack((xs.ravel(), ys.ravel()))
+    found = index.query(points)
+    for point, i in zip(points, found):
+        expected = brute_force(buttons, point)
+        assert (buttons[i] if i >= 0 else None) is expected
+        assert index.hit(point) is expected
+
+
+def test_empty_layout():
+    index = KeyboardIndex([])
+    assert index.hit((10, 10)) is None
+    assert index.query([(10, 10)]).tolist() == [-1]
@@ -0,0 +1,375 @@
+"""
+Parameter tuner for the smoothing filters.
+
+Searches the parameters of each filter (grid or random search) on
+simulated trajectories from simulation.py and on recorded sessions
+(recording.py / extract.py .npz files). Candidates are scored by error,
+jitter and lag (recordings have no ground truth and only count towards
+jitter and lag) and stopped early by successive halving: every round the
+candidates run on more trajectories and only the best third by the
+weighted objective go on to the next round. Rounds run on a process
+pool.
+
+The best candidate of each filter is written as a profile that
+GestureControlApp loads through config.filter_profile, together with
+the Pareto front of the three metrics for picking another trade-off.
+Candidates that were stopped early but are not dominated on the runs
+they got are run on the rest of the data, so the whole front is compared
+on the full data set.
+
+    python tuner.py sessions/*.npz --search random --samples 60 -o filter_profile.json
+"""
+import argparse
+import contextlib
+import inspect
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from algorithm_setting import FILTERS, make_filter, estimate_lag
+from simulation import generate_trajectories
+
+# Search space per filter: parameter -> (low, high, scale), scale 'lin', 'log' or 'int'.
+# The EKF noise parameters scale its default diagonals.
+SEARCH_SPACES = {
+    'lowpass': {'alpha': (0.05, 0.95, 'lin')},
+    'moving_avg': {'window_size': (1, 15, 'int')},
+    'kf': {'Q': (1e-3, 1e3, 'log'), 'R': (1e-2, 1e3, 'log'), 'P': (1, 1e4, 'log')},
+    'ekf': {'q_scale': (1e-2, 1e3, 'log'), 'R': (1e-2, 1e3, 'log'), 'p_scale': (0.1, 100, 'log')}
+}
+
+# Names of the metrics, all minimized
+METRICS = ('error', 'jitter', 'lag_ms')
+
+# Samples skipped at the start of every trajectory while the filters initialize
+WARMUP = 10
+
+# Per-process data set, created by init_worker
+_dataset = None
+
+
+def filter_options(name, params):
+    """
+    :return: make_filter options for a candidate's parameters
+    """
+    if name == 'ekf':
+        defaults = inspect.signature(FILTERS['ekf']).parameters
+        return {
+            'P': [round(p * params['p_scale'], 6) for p in defaults['P'].default],
+            'Q': [round(q * params['q_scale'], 6) for q in defaults['Q'].default],
+            'R': params['R']
+        }
+    return dict(params)
+
+
+def _axis_values(low, high, scale, points):
+    if scale == 'int':
+        return sorted(set(np.linspace(low, high, points).round().astype(int).tolist()))
+    if scale == 'log':
+        return np.geomspace(low, high, points).tolist()
+    return np.linspace(low, high, points).tolist()
+
+
+def grid_candidates(space, points):
+    """
+    :param points: Values per parameter
+    :return: List of parameter dicts covering the grid
+    """
+    candidates = [{}]
+    for param, (low, high, scale) in space.items():
+        candidates = [dict(c, **{param: v}) for c in candidates for v in _axis_values(low, high, scale, points)]
+    return candidates
+
+
+def random_candidates(space, count, rng):
+    """
+    :param count: Number of candidates
+    :param rng: numpy Generator
+    :return: List of parameter dicts sampled from the space
+    """
+    candidates = []
+    for _ in range(count):
+        params = {}
+        for param, (low, high, scale) in space.items():
+            if scale == 'int':
+                params[param] = int(rng.integers(low, high + 1))
+            elif scale == 'log':
+                params[param] = float(np.exp(rng.uniform(np.log(low), np.log(high))))
+            else:
+                params[param] = float(rng.uniform(low, high))
+        candidates.append(params)
+    return candidates
+
+
+def simulated_runs(runs, num_points, seed):
+    """
+    :return: List of (timestamps, measurements, reference) with the true path as reference
+    """
+    x_true, y_true, x_noisy, y_noisy, _ = generate_trajectories(runs, num_points, seed)
+    timestamps = np.arange(num_points) / 30.0
+    return [(timestamps, np.column_stack((x_noisy[i], y_noisy[i])), np.column_stack((x_true[i], y_true[i])))
+            for i in range(runs)]
+
+
+def recorded_runs(path, min_length=60, max_gap=0.2):
+    """
+    Index fingertip paths of a recording, mapped to the screen the way the
+    mouse mode maps them. Every stretch of detected frames without a gap
+    is one run. There is no truth to measure the error against, so the
+    reference is None.
+    :return: List of (timestamps, measurements, None)
+    """
+    data = np.load(path)
+    timestamps = data['timestamps']
+    present = (data['handedness'][:, 0] > 0) & ~data['predicted']
+    h, w = data['frame_shape'].tolist()
+    h, w = h or 720, w or 1280
+    screen = data['screen_size'].tolist()
+    wScr, hScr = screen if screen[0] else (1920, 1080)
+    tip = data['landmarks'][:, 0, 8, :2].astype(np.float64)
+    points = np.column_stack((np.interp(tip[:, 0], (0.2 * w, 0.8 * w), (0, wScr)),
+                              np.interp(tip[:, 1], (0.2 * h, 0.8 * h), (0, hScr))))
+
+    runs = []
+    index = np.flatnonzero(present)
+    if not len(index):
+        return runs
+    breaks = np.flatnonzero((np.diff(index) > 1) | (np.diff(timestamps[index]) > max_gap)) + 1
+    for segment in np.split(index, breaks):
+        if len(segment) >= min_length:
+            runs.append((timestamps[segment] - timestamps[segment[0]], points[segment], None))
+    return runs
+
+
+def init_worker(sources):
+    """Pool initializer, builds the data set once per worker process"""
+    global _dataset
+    _dataset = load_dataset(sources)
+
+
+def load_dataset(sources):
+    """
+    :param sources: Dict with 'simulated' (runs, num_points, seed) and 'recordings' (paths)
+    :return: Runs of all sources, interleaved so every prefix mixes the sources
+    """
+    groups = []
+    if sources.get('simulated'):
+        groups.append(simulated_runs(*sources['simulated']))
+    recorded = [run for path in sources.get('recordings', []) for run in recorded_runs(path)]
+    if recorded:
+        groups.append(recorded)
+    dataset = []
+    for i in range(max((len(g) for g in groups), default=0)):
+        dataset.extend(g[i] for g in groups if i < len(g))
+    return dataset
+
+
+def evaluate_run(name, options, run):
+    """
+    Filter one run.
+    :return: Error (RMSE against the reference, NaN without one), jitter (RMS second difference of the output)
+        and lag (ms, behind the reference or else the measurements)
+    """
+    timestamps, measurements, reference = run
+    filt = make_filter(name, **options)
+    out = np.array([filt.filter(measurements[i], timestamps[i]) for i in range(len(measurements))], np.float64)
+    out = out[WARMUP:]
+    dt = float(np.median(np.diff(timestamps)))
+    if reference is None:
+        error = np.nan
+        reference = measurements[WARMUP:]
+    else:
+        reference = reference[WARMUP:]
+        error = np.sqrt(np.mean(np.sum((out - reference) ** 2, axis=1)))
+    jitter = np.sqrt(np.mean(np.sum(np.diff(out, 2, axis=0) ** 2, axis=1)))
+    # A causal filter cannot lead, a negative estimate is noise (e.g. a hand held still)
+    lag = max(estimate_lag(reference, out, dt), 0.0) * 1000
+    return error, jitter, lag
+
+
+def evaluate_candidate(task):
+    """
+    Worker: evaluate a candidate on a range of runs.
+    :return: Candidate id and an (n, 3) array of the run metrics
+    """
+    cid, name, options, first, last = task
+    # Filter messages such as the Kalman steady-state switch would repeat for every run
+    with contextlib.redirect_stdout(None):
+        metrics = [evaluate_run(name, options, _dataset[i]) for i in range(first, last)]
+    return cid, np.array(metrics).reshape(-1, 3)
+
+
+def pareto_front(points):
+    """
+    :param points: (n, k) array of metrics, all minimized, NaN metrics are not compared
+    :return: Indices of the points no other point dominates
+    """
+    points = np.nan_to_num(np.asarray(points, np.float64))
+    front = []
+    for i, p in enumerate(points):
+        dominated = np.any(np.all(points <= p, axis=1) & np.any(points < p, axis=1))
+        if not dominated:
+            front.append(i)
+    return front
+
+
+def _run_candidates(name, results, cids, pool, budget):
+    """Evaluate the candidates on the runs they have not seen up to `budget` and update their means"""
+    tasks = [(cid, name, results[cid]['options'], len(results[cid]['metrics']), budget) for cid in cids
+             if len(results[cid]['metrics']) < budget]
+    for cid, metrics in pool.imap_unordered(evaluate_candidate, tasks):
+        results[cid]['metrics'] = np.vstack((results[cid]['metrics'], metrics))
+    for cid in cids:
+        results[cid].update(mean=_mean(results[cid]['metrics']), runs=len(results[cid]['metrics']))
+
+
+def _mean(metrics):
+    """Mean metrics of a candidate, the error over the runs with a reference (NaN if none has one)"""
+    mean = metrics.mean(axis=0)
+    errors = metrics[~np.isnan(metrics[:, 0]), 0]
+    mean[0] = errors.mean() if len(errors) else np.nan
+    return mean
+
+
+def _objective(mean, weights):
+    return float(np.nan_to_num(mean) @ weights)
+
+
+def tune_filter(name, candidates, pool, num_runs, weights, min_runs=5, eta=3, fixed=None):
+    """
+    Successive halving over the candidates of one filter.
+    :param candidates: Parameter dicts
+    :param pool: Process pool with the data set loaded
+    :param num_runs: Runs in the data set
+    :param weights: Objective weights of the metrics
+    :param min_runs: Runs of the first round
+    :param eta: Factor the runs grow and the candidates shrink by per round
+    :param fixed: make_filter options every candidate runs with, written to the profile with the tuned ones
+    :return: Result per candidate (params, options, mean metrics, objective, runs) and the ids of the final round
+    """
+    weights = np.asarray(weights, np.float64)
+    results = [{'params': params, 'options': dict(filter_options(name, params), **(fixed or {})),
+                'metrics': np.empty((0, 3))} for params in candidates]
+    alive = list(range(len(candidates)))
+    budget = min(min_runs, num_runs)
+    rnd = 0
+    while True:
+        rnd += 1
+        _run_candidates(name, results, alive, pool, budget)
+        objectives = np.array([_objective(results[cid]['mean'], weights) for cid in alive])
+        for cid, obj in zip(alive, objectives):
+            results[cid]['objective'] = float(obj)
+        best = alive[int(np.argmin(objectives))]
+        print(f"{name}: round {rnd}, {len(alive)} candidates on {budget} runs, "
+              f"best objective {results[best]['objective']:.2f} with {results[best]['params']}")
+        if budget >= num_runs or len(alive) == 1:
+            return results, alive
+        keep = np.argsort(objectives)[:max(1, int(np.ceil(len(alive) / eta)))]
+        alive = [alive[i] for i in sorted(keep)]
+        budget = min(budget * eta, num_runs)
+
+
+def full_front(name, results, final, pool, num_runs, weights):
+    """
+    Pareto front on the full data set. Candidates not dominated on the runs
+    they got, and the final round, are run on the remaining runs first.
+    :return: Ids of the front, all evaluated on every run
+    """
+    cids = sorted(set(pareto_front([result['mean'] for result in results])) | set(final))
+    _run_candidates(name, results, cids, pool, num_runs)
+    for cid in cids:
+        results[cid]['objective'] = _objective(results[cid]['mean'], np.asarray(weights, np.float64))
+    return [cids[i] for i in pareto_front([results[cid]['mean'] for cid in cids])]
+
+
+def _summary(result):
+    mean = result['mean']
+    return {
+        'params': result['params'],
+        'options': result['options'],
+        'error': float(mean[0]),
+        'jitter': float(mean[1]),
+        'lag_ms': float(mean[2]),
+        'objective': result['objective'],
+        'runs': result['runs']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune the smoothing filter parameters")
+    parser.add_argument("recordings", nargs="*", help="Recorded sessions (.npz) to tune on besides the simulation")
+    parser.add_argument("-o", "--out", default="filter_profile.json", help="Profile file")
+    parser.add_argument("--filters", nargs="+", default=list(SEARCH_SPACES), help="Filters to tune")
+    parser.add_argument("--search", choices=("grid", "random"), default="grid", help="Search strategy")
+    parser.add_argument("--grid-points", type=int, default=5, help="Grid values per parameter")
+    parser.add_argument("--samples", type=int, default=40, help="Random search candidates per filter")
+    parser.add_argument("--runs", type=int, default=45, help="Simulated trajectories, 0 for recordings only")
+    parser.add_argument("--length", type=int, default=300, help="Samples per simulated trajectory")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--weights", type=float, nargs=3, default=(1.0, 1.0, 0.1), metavar=("ERROR", "JITTER", "LAG"),
+                        help="Objective weights of error (px), jitter (px) and lag (ms)")
+    parser.add_argument("--min-runs", type=int, default=5, help="Runs of the first successive halving round")
+    parser.add_argument("--eta", type=int, default=3, help="Successive halving factor")
+    parser.add_argument("--kf-steady-state", action=argparse.BooleanOptionalAction, default=True,
+                        help="Tune the Kalman filter with the steady-state gain switch, as config.kf_steady_state")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes")
+    args = parser.parse_args()
+
+    sources = {'simulated': (args.runs, args.length, args.seed) if args.runs else None,
+               'recordings': args.recordings}
+    num_runs = len(load_dataset(sources))
+    if not num_runs:
+        parser.error("No trajectories to tune on")
+    print(f"Tuning {', '.join(args.filters)} on {num_runs} runs with {args.workers} workers")
+    if args.recordings:
+        print("Recordings have no ground truth, they are scored on jitter and lag only"
+              + ("" if args.runs else ", the error is not scored"))
+
+    rng = np.random.default_rng(args.seed)
+    # Options the app applies on top of the profile, the candidates are scored with them
+    fixed = {'kf': {'steady_state': args.kf_steady_state}}
+    profile = {'filters': {}, 'results': {}}
+    t0 = time.perf_counter()
+    with multiprocessing.Pool(args.workers, initializer=init_worker, initargs=(sources,)) as pool:
+        for name in args.filters:
+            space = SEARCH_SPACES[name]
+            if args.search == 'grid':
+                candidates = grid_candidates(space, args.grid_points)
+            else:
+                candidates = random_candidates(space, args.samples, rng)
+            results, final = tune_filter(name, candidates, pool, num_runs, args.weights, args.min_runs, args.eta,
+                                          fixed.get(name))
+            front = full_front(name, results, final, pool, num_runs, args.weights)
+            # Every front member and the final round are scored on the full data, the best may come from either
+            best = min(set(front) | set(final), key=lambda cid: results[cid]['objective'])
+            profile['filters'][name] = results[best]['options']
+            profile['results'][name] = {
+                'best': _summary(results[best]),
+                'pareto': sorted((_summary(results[cid]) for cid in front), key=lambda s: s['objective']),
+                'candidates': len(candidates),
+                'stopped_early': len(candidates) - len(final)
+            }
+
+    profile['recommended_filter'] = min(profile['results'], key=lambda n: profile['results'][n]['best']['objective'])
+    profile['objective'] = dict(zip(METRICS, args.weights))
+    profile['data'] = {'runs': num_runs, 'simulated': sources['simulated'], 'recordings': args.recordings}
+    with open(args.out, 'w') as f:
+        json.dump(profile, f, indent=2)
+
+    print(f"Tuned in {time.perf_counter() - t0:.1f}s")
+    for name, result in profile['results'].items():
+        print(f"{name}: {result['candidates']} candidates, {result['stopped_early']} stopped early, "
+              f"{len(result['pareto'])} on the Pareto front")
+        for s in result['pareto'][:10]:
+            marker = '*' if s['params'] == result['best']['params'] else ' '
+            print(f"  {marker} error {s['error']:.2f} | jitter {s['jitter']:.2f} | lag {s['lag_ms']:.1f} ms | "
+                  f"objective {s['objective']:.2f} | {s['params']}")
+    print(f"Recommended filter: {profile['recommended_filter']}")
+    print(f"Profile written to {args.out}, set filter_profile in config.py to use it")
+
+
+if __name__ == "__main__":
+    main()